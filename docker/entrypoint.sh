@@ -46,9 +46,13 @@ esac
 # This function tries to upgrade the login database schema with
 # exponential backoff. This is necessary during development, because
 # the database might not be running yet when this script executes.
+# Also, in order to not block user logins, migrations give up when
+# they can not quickly acquire a table lock (see "migrations/env.py"),
+# and must be retried later. Migrations which have succeeded are not
+# retried.
 perform_db_upgrade() {
     local retry_after=1
-    local time_limit=$(($retry_after << 5))
+    local time_limit=$(($retry_after << 7))
     local error_file="$APP_ROOT_DIR/flask-db-upgrade.error"
     echo -n 'Running login database schema upgrade ...'
     while [[ $retry_after -lt $time_limit ]]; do
@@ -92,9 +96,10 @@ case $1 in
         fi
         exec gunicorn --config "$APP_ROOT_DIR/gunicorn.conf.py" -b :$WEBSERVER_PORT wsgi:app
         ;;
-    flush_activate_users  | flush_deactivate_users | flush_all)
+    flush_activate_users  | flush_deactivate_users | flush_emails | flush_all)
         flush_activate_users=ActivateUserSignal
         flush_deactivate_users=DeactivateUserSignal
+        flush_emails=EmailSignal
         flush_all=
 
         # For example: if `$1` is "flush_activate_users",
@@ -104,6 +109,10 @@ case $1 in
         shift
         exec flask swpt_login flush $signal_name "$@"
         ;;
+    maintain_user_id_pool)
+        shift
+        exec flask swpt_login maintain_user_id_pool "$@"
+        ;;
     await_migrations)
         echo Awaiting database migrations to be applied...
         while ! flask db current 2> /dev/null | grep '(head)'; do
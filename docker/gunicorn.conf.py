@@ -4,6 +4,13 @@ accesslog = "-" if os.getenv("APP_LOG_LEVEL") == "debug" else None
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s %(D)s "%({X-Logging-Context}o)s" "%(f)s" "%(a)s"'
 disable_redirect_access_to_syslog = True
 
+
+def post_worker_init(worker):
+    from swpt_login.db_pool import warm_up_pools
+
+    warm_up_pools(worker.wsgi)
+
+
 for k, v in os.environ.items():
     if k.startswith("GUNICORN_"):
         key = k.split('_', 1)[1].lower()
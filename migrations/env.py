@@ -1,6 +1,6 @@
 from __future__ import with_statement
 from alembic import context
-from sqlalchemy import engine_from_config, pool
+from sqlalchemy import engine_from_config, pool, text
 from logging.config import fileConfig
 import logging
 
@@ -70,9 +70,22 @@ def run_migrations_online():
                                 poolclass=pool.NullPool)
 
     connection = engine.connect()
+
+    # When a migration waits for a lock (for example, because a long
+    # query is running on the table), all queries which come after it
+    # would wait too, and logins would get blocked. With a short lock
+    # timeout, the migration fails instead, and is retried later (see
+    # `perform_db_upgrade` in "docker/entrypoint.sh"). Each migration
+    # runs in its own transaction, so that the migrations which have
+    # succeeded are not retried.
+    lock_timeout = current_app.config['APP_MIGRATION_LOCK_TIMEOUT_SECONDS']
+    connection.execute(text(f"SET lock_timeout = '{int(lock_timeout * 1000)}ms'"))
+    connection.commit()
+
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      transaction_per_migration=True,
                       **current_app.extensions['migrate'].configure_args)
     
     try:
@@ -0,0 +1,63 @@
+"""binary hashes
+
+Revision ID: 3f6a0c9d2b71
+Revises: 9d4b1e7a6c52
+Create Date: 2026-10-19 09:12:37.804412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from swpt_login.migration_helpers import backfill_in_batches
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a0c9d2b71'
+down_revision = '9d4b1e7a6c52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: Adding nullable columns, and dropping NOT NULL
+    # constraints, changes only the table metadata. The existing
+    # values are converted to binary form with the
+    # `swpt_login convert_user_hashes` command. The credentials
+    # covering index is replaced by the next revision, because
+    # indexes are created concurrently (outside of the transaction).
+    with op.batch_alter_table('user_registration', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('salt_bin', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('password_hash_bin', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('recovery_code_hash_bin', sa.LargeBinary(), nullable=True))
+        batch_op.alter_column('salt', existing_type=sa.String(length=32), nullable=True)
+        batch_op.alter_column('password_hash', existing_type=sa.String(length=128), nullable=True)
+        batch_op.alter_column('recovery_code_hash', existing_type=sa.String(length=128), nullable=True)
+
+
+def downgrade():
+    # The binary values must be converted back to Base64 encoded
+    # values before the binary columns are dropped. The conversion is
+    # committed in batches, and can safely be repeated if the
+    # downgrade fails later.
+    backfill_in_batches(
+        "WITH batch AS ("
+        " SELECT email FROM user_registration"
+        " WHERE email > :last_key ORDER BY email LIMIT :batch_size"
+        "), updated AS ("
+        " UPDATE user_registration u SET"
+        " salt = coalesce(encode(u.salt_bin, 'base64'), u.salt),"
+        " password_hash = coalesce(encode(u.password_hash_bin, 'base64'), u.password_hash),"
+        " recovery_code_hash = coalesce(encode(u.recovery_code_hash_bin, 'base64'), u.recovery_code_hash),"
+        " salt_bin = NULL, password_hash_bin = NULL, recovery_code_hash_bin = NULL"
+        " FROM batch b"
+        " WHERE u.email = b.email"
+        " AND (u.password_hash_bin IS NOT NULL OR u.recovery_code_hash_bin IS NOT NULL)"
+        ") "
+        "SELECT max(email), count(*) FROM batch"
+    )
+    with op.batch_alter_table('user_registration', schema=None) as batch_op:
+        batch_op.alter_column('recovery_code_hash', existing_type=sa.String(length=128), nullable=False)
+        batch_op.alter_column('password_hash', existing_type=sa.String(length=128), nullable=False)
+        batch_op.alter_column('salt', existing_type=sa.String(length=32), nullable=False)
+        batch_op.drop_column('recovery_code_hash_bin')
+        batch_op.drop_column('password_hash_bin')
+        batch_op.drop_column('salt_bin')
@@ -0,0 +1,41 @@
+"""signal retries
+
+Revision ID: 5a8e3d1f0c27
+Revises: dfb07c0fddc7
+Create Date: 2026-10-18 14:21:07.503112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a8e3d1f0c27'
+down_revision = 'dfb07c0fddc7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ['activate_user_signal', 'deactivate_user_signal']:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default=sa.text('0')))
+            batch_op.add_column(sa.Column('next_attempt_at', sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.text('now()')))
+            batch_op.add_column(sa.Column('dead_at', sa.TIMESTAMP(timezone=True), nullable=True))
+            batch_op.add_column(sa.Column('last_error', sa.Text(), nullable=True))
+            batch_op.create_index(f'idx_{table_name}_next_attempt_at', ['next_attempt_at'], unique=False, postgresql_where=sa.text('dead_at IS NULL'))
+
+        # The server defaults are needed only for the existing rows.
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column('attempts', server_default=None)
+            batch_op.alter_column('next_attempt_at', server_default=None)
+
+
+def downgrade():
+    for table_name in ['activate_user_signal', 'deactivate_user_signal']:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_index(f'idx_{table_name}_next_attempt_at', postgresql_where=sa.text('dead_at IS NULL'))
+            batch_op.drop_column('last_error')
+            batch_op.drop_column('dead_at')
+            batch_op.drop_column('next_attempt_at')
+            batch_op.drop_column('attempts')
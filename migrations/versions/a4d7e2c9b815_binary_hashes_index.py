@@ -0,0 +1,48 @@
+"""binary hashes index
+
+Revision ID: a4d7e2c9b815
+Revises: 3f6a0c9d2b71
+Create Date: 2026-10-19 09:14:02.118356
+
+"""
+from swpt_login.migration_helpers import (
+    create_index_concurrently,
+    drop_index_concurrently,
+    execute_with_retry,
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e2c9b815'
+down_revision = '3f6a0c9d2b71'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'idx_user_registration_credentials'
+NEW_INDEX_NAME = 'idx_user_registration_credentials_new'
+
+
+def _replace_credentials_index(include):
+    # The new index is created concurrently, so that the table does
+    # not get locked for writes. Then the old index is dropped, and
+    # the new index gets the old index's name. Every step can safely
+    # be repeated, so that a failed migration can be retried.
+    create_index_concurrently(
+        NEW_INDEX_NAME,
+        'user_registration',
+        ['email'],
+        unique=False,
+        postgresql_include=include,
+    )
+    drop_index_concurrently(INDEX_NAME, 'user_registration')
+    execute_with_retry(f'ALTER INDEX IF EXISTS {NEW_INDEX_NAME} RENAME TO {INDEX_NAME}')
+
+
+def upgrade():
+    _replace_credentials_index(
+        ['user_id', 'salt', 'password_hash', 'salt_bin', 'password_hash_bin', 'status'],
+    )
+
+
+def downgrade():
+    _replace_credentials_index(['user_id', 'salt', 'password_hash', 'status'])
@@ -0,0 +1,33 @@
+"""credentials covering index
+
+Revision ID: b83f2c6d9e41
+Revises: 5a8e3d1f0c27
+Create Date: 2026-10-18 16:03:44.215870
+
+"""
+from swpt_login.migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83f2c6d9e41'
+down_revision = '5a8e3d1f0c27'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'idx_user_registration_credentials'
+
+
+def upgrade():
+    # The index is created concurrently, so that the table does not
+    # get locked for writes.
+    create_index_concurrently(
+        INDEX_NAME,
+        'user_registration',
+        ['email'],
+        unique=False,
+        postgresql_include=['user_id', 'salt', 'password_hash', 'status'],
+    )
+
+
+def downgrade():
+    drop_index_concurrently(INDEX_NAME, 'user_registration')
@@ -0,0 +1,38 @@
+"""signal inserted_at indexes
+
+Revision ID: c5e1f8a2d943
+Revises: 7c2e9a4f1b58
+Create Date: 2026-10-19 18:05:31.640218
+
+"""
+import sqlalchemy as sa
+from swpt_login.migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f8a2d943'
+down_revision = '7c2e9a4f1b58'
+branch_labels = None
+depends_on = None
+
+TABLES = ['activate_user_signal', 'deactivate_user_signal', 'email_signal']
+
+
+def upgrade():
+    # These indexes allow the age of the oldest waiting signal to be
+    # found quickly, even when there is a huge backlog. They are
+    # created concurrently, so that the tables do not get locked for
+    # writes.
+    for table in TABLES:
+        create_index_concurrently(
+            f'idx_{table}_inserted_at',
+            table,
+            ['inserted_at'],
+            unique=False,
+            postgresql_where=sa.text('dead_at IS NULL'),
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        drop_index_concurrently(f'idx_{table}_inserted_at', table)
@@ -0,0 +1,51 @@
+"""signal notify triggers
+
+Revision ID: dfb07c0fddc7
+Revises: 147fc5c04b54
+Create Date: 2026-10-18 14:22:09.731554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dfb07c0fddc7'
+down_revision = '147fc5c04b54'
+branch_labels = None
+depends_on = None
+
+
+def create_notify_trigger(table):
+    op.execute(
+        f"CREATE TRIGGER {table}_notify"
+        f" AFTER INSERT ON {table}"
+        f" FOR EACH STATEMENT EXECUTE FUNCTION notify_signal_insert()"
+    )
+
+
+def drop_notify_trigger(table):
+    op.execute(f"DROP TRIGGER IF EXISTS {table}_notify ON {table}")
+
+
+def upgrade():
+    # Sends a notification on a channel named after the table. Note
+    # that identical notifications sent from one transaction are
+    # delivered only once.
+    op.execute(
+        "CREATE OR REPLACE FUNCTION notify_signal_insert() RETURNS trigger"
+        " AS $$"
+        " BEGIN"
+        "   PERFORM pg_notify(TG_TABLE_NAME, '');"
+        "   RETURN NULL;"
+        " END;"
+        " $$ LANGUAGE plpgsql"
+    )
+    create_notify_trigger('activate_user_signal')
+    create_notify_trigger('deactivate_user_signal')
+
+
+def downgrade():
+    drop_notify_trigger('activate_user_signal')
+    drop_notify_trigger('deactivate_user_signal')
+    op.execute("DROP FUNCTION IF EXISTS notify_signal_insert()")
@@ -122,10 +122,11 @@ def configure_logging(level: str, format: str, associated_loggers: List[str]) ->
 def create_app(config_dict={}):
     from werkzeug.middleware.proxy_fix import ProxyFix
     from flask import Flask
-    from . import extensions
+    from . import extensions, replicas, sharding, db_pool
     from .config import Configuration
     from .routes import login, consent
     from .cli import swpt_login
+    from .benchmarks import swpt_login_benchmark
 
     app = Flask(__name__)
     app.wsgi_app = ProxyFix(app.wsgi_app, x_port=1)
@@ -139,14 +140,29 @@ def create_app(config_dict={}):
 
     engine_options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
     engine_options["pool_size"] = app.config["POSTGRES_CONNECTION_POOL_SIZE"]
+    engine_options["poolclass"] = db_pool.InstrumentedQueuePool
+    engine_options["pool_pre_ping"] = app.config["POSTGRES_POOL_PRE_PING"]
+    engine_options["pool_recycle"] = app.config["POSTGRES_POOL_RECYCLE_SECONDS"] or -1
+    connect_args = engine_options["connect_args"] = dict(
+        engine_options.get("connect_args", {})
+    )
+    if app.config["POSTGRES_TRANSACTION_POOLING"]:
+        # A transaction pooler (like PgBouncer in "transaction" mode)
+        # may run every transaction on a different server connection.
+        # Therefore, session settings and prepared statements can not
+        # be used. Instead, the "enable_seqscan" setting must be
+        # configured as a role-level default (see README.md).
+        connect_args["prepare_threshold"] = None
+    else:
+        # Setting "enable_seqscan" via the connection startup options
+        # does not cost an additional round trip.
+        connect_args["prepare_threshold"] = app.config["POSTGRES_PREPARE_THRESHOLD"]
+        options = connect_args.get("options", "")
+        if "enable_seqscan" not in options:
+            connect_args["options"] = f"{options} -c enable_seqscan=off".strip()
     app.config["SQLALCHEMY_BINDS"] = {
-        "replica": {
-            "url": (
-                app.config["POSTGRES_REPLICA_URL"]
-                or app.config["SQLALCHEMY_DATABASE_URI"]
-            ),
-            **engine_options,
-        },
+        **replicas.get_replica_binds(app.config, engine_options),
+        **sharding.get_shard_binds(app.config, engine_options),
     }
 
     subject_prefix = app.config["SUBJECT_PREFIX"]
@@ -162,11 +178,13 @@ def create_app(config_dict={}):
         raise RuntimeError("invalid SUBJECT_PREFIX")
 
     extensions.init_app(app)
+    replicas.init_app(app)
     app.register_blueprint(login, url_prefix=app.config["LOGIN_PATH"])
     app.register_blueprint(consent, url_prefix=app.config["CONSENT_PATH"])
     app.register_error_handler(500, _server_error)
     app.register_error_handler(403, _server_error)
     app.cli.add_command(swpt_login)
+    app.cli.add_command(swpt_login_benchmark)
     return app
 
 
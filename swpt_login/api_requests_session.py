@@ -1,14 +1,19 @@
+import os
+import logging
 import threading
 import requests
+import redis
+from http.cookiejar import DefaultCookiePolicy
 from urllib.parse import urlparse
-from werkzeug.local import Local
 from flask import current_app
 from requests.auth import HTTPBasicAuth
 from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import BackendApplicationClient
 
-_local = Local()
+_requests_session = None
+_requests_session_pid = None
+_requests_session_lock = threading.Lock()
 
 
 class APIAdapter(HTTPAdapter):
@@ -38,12 +43,27 @@ class APIAdapter(HTTPAdapter):
             with cls.__access_token_lock:
                 access_token = cls.__access_token
                 if access_token is None:
-                    token_info = cls.__obtain_new_access_token()
-                    access_token = cls.__access_token = token_info["access_token"]
-                    is_new_access_token = True
+                    access_token, is_new_access_token = cls.__load_access_token()
+                    cls.__access_token = access_token
 
         return access_token, is_new_access_token
 
+    @classmethod
+    def __load_access_token(cls):
+        if current_app.config["API_CACHE_ACCESS_TOKEN"]:
+            try:
+                return _load_shared_access_token(cls.__obtain_new_access_token)
+            except redis.RedisError:
+                logger = logging.getLogger(__name__)
+                logger.warning(
+                    "Can not use the shared access token cache. Falling back"
+                    " to obtaining an access token for this process only.",
+                    exc_info=True,
+                )
+
+        token_info = cls.__obtain_new_access_token()
+        return token_info["access_token"], True
+
     @classmethod
     def __obtain_new_access_token(cls):
         client_id = current_app.config["SUPERUSER_CLIENT_ID"]
@@ -70,6 +90,82 @@ class APIAdapter(HTTPAdapter):
                 if cls.__access_token == access_token:
                     cls.__access_token = None
 
+        if current_app.config["API_CACHE_ACCESS_TOKEN"]:
+            try:
+                _invalidate_shared_access_token(access_token)
+            except redis.RedisError:
+                pass
+
+
+def _get_shared_access_token_keys():
+    client_id = current_app.config["SUPERUSER_CLIENT_ID"]
+    return f"apitoken:{client_id}", f"apitoken-lock:{client_id}"
+
+
+def _load_shared_access_token(obtain_new_access_token):
+    """Return an access token from the shared (Redis) cache.
+
+    When the cache is empty, only one process at a time obtains a new
+    access token, and puts it in the cache. All other processes wait
+    for the new access token to appear in the cache. Returns a
+    `(access_token, is_new_access_token)` tuple.
+    """
+
+    redis_store = current_app.extensions["redis"]
+    key, lock_key = _get_shared_access_token_keys()
+    timeout_seconds = float(current_app.config["API_TIMEOUT_SECONDS"])
+
+    if access_token := redis_store.get(key):
+        return access_token, False
+
+    lock = redis_store.lock(
+        lock_key,
+        timeout=2 * timeout_seconds,
+        blocking_timeout=2 * timeout_seconds,
+    )
+    if not lock.acquire():
+        # The process that holds the lock is probably stuck. Give up
+        # waiting, and obtain a new access token for this process.
+        if access_token := redis_store.get(key):
+            return access_token, False
+
+        token_info = obtain_new_access_token()
+        return token_info["access_token"], True
+
+    try:
+        if access_token := redis_store.get(key):
+            return access_token, False
+
+        token_info = obtain_new_access_token()
+        access_token = token_info["access_token"]
+        expires_in = token_info.get("expires_in")
+        margin_seconds = current_app.config[
+            "API_ACCESS_TOKEN_EXPIRATION_MARGIN_SECONDS"
+        ]
+        if expires_in is not None:
+            ttl_seconds = int(float(expires_in) - margin_seconds)
+            if ttl_seconds > 0:
+                redis_store.set(key, access_token, ex=ttl_seconds)
+
+        return access_token, True
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:  # pragma: no cover
+            pass
+
+
+def _invalidate_shared_access_token(access_token):
+    redis_store = current_app.extensions["redis"]
+    key, _ = _get_shared_access_token_keys()
+
+    # NOTE: This is not atomic, but the worst that could happen is
+    # that an access token that has just been put in the cache gets
+    # removed from it. In this case, the access token will simply be
+    # obtained again.
+    if redis_store.get(key) == access_token:
+        redis_store.delete(key)
+
 
 class HydraAdminAdapter(HTTPAdapter):
     def send(self, request, *args, **kw):
@@ -77,21 +173,98 @@ class HydraAdminAdapter(HTTPAdapter):
         return super().send(request, *args, **kw)
 
 
+def get_pool_maxsize() -> int:
+    """Return the maximum number of connections to keep per host.
+
+    Every thread in the process may need its own connection,
+    therefore by default, this is equal to the maximum number of
+    threads (web server threads, or concurrent signal deliveries).
+    """
+
+    return current_app.config["APP_HTTP_POOL_MAXSIZE"] or max(
+        current_app.config["WEBSERVER_THREADS"],
+        current_app.config["APP_FLUSH_MAX_CONCURRENCY"],
+    )
+
+
 def create_requests_session():
     api_base_url = urlparse(current_app.config["API_RESOURCE_SERVER"])
     api_resource_server = f"{api_base_url.scheme}://{api_base_url.netloc}"
     hydra_admin_url = current_app.config["HYDRA_ADMIN_URL"]
+    pool_kwargs = dict(
+        pool_connections=current_app.config["APP_HTTP_POOL_CONNECTIONS"],
+        pool_maxsize=get_pool_maxsize(),
+        pool_block=current_app.config["APP_HTTP_POOL_BLOCK"],
+    )
 
     session = requests.Session()
     session.timeout = float(current_app.config["API_TIMEOUT_SECONDS"])
-    session.mount(api_resource_server, APIAdapter())
-    session.mount(hydra_admin_url, HydraAdminAdapter())
+
+    # The session is shared between threads. Therefore, we must not
+    # let it accumulate cookies, which is not thread-safe.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    session.mount("https://", HTTPAdapter(**pool_kwargs))
+    session.mount("http://", HTTPAdapter(**pool_kwargs))
+    session.mount(api_resource_server, APIAdapter(**pool_kwargs))
+    session.mount(hydra_admin_url, HydraAdminAdapter(**pool_kwargs))
 
     return session
 
 
 def get_requests_session():
-    if not hasattr(_local, "requests_session"):
-        _local.requests_session = create_requests_session()
+    """Return the requests session shared by all threads in the process.
+
+    The session will be re-created in forked child processes, because
+    HTTP connections can not be shared between processes.
+    """
+
+    global _requests_session, _requests_session_pid
+
+    pid = os.getpid()
+    if _requests_session_pid != pid:
+        with _requests_session_lock:
+            if _requests_session_pid != pid:
+                _requests_session = create_requests_session()
+                _requests_session_pid = pid
+
+    return _requests_session
+
+
+def get_requests_session_stats() -> list[dict]:
+    """Return usage statistics for the requests session's HTTP pools.
+
+    For every host, reports the number of idle connections in the
+    pool, the maximum pool size, the number of opened connections,
+    the number of made requests, and the connection reuse ratio.
+    """
+
+    session = get_requests_session()
+    stats = []
+
+    for prefix, adapter in list(session.adapters.items()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:  # pragma: no cover
+                continue
+
+            num_connections = pool.num_connections
+            num_requests = pool.num_requests
+            stats.append({
+                "adapter": prefix,
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "idle_connections": sum(
+                    1 for c in list(pool.pool.queue) if c is not None
+                ),
+                "pool_maxsize": pool.pool.maxsize,
+                "num_connections": num_connections,
+                "num_requests": num_requests,
+                "reuse_ratio": (
+                    max(0.0, 1.0 - num_connections / num_requests)
+                    if num_requests > 0
+                    else None
+                ),
+            })
 
-    return _local.requests_session
+    return stats
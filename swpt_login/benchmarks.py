@@ -0,0 +1,784 @@
+import os
+import sys
+import base64
+import json
+import time
+import random
+import signal
+import threading
+import functools
+import subprocess
+from collections import Counter
+from types import SimpleNamespace
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+import click
+from sqlalchemy import select, func, insert, delete, text, event
+from flask.cli import with_appcontext
+from swpt_login import utils
+from swpt_login.extensions import db
+from swpt_login.models import (
+    ActivateUserSignal,
+    DeactivateUserSignal,
+    UserRegistration,
+    RegisteredUserId,
+)
+from swpt_login.sharding import (
+    execute_on_shard,
+    get_shard_engines,
+    change_registration_email,
+)
+from swpt_login.flushing import read_flush_stats, clear_flush_stats
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100.0))
+    return values[index]
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ResourceServerStandIn:
+    """A local stand-in for the resource server, and the token endpoint.
+
+    Responds to activation and deactivation requests after `latency`
+    seconds. A fraction of the requests (`error_rate`) fail with a
+    "500 Internal Server Error" response. The times at which the
+    requests have been successfully handled are recorded.
+    """
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.delivered_at: dict[str, float] = {}
+        self.request_count = 0
+        self.error_count = 0
+        self.server = make_server(
+            "127.0.0.1",
+            0,
+            self.wsgi_app,
+            server_class=_ThreadingWSGIServer,
+            handler_class=_QuietRequestHandler,
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/"
+
+    def wsgi_app(self, environ, start_response):
+        path = environ["PATH_INFO"]
+
+        if path == "/oauth2/token":
+            body = json.dumps({
+                "access_token": "benchmark",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+            })
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [body.encode()]
+
+        time.sleep(self.latency)
+        with self.lock:
+            self.request_count += 1
+            if random.random() < self.error_rate:
+                self.error_count += 1
+                start_response("500 Internal Server Error", [])
+                return [b""]
+
+        user_id = path.rstrip("/").split("/")[-2]
+        with self.lock:
+            self.delivered_at.setdefault(user_id, time.time())
+
+        if path.endswith("/activate"):
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [b"{}"]
+
+        start_response("204 No Content", [])
+        return [b""]
+
+    def start(self) -> None:
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _seed_signals(model, rows: int, first: int = 0) -> dict[str, float]:
+    """Insert synthetic signals, committing them in batches.
+
+    Returns a dictionary which maps the user ID of each inserted
+    signal to the time at which the signal has been committed.
+    """
+
+    batch_size = 5000
+    committed_at = {}
+    for start in range(first, first + rows, batch_size):
+        stop = min(first + rows, start + batch_size)
+        if model is ActivateUserSignal:
+            values = [
+                dict(
+                    user_id=str(i),
+                    reservation_id=f"benchmark-{i}",
+                    email=f"benchmark-{i}@example.com",
+                    salt="salt",
+                    password_hash="password_hash",
+                    recovery_code_hash="recovery_code_hash",
+                )
+                for i in range(start, stop)
+            ]
+        else:
+            values = [dict(user_id=str(i)) for i in range(start, stop)]
+        db.session.execute(insert(model), values)
+        db.session.commit()
+
+        now = time.time()
+        committed_at.update((v["user_id"], now) for v in values)
+
+    return committed_at
+
+
+def _count_pending(model) -> int:
+    count = db.session.execute(
+        select(func.count()).select_from(model).where(model.dead_at.is_(None))
+    ).scalar()
+    db.session.commit()
+    return count
+
+
+def _read_flush_stats(table_name: str) -> tuple[int, int]:
+    processed = 0
+    statements = 0
+    for stats in read_flush_stats(table_name).values():
+        processed += int(stats.get("processed", 0))
+        statements += int(stats.get("statements", 0))
+
+    return processed, statements
+
+
+def _delete_synthetic_signals(model, user_ids: list[str]) -> None:
+    batch_size = 5000
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        db.session.execute(delete(model).where(model.user_id.in_(batch)))
+        db.session.commit()
+
+
+def _delete_synthetic_registrations() -> None:
+    """Delete the registrations of the synthetic users (benchmark-N@example.com)."""
+
+    batch_size = 5000
+    synthetic = UserRegistration.email.like("benchmark-%@example.com")
+    for engine in get_shard_engines():
+        while True:
+            with engine.begin() as connection:
+                user_ids = connection.execute(
+                    delete(UserRegistration)
+                    .where(
+                        UserRegistration.email.in_(
+                            select(UserRegistration.email)
+                            .where(synthetic)
+                            .limit(batch_size)
+                        )
+                    )
+                    .returning(UserRegistration.user_id)
+                ).scalars().all()
+
+            if not user_ids:
+                break
+
+            db.session.execute(
+                delete(RegisteredUserId).where(RegisteredUserId.user_id.in_(user_ids))
+            )
+            db.session.commit()
+
+
+def _requires_confirmation(command):
+    """Refuse to run the benchmark without the `--yes` option.
+
+    Benchmarks run against the configured database, and must not be
+    run against a production database by mistake.
+    """
+
+    @click.option(
+        "--yes", "confirmed", is_flag=True, default=False,
+        help="Confirm that the configured database is not a production database.",
+    )
+    @functools.wraps(command)
+    def wrapper(*args, confirmed: bool, **kwargs):
+        if not confirmed:
+            url = db.engine.url.render_as_string(hide_password=True)
+            raise click.ClickException(
+                f"Benchmarks must not be run against a production database."
+                f" Use --yes to confirm that {url} is not a production database."
+            )
+        return command(*args, **kwargs)
+
+    return wrapper
+
+
+@click.group("swpt_login_benchmark")
+def swpt_login_benchmark():
+    """Run performance benchmarks.
+
+    The benchmarks create synthetic rows in the database, and
+    therefore must not be run against a production database. To
+    confirm that the configured database is not a production
+    database, the `--yes` option must be passed to each benchmark.
+    """
+
+
+@swpt_login_benchmark.command("flush")
+@with_appcontext
+@_requires_confirmation
+@click.option(
+    "-n", "--rows", type=int, default=10000, show_default=True,
+    help="The number of synthetic signals to create.",
+)
+@click.option(
+    "-p", "--processes", type=int, default=1, show_default=True,
+    help="The number of flush processes.",
+)
+@click.option(
+    "-b", "--burst-count", type=int, default=100, show_default=True,
+    help="The maximum number of signals processed in one burst.",
+)
+@click.option(
+    "-c", "--concurrency", type=int, default=10, show_default=True,
+    help="The maximum number of concurrent HTTP requests per process.",
+)
+@click.option(
+    "--latency", type=float, default=0.01, show_default=True,
+    help="The resource server's response time in seconds.",
+)
+@click.option(
+    "--error-rate", type=float, default=0.0, show_default=True,
+    help="The fraction of requests that fail with status code 500.",
+)
+@click.option(
+    "--timeout", type=float, default=600.0, show_default=True,
+    help="Give up after FLOAT seconds.",
+)
+@click.argument(
+    "task_type",
+    type=click.Choice(["ActivateUserSignal", "DeactivateUserSignal"]),
+)
+def benchmark_flush(
+    task_type: str,
+    rows: int,
+    processes: int,
+    burst_count: int,
+    concurrency: int,
+    latency: float,
+    error_rate: float,
+    timeout: float,
+) -> None:
+    """Measure how fast a backlog of pending tasks is processed.
+
+    Creates synthetic TASK_TYPE signals, starts a local stand-in for
+    the resource server, and runs `flask swpt_login flush` until all
+    the signals have been processed. Reports the number of processed
+    signals per second, the number of SQL statements per signal, and
+    the per-row latency (the time from committing a signal, to its
+    successful delivery). The startup time of the flush processes is
+    not included in the measurements. The synthetic rows are deleted
+    at the end.
+    """
+
+    model = (
+        ActivateUserSignal
+        if task_type == "ActivateUserSignal"
+        else DeactivateUserSignal
+    )
+    table_name = model.__table__.name
+    if _count_pending(model) > 0:
+        raise click.ClickException(f"The {table_name} table is not empty.")
+
+    clear_flush_stats(table_name)
+    server = ResourceServerStandIn(latency, error_rate)
+    server.start()
+
+    burst_count_setting = (
+        "APP_FLUSH_ACTIVATE_USERS_BURST_COUNT"
+        if model is ActivateUserSignal
+        else "APP_FLUSH_DEACTIVATE_USERS_BURST_COUNT"
+    )
+    env = {
+        **os.environ,
+        "OAUTHLIB_INSECURE_TRANSPORT": "1",
+        "API_RESOURCE_SERVER": server.url,
+        "API_AUTH2_TOKEN_URL": server.url + "oauth2/token",
+        "API_CACHE_ACCESS_TOKEN": "False",
+        burst_count_setting: str(burst_count),
+        "APP_FLUSH_MAX_CONCURRENCY": str(concurrency),
+        "APP_FLUSH_STATS_PERIOD": "1.0",
+        "APP_SIGNAL_RETRY_MIN_SECONDS": "0.1",
+        "APP_SIGNAL_RETRY_MAX_SECONDS": "1.0",
+        "APP_SIGNAL_MAX_ATTEMPTS": "1000",
+    }
+    click.echo(f"Starting {processes} flush processes...")
+    deadline = time.time() + timeout
+    flush_process = subprocess.Popen(
+        [
+            sys.executable, "-m", "flask", "swpt_login", "flush",
+            "--processes", str(processes),
+            "--max-processes", "0",
+            "--wait", "0.1",
+            "--max-wait", "0.5",
+            task_type,
+        ],
+        env=env,
+    )
+
+    def wait_until_processed() -> None:
+        while _count_pending(model) > 0:
+            if time.time() > deadline:
+                raise click.ClickException("The benchmark has timed out.")
+            if flush_process.poll() is not None:
+                raise click.ClickException("The flush process has exited.")
+            time.sleep(0.1)
+
+    user_ids = [str(i) for i in range(rows + 1)]
+    try:
+        # One warm-up signal is processed before the measured
+        # signals are created, so that the startup time of the flush
+        # processes is not included in the measurements.
+        _seed_signals(model, 1, first=rows)
+        wait_until_processed()
+
+        click.echo(f"Creating {rows} {task_type} signals...")
+        started_at = time.time()
+        committed_at = _seed_signals(model, rows)
+        wait_until_processed()
+        elapsed = time.time() - started_at
+    finally:
+        if flush_process.poll() is None:
+            flush_process.send_signal(signal.SIGTERM)
+            flush_process.wait()
+        server.stop()
+
+        click.echo("Deleting the synthetic rows...")
+        db.session.rollback()
+        _delete_synthetic_signals(model, user_ids)
+        if model is ActivateUserSignal:
+            _delete_synthetic_registrations()
+
+    # The latency of a row is the time from committing the row, to
+    # its first successful delivery to the resource server (including
+    # the time spent waiting in the queue, and the failed attempts).
+    processed, statements = _read_flush_stats(table_name)
+    latencies = [
+        server.delivered_at[user_id] - t for user_id, t in committed_at.items()
+    ]
+    click.echo(f"Processed signals: {processed} (including 1 warm-up signal)")
+    click.echo(f"HTTP requests: {server.request_count} ({server.error_count} errors)")
+    click.echo(f"Elapsed time: {elapsed:.3f} s")
+    click.echo(f"Throughput: {rows / elapsed:.1f} rows/s")
+    click.echo(f"SQL statements per row: {statements / max(1, processed):.2f}")
+    click.echo(f"p50 per-row latency: {_percentile(latencies, 50):.3f} s")
+    click.echo(f"p99 per-row latency: {_percentile(latencies, 99):.3f} s")
+
+
+BENCHMARK_TABLE = "benchmark_user_registration"
+
+
+def _execute_autocommit(statement: str, **params) -> None:
+    with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+    ) as connection:
+        connection.execute(text(statement), params)
+
+
+def _measure_credential_lookups(
+    rows: int, lookups: int
+) -> tuple[dict, list[float]]:
+    """Return an `EXPLAIN` plan of a lookup, and the lookup latencies."""
+
+    query = text(
+        f"SELECT user_id, salt, password_hash, status FROM {BENCHMARK_TABLE}"
+        " WHERE email = :email"
+    )
+    latencies = []
+    with db.engine.connect() as connection:
+        explain = connection.execute(
+            text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.text}"),
+            {"email": "user-1@example.com"},
+        ).scalar()
+        plan = (json.loads(explain) if isinstance(explain, str) else explain)[0]["Plan"]
+
+        for _ in range(lookups):
+            email = f"user-{random.randrange(rows)}@example.com"
+            started_at = time.perf_counter()
+            connection.execute(query, {"email": email}).one_or_none()
+            latencies.append(time.perf_counter() - started_at)
+
+        connection.rollback()
+
+    return plan, latencies
+
+
+def _report_credential_lookups(title: str, plan: dict, latencies: list[float]):
+    click.echo(title)
+    click.echo(f"  Plan: {plan['Node Type']} using {plan.get('Index Name')}")
+    click.echo(f"  Heap fetches: {plan.get('Heap Fetches', 'n/a')}")
+    click.echo(
+        f"  Buffers: {plan.get('Shared Hit Blocks', 0)} hit,"
+        f" {plan.get('Shared Read Blocks', 0)} read"
+    )
+    click.echo(f"  p50 latency: {1000 * _percentile(latencies, 50):.3f} ms")
+    click.echo(f"  p99 latency: {1000 * _percentile(latencies, 99):.3f} ms")
+
+
+@swpt_login_benchmark.command("credentials_index")
+@with_appcontext
+@_requires_confirmation
+@click.option(
+    "-n", "--rows", type=int, default=10_000_000, show_default=True,
+    help="The number of rows in the synthetic table.",
+)
+@click.option(
+    "-l", "--lookups", type=int, default=10000, show_default=True,
+    help="The number of credential lookups to perform.",
+)
+def benchmark_credentials_index(rows: int, lookups: int) -> None:
+    """Compare credential lookups with and without a covering index.
+
+    Creates a synthetic table which looks like the "user_registration"
+    table, and performs random credential lookups, first using only
+    the primary key index, and then using a covering index (which
+    includes all the selected columns). The synthetic table is dropped
+    at the end.
+    """
+
+    click.echo(f"Creating a synthetic table with {rows} rows...")
+    # NOTE: An existing table with the same name is never dropped. If
+    # the table exists, the benchmark fails.
+    _execute_autocommit(
+        f"CREATE TABLE {BENCHMARK_TABLE} ("
+        " email VARCHAR(255) PRIMARY KEY,"
+        " user_id VARCHAR(64) NOT NULL,"
+        " salt VARCHAR(32) NOT NULL,"
+        " password_hash VARCHAR(128) NOT NULL,"
+        " recovery_code_hash VARCHAR(128) NOT NULL,"
+        " registered_from_ip INET,"
+        " registered_at TIMESTAMP WITH TIME ZONE NOT NULL,"
+        " status SMALLINT NOT NULL)"
+    )
+    try:
+        _execute_autocommit(
+            f"INSERT INTO {BENCHMARK_TABLE}"
+            " SELECT 'user-' || i || '@example.com', i::text,"
+            " left(md5(i::text), 22), md5('p' || i::text) || md5('h' || i::text),"
+            " md5('r' || i::text) || md5('c' || i::text), NULL, now(), 0"
+            " FROM generate_series(0, :rows - 1) AS i",
+            rows=rows,
+        )
+        _execute_autocommit(f"VACUUM ANALYZE {BENCHMARK_TABLE}")
+        plan, latencies = _measure_credential_lookups(rows, lookups)
+        _report_credential_lookups("Primary key index:", plan, latencies)
+
+        _execute_autocommit(
+            f"CREATE INDEX {BENCHMARK_TABLE}_credentials ON {BENCHMARK_TABLE}"
+            " (email) INCLUDE (user_id, salt, password_hash, status)"
+        )
+        _execute_autocommit(f"VACUUM ANALYZE {BENCHMARK_TABLE}")
+        plan, latencies = _measure_credential_lookups(rows, lookups)
+        _report_credential_lookups("Covering index:", plan, latencies)
+    finally:
+        _execute_autocommit(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+
+
+def _measure_hot_query(statement, lookups: int, prepare: bool) -> list[float]:
+    sql = str(statement.compile(dialect=db.engine.dialect))
+    latencies = []
+    raw_connection = db.engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            for _ in range(lookups):
+                email = f"user-{random.randrange(1_000_000_000)}@example.com"
+                started_at = time.perf_counter()
+                cursor.execute(sql, {"email": email}, prepare=prepare)
+                cursor.fetchall()
+                latencies.append(time.perf_counter() - started_at)
+        raw_connection.rollback()
+    finally:
+        raw_connection.close()
+
+    return latencies
+
+
+def _get_planning_time(statement) -> float:
+    """Return the planning time (in milliseconds) of an unprepared query."""
+
+    sql = str(statement.compile(dialect=db.engine.dialect))
+    raw_connection = db.engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}",
+                {"email": "user-1@example.com"},
+                prepare=False,
+            )
+            explain = cursor.fetchone()[0]
+        raw_connection.rollback()
+    finally:
+        raw_connection.close()
+
+    return (json.loads(explain) if isinstance(explain, str) else explain)[0][
+        "Planning Time"
+    ]
+
+
+@swpt_login_benchmark.command("prepared_statements")
+@with_appcontext
+@_requires_confirmation
+@click.option(
+    "-l", "--lookups", type=int, default=10000, show_default=True,
+    help="The number of queries to perform in each mode.",
+)
+def benchmark_prepared_statements(lookups: int) -> None:
+    """Compare hot queries with and without server-side prepared statements.
+
+    Executes the credentials query, and the recovery code hash query,
+    first without preparing them, and then as prepared statements, and
+    reports the planning time and the latencies.
+    """
+
+    from swpt_login.routes import USER_CREDENTIALS_QUERY
+    from swpt_login.redis import RECOVERY_CODE_HASH_QUERY
+
+    for name, statement in [
+        ("Credentials query", USER_CREDENTIALS_QUERY),
+        ("Recovery code hash query", RECOVERY_CODE_HASH_QUERY),
+    ]:
+        click.echo(f"{name}:")
+        click.echo(f"  Planning time: {_get_planning_time(statement):.3f} ms")
+        for title, prepare in [("Not prepared", False), ("Prepared", True)]:
+            latencies = _measure_hot_query(statement, lookups, prepare)
+            click.echo(
+                f"  {title}:"
+                f" p50 latency {1000 * _percentile(latencies, 50):.3f} ms,"
+                f" p99 latency {1000 * _percentile(latencies, 99):.3f} ms"
+            )
+
+
+class _RoundTripCounter:
+    """Count the SQL statements and commits executed by all engines."""
+
+    def __init__(self):
+        self.count = 0
+        self.engines = set(db.engines.values())
+
+    def _increment(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._increment)
+            event.listen(engine, "commit", self._increment)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._increment)
+            event.remove(engine, "commit", self._increment)
+
+
+def _insert_benchmark_user(user_id: str, email: str, password_hash: str) -> None:
+    execute_on_shard(
+        email,
+        insert(UserRegistration).values(
+            user_id=user_id,
+            email=email,
+            salt="",
+            password_hash=password_hash,
+            recovery_code_hash=password_hash,
+        ),
+    )
+    db.session.execute(insert(RegisteredUserId).values(user_id=user_id))
+    db.session.commit()
+
+
+def _delete_benchmark_user(user_id: str, email: str) -> None:
+    execute_on_shard(email, delete(UserRegistration).where(UserRegistration.email == email))
+    db.session.execute(delete(RegisteredUserId).where(RegisteredUserId.user_id == user_id))
+    db.session.execute(
+        delete(DeactivateUserSignal).where(DeactivateUserSignal.user_id == user_id)
+    )
+    db.session.commit()
+
+
+@swpt_login_benchmark.command("account_flows")
+@with_appcontext
+@_requires_confirmation
+@click.option(
+    "-i", "--iterations", type=int, default=1000, show_default=True,
+    help="The number of times each flow is performed.",
+)
+def benchmark_account_flows(iterations: int) -> None:
+    """Measure the database round trips of the account-mutation flows.
+
+    Performs the database operations of the password recovery, the
+    recovery code change, the email change, and the account deletion
+    flows, and reports the number of database round trips (SQL
+    statements plus commits) per flow, and the latencies. Password
+    hashes are calculated in advance, so that they do not affect the
+    latencies.
+    """
+
+    from swpt_login.routes import query_user_credentials
+
+    user_id = f"{random.randrange(1 << 62)}"
+    email = f"account-flows-{user_id}@example.com"
+    new_email = f"account-flows-{user_id}-new@example.com"
+    salt = utils.generate_password_salt()
+    password_hash = utils.calc_crypt_hash(salt, "password")
+    _insert_benchmark_user(user_id, email, password_hash)
+
+    def change_password():
+        UserRegistration.change_password(email, salt, password_hash)
+        db.session.commit()
+
+    def change_recovery_code():
+        UserRegistration.change_recovery_code_hash(email, password_hash)
+        db.session.commit()
+
+    def change_email():
+        nonlocal email, new_email
+        change_registration_email(user_id, email, new_email)
+        db.session.commit()
+        email, new_email = new_email, email
+
+    def delete_account():
+        user = query_user_credentials(email)
+        deleted_user_id = UserRegistration.delete_verified(email, user)
+        db.session.execute(
+            delete(RegisteredUserId).where(RegisteredUserId.user_id == deleted_user_id)
+        )
+        db.session.add(DeactivateUserSignal(user_id=deleted_user_id))
+        db.session.commit()
+
+    try:
+        for name, flow in [
+            ("Password recovery", change_password),
+            ("Recovery code change", change_recovery_code),
+            ("Email change", change_email),
+            ("Account deletion", delete_account),
+        ]:
+            round_trips = 0
+            latencies = []
+            for _ in range(iterations):
+                with _RoundTripCounter() as counter:
+                    started_at = time.perf_counter()
+                    flow()
+                    latencies.append(time.perf_counter() - started_at)
+                round_trips += counter.count
+
+                if flow is delete_account:
+                    _delete_benchmark_user(user_id, email)
+                    _insert_benchmark_user(user_id, email, password_hash)
+
+            click.echo(
+                f"{name}:"
+                f" {round_trips / iterations:.2f} round trips,"
+                f" p50 latency {1000 * _percentile(latencies, 50):.3f} ms,"
+                f" p99 latency {1000 * _percentile(latencies, 99):.3f} ms"
+            )
+    finally:
+        db.session.rollback()
+        _delete_benchmark_user(user_id, email)
+
+
+_TABLE_STATS_QUERY = text(
+    "SELECT"
+    " (SELECT count(*) FROM user_registration) AS rows,"
+    " (SELECT count(password_hash_bin) FROM user_registration) AS converted_rows,"
+    " pg_relation_size('user_registration') AS table_size,"
+    " pg_indexes_size('user_registration') AS indexes_size,"
+    " coalesce(s.heap_blks_hit, 0) AS heap_blks_hit,"
+    " coalesce(s.heap_blks_read, 0) AS heap_blks_read,"
+    " coalesce(s.idx_blks_hit, 0) AS idx_blks_hit,"
+    " coalesce(s.idx_blks_read, 0) AS idx_blks_read"
+    " FROM pg_statio_user_tables s"
+    " WHERE s.relid = 'user_registration'::regclass"
+)
+
+
+def _get_hit_ratio(hit: int, read: int) -> str:
+    return f"{100.0 * hit / (hit + read):.2f}%" if hit + read else "n/a"
+
+
+def _measure_password_checks(credentials, logins: int) -> float:
+    """Return the CPU time (in seconds) per password check."""
+
+    started_at = time.process_time()
+    for _ in range(logins):
+        assert utils.is_correct_password(credentials, "password")
+    return (time.process_time() - started_at) / logins
+
+
+@swpt_login_benchmark.command("binary_hashes")
+@with_appcontext
+@_requires_confirmation
+@click.option(
+    "-l", "--logins", type=int, default=2000, show_default=True,
+    help="The number of password checks to perform in each mode.",
+)
+def benchmark_binary_hashes(logins: int) -> None:
+    """Compare Base64 encoded and binary password hashes.
+
+    Reports the size of the user_registration table and its indexes,
+    and the cache hit ratios, summed over all shards. (Run this before
+    and after running `flask swpt_login convert_user_hashes`.) Also,
+    reports the CPU time needed to check a password, when Base64
+    encoded and binary hashes are used.
+    """
+
+    totals = Counter()
+    for engine in get_shard_engines():
+        with engine.connect() as connection:
+            totals.update(connection.execute(_TABLE_STATS_QUERY).mappings().one())
+
+    click.echo(f"Converted rows: {totals['converted_rows']} of {totals['rows']}")
+    click.echo(f"Table size: {totals['table_size'] / 1048576:.2f} MiB")
+    click.echo(f"Indexes size: {totals['indexes_size'] / 1048576:.2f} MiB")
+    click.echo(
+        "Table cache hit ratio:"
+        f" {_get_hit_ratio(totals['heap_blks_hit'], totals['heap_blks_read'])}"
+    )
+    click.echo(
+        "Indexes cache hit ratio:"
+        f" {_get_hit_ratio(totals['idx_blks_hit'], totals['idx_blks_read'])}"
+    )
+
+    salt = utils.generate_password_salt()
+    salt_bin = base64.b64decode(salt)
+    password_hash = utils.calc_crypt_hash(salt, "password")
+    password_hash_bin = base64.b64decode(password_hash)
+    for title, credentials in [
+        ("Base64 encoded hashes", SimpleNamespace(
+            salt=salt,
+            password_hash=password_hash,
+            salt_bin=None,
+            password_hash_bin=None,
+        )),
+        ("Binary hashes", SimpleNamespace(
+            salt=None,
+            password_hash=None,
+            salt_bin=salt_bin,
+            password_hash_bin=password_hash_bin,
+        )),
+    ]:
+        cpu_time = _measure_password_checks(credentials, logins)
+        click.echo(f"{title}: {1000 * cpu_time:.3f} ms CPU time per login")
@@ -0,0 +1,345 @@
+from typing import BinaryIO, Optional
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from flask import current_app
+from .extensions import db
+from .sharding import (
+    is_sharded,
+    get_shard_number,
+    get_shard_engines,
+    get_next_shard_engines,
+    upsert_registrations,
+)
+
+COPY_FORMATS = ["csv", "binary"]
+COLUMNS = [
+    "email",
+    "user_id",
+    "salt",
+    "password_hash",
+    "recovery_code_hash",
+    "registered_from_ip",
+    "registered_at",
+    "status",
+]
+IMPORT_TABLE = "user_registration_import"
+
+_COPY_BLOCK_SIZE = 1 << 16
+_COLUMN_LIST = ", ".join(COLUMNS)
+_EXPORTED_COLUMN_LIST = (
+    "email, user_id,"
+    " coalesce(salt, encode(salt_bin, 'base64')) AS salt,"
+    " coalesce(password_hash, encode(password_hash_bin, 'base64')) AS password_hash,"
+    " coalesce(recovery_code_hash, encode(recovery_code_hash_bin, 'base64'))"
+    " AS recovery_code_hash,"
+    " registered_from_ip, registered_at, status"
+)
+_INSERTED_COLUMN_LIST = (
+    "email, user_id, salt, password_hash, recovery_code_hash,"
+    " salt_bin, password_hash_bin, recovery_code_hash_bin,"
+    " registered_from_ip, registered_at, status"
+)
+_IMPORTED_COLUMN_LIST = (
+    "email, user_id, salt, password_hash, recovery_code_hash,"
+    " NULL::bytea AS salt_bin, NULL::bytea AS password_hash_bin,"
+    " NULL::bytea AS recovery_code_hash_bin,"
+    " registered_from_ip, coalesce(registered_at, now()) AS registered_at,"
+    " coalesce(status, 0) AS status"
+)
+# This is used when STORE_BINARY_HASHES is enabled. Salts which
+# specify a non-default hashing method (and their password hashes)
+# are imported Base64 encoded.
+_IMPORTED_BINARY_COLUMN_LIST = (
+    "email, user_id,"
+    " CASE WHEN salt LIKE '$%' THEN salt END AS salt,"
+    " CASE WHEN salt LIKE '$%' THEN password_hash END AS password_hash,"
+    " NULL AS recovery_code_hash,"
+    " CASE WHEN salt NOT LIKE '$%' THEN decode(salt, 'base64') END AS salt_bin,"
+    " CASE WHEN salt NOT LIKE '$%' THEN decode(password_hash, 'base64') END"
+    " AS password_hash_bin,"
+    " decode(recovery_code_hash, 'base64') AS recovery_code_hash_bin,"
+    " registered_from_ip, coalesce(registered_at, now()) AS registered_at,"
+    " coalesce(status, 0) AS status"
+)
+
+# NOTE: The columns of the import table have the same types as the
+# columns of the `user_registration` table (this is required for
+# binary COPY), but they are nullable, so that rows with missing
+# values can be reported, instead of aborting the whole import.
+_CREATE_IMPORT_TABLE = f"""
+CREATE TEMPORARY TABLE {IMPORT_TABLE} (
+  email VARCHAR(255),
+  user_id VARCHAR(64),
+  salt VARCHAR(32),
+  password_hash VARCHAR(128),
+  recovery_code_hash VARCHAR(128),
+  registered_from_ip INET,
+  registered_at TIMESTAMP WITH TIME ZONE,
+  status SMALLINT,
+  problem TEXT
+)
+"""
+
+# Each statement marks the rows which have a problem. Only rows which
+# have not been marked already are checked.
+_VALIDATIONS = [
+    f"""
+    UPDATE {IMPORT_TABLE} SET problem = 'missing value'
+    WHERE problem IS NULL AND (
+      email IS NULL OR user_id IS NULL OR user_id = '' OR salt IS NULL
+      OR password_hash IS NULL OR recovery_code_hash IS NULL
+    )
+    """,
+    # This is the same check as `utils.is_invalid_email`.
+    f"""
+    UPDATE {IMPORT_TABLE} SET problem = 'invalid email'
+    WHERE problem IS NULL AND (
+      length(email) >= 255 OR email !~ '^[^@]+@[^@]+\\.[^@]+$'
+    )
+    """,
+    f"""
+    UPDATE {IMPORT_TABLE} t SET problem = 'duplicated email'
+    FROM (
+      SELECT email FROM {IMPORT_TABLE} GROUP BY email HAVING count(*) > 1
+    ) d
+    WHERE t.problem IS NULL AND t.email = d.email
+    """,
+    f"""
+    UPDATE {IMPORT_TABLE} t SET problem = 'duplicated user ID'
+    FROM (
+      SELECT user_id FROM {IMPORT_TABLE} GROUP BY user_id HAVING count(*) > 1
+    ) d
+    WHERE t.problem IS NULL AND t.user_id = d.user_id
+    """,
+    f"""
+    UPDATE {IMPORT_TABLE} t SET problem = 'user ID already registered'
+    FROM registered_user_id r
+    WHERE t.problem IS NULL AND t.user_id = r.user_id
+    """,
+]
+
+# This validation is used only when STORE_BINARY_HASHES is enabled,
+# because otherwise the values are imported as they are.
+_BASE64_VALIDATION = f"""
+UPDATE {IMPORT_TABLE} SET problem = 'invalid Base64 value'
+WHERE problem IS NULL AND (
+  (salt NOT LIKE '$%' AND (salt !~ '^[A-Za-z0-9+/]*={{0,2}}$' OR length(salt) % 4 <> 0))
+  OR (salt NOT LIKE '$%' AND (
+    password_hash !~ '^[A-Za-z0-9+/]*={{0,2}}$' OR length(password_hash) % 4 <> 0
+  ))
+  OR recovery_code_hash !~ '^[A-Za-z0-9+/]*={{0,2}}$'
+  OR length(recovery_code_hash) % 4 <> 0
+)
+"""
+
+_EMAIL_CONFLICTS = f"""
+UPDATE {IMPORT_TABLE} t SET problem = 'email already registered'
+FROM user_registration u
+WHERE t.problem IS NULL AND t.email = u.email
+"""
+
+_REGISTER_USER_IDS = f"""
+INSERT INTO registered_user_id (user_id, registered_at)
+SELECT user_id, coalesce(registered_at, now())
+FROM {IMPORT_TABLE}
+WHERE problem IS NULL
+"""
+
+
+def _get_imported_column_list() -> str:
+    if current_app.config["STORE_BINARY_HASHES"]:
+        return _IMPORTED_BINARY_COLUMN_LIST
+    return _IMPORTED_COLUMN_LIST
+
+
+def _get_copy_options(format: str, header: bool) -> str:
+    if format == "binary":
+        return "(FORMAT binary)"
+    return "(FORMAT csv, HEADER)" if header else "(FORMAT csv)"
+
+
+def export_registrations(output: BinaryIO, format: str = "csv") -> int:
+    """Write all user registrations to `output`, and return their number.
+
+    The rows are streamed from each shard with `COPY ... TO STDOUT`,
+    so that the memory usage does not depend on the number of rows.
+    """
+
+    engines = get_shard_engines()
+    if format == "binary" and len(engines) > 1:
+        # NOTE: Each binary COPY stream has its own header and
+        # trailer, and therefore the streams from different shards
+        # can not be concatenated.
+        raise ValueError("The binary format can not be used with multiple shards.")
+
+    count = 0
+    for i, engine in enumerate(engines):
+        with engine.connect() as connection:
+            cursor = connection.connection.driver_connection.cursor()
+            with cursor.copy(
+                f"COPY (SELECT {_EXPORTED_COLUMN_LIST} FROM user_registration)"
+                f" TO STDOUT {_get_copy_options(format, header=(i == 0))}"
+            ) as copy:
+                for data in copy:
+                    output.write(data)
+            count += cursor.rowcount
+
+    return count
+
+
+def _copy_into_import_table(connection, input: BinaryIO, format: str) -> None:
+    cursor = connection.connection.driver_connection.cursor()
+    with cursor.copy(
+        f"COPY {IMPORT_TABLE} ({_COLUMN_LIST})"
+        f" FROM STDIN {_get_copy_options(format, header=True)}"
+    ) as copy:
+        while data := input.read(_COPY_BLOCK_SIZE):
+            copy.write(data)
+
+
+def _merge_into_shards(connection, batch_size: int) -> None:
+    """Insert the valid rows from the import table into the shards.
+
+    Rows whose emails already exist in the shards are marked as
+    problematic, and their user IDs are unregistered.
+    """
+
+    from .models import UserRegistration, RegisteredUserId
+
+    shard_engines = get_shard_engines()
+    next_shard_engines = get_next_shard_engines()
+    select_batch = text(
+        f"SELECT {_get_imported_column_list()} FROM {IMPORT_TABLE}"
+        " WHERE problem IS NULL AND email > :last_email"
+        " ORDER BY email LIMIT :batch_size"
+    )
+    insert_rows = (
+        pg_insert(UserRegistration)
+        .on_conflict_do_nothing()
+        .returning(UserRegistration.email)
+    )
+    last_email = ""
+
+    while rows := [
+        dict(row) for row in connection.execute(
+            select_batch, {"last_email": last_email, "batch_size": batch_size}
+        ).mappings()
+    ]:
+        inserted = []
+        for shard_number, engine in enumerate(shard_engines):
+            shard_rows = [
+                row for row in rows
+                if get_shard_number(row["email"], len(shard_engines)) == shard_number
+            ]
+            if shard_rows:
+                with engine.begin() as shard_connection:
+                    inserted.extend(
+                        shard_connection.execute(insert_rows, shard_rows).scalars()
+                    )
+
+        inserted_emails = set(inserted)
+        rejected = [row for row in rows if row["email"] not in inserted_emails]
+        if rejected:
+            connection.execute(
+                text(
+                    f"UPDATE {IMPORT_TABLE} SET problem = 'email already registered'"
+                    " WHERE email = ANY(:emails)"
+                ),
+                {"emails": [row["email"] for row in rejected]},
+            )
+            connection.execute(
+                RegisteredUserId.__table__.delete().where(
+                    RegisteredUserId.user_id.in_([row["user_id"] for row in rejected])
+                )
+            )
+
+        for shard_number, engine in enumerate(next_shard_engines):
+            next_shard_rows = [
+                row for row in rows
+                if row["email"] in inserted_emails
+                and get_shard_number(row["email"], len(next_shard_engines)) == shard_number
+            ]
+            if next_shard_rows:
+                with engine.begin() as next_shard_connection:
+                    upsert_registrations(next_shard_connection, next_shard_rows)
+
+        connection.commit()
+        last_email = rows[-1]["email"]
+
+
+def import_registrations(
+    input: BinaryIO,
+    format: str = "csv",
+    report: Optional[BinaryIO] = None,
+    batch_size: int = 10000,
+) -> dict[str, int]:
+    """Import user registrations from `input`.
+
+    The rows are streamed with `COPY ... FROM STDIN` into a temporary
+    table, validated, and then merged into the `user_registration`
+    table. Rows which can not be imported (invalid rows, and rows
+    which conflict with existing registrations) are skipped, and if
+    `report` is given, they are written to it in CSV format. Returns
+    a dictionary with the number of imported rows (under the key
+    "imported"), and the number of skipped rows for each problem.
+
+    When `user_registration` is not sharded, the import is atomic.
+    Otherwise, the rows are inserted into the shards in batches.
+    """
+
+    with db.engine.connect() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {IMPORT_TABLE}"))
+        connection.execute(text(_CREATE_IMPORT_TABLE))
+        try:
+            _copy_into_import_table(connection, input, format)
+            connection.execute(text(f"CREATE INDEX ON {IMPORT_TABLE} (email)"))
+            connection.execute(text(f"ANALYZE {IMPORT_TABLE}"))
+            for validation in _VALIDATIONS:
+                connection.execute(text(validation))
+            if current_app.config["STORE_BINARY_HASHES"]:
+                connection.execute(text(_BASE64_VALIDATION))
+
+            if is_sharded() or get_next_shard_engines():
+                connection.execute(text(_REGISTER_USER_IDS))
+                connection.commit()
+                _merge_into_shards(connection, batch_size)
+            else:
+                connection.execute(text(_EMAIL_CONFLICTS))
+                connection.execute(text(_REGISTER_USER_IDS))
+                connection.execute(
+                    text(
+                        f"INSERT INTO user_registration ({_INSERTED_COLUMN_LIST})"
+                        f" SELECT {_get_imported_column_list()} FROM {IMPORT_TABLE}"
+                        " WHERE problem IS NULL"
+                    )
+                )
+
+            counts = {
+                problem or "imported": count
+                for problem, count in connection.execute(
+                    text(f"SELECT problem, count(*) FROM {IMPORT_TABLE} GROUP BY problem")
+                )
+            }
+            counts.setdefault("imported", 0)
+
+            if report is not None:
+                cursor = connection.connection.driver_connection.cursor()
+                with cursor.copy(
+                    f"COPY (SELECT email, user_id, problem FROM {IMPORT_TABLE}"
+                    " WHERE problem IS NOT NULL ORDER BY email)"
+                    " TO STDOUT (FORMAT csv, HEADER)"
+                ) as copy:
+                    for data in copy:
+                        report.write(data)
+
+            connection.execute(text(f"DROP TABLE {IMPORT_TABLE}"))
+            connection.commit()
+        except Exception:
+            # NOTE: The temporary table must be dropped, because the
+            # database connection will be returned to the pool.
+            connection.rollback()
+            connection.execute(text(f"DROP TABLE IF EXISTS {IMPORT_TABLE}"))
+            connection.commit()
+            raise
+
+    return counts
@@ -1,15 +1,21 @@
+import os
 import logging
+import csv
+import json
 import time
+import itertools
 import sys
 import click
 import signal
 import ipaddress
-import random
-from typing import Any
+from typing import Any, Callable, Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update, bindparam, any_, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.inspection import inspect
 from flask import current_app
 from flask.cli import with_appcontext
-from flask_sqlalchemy.model import Model
-from swpt_pythonlib.flask_signalbus import SignalBus, get_models_to_flush
+from swpt_pythonlib.flask_signalbus import get_models_to_flush
 from swpt_pythonlib.multiproc_utils import (
     spawn_worker_processes,
     try_unblock_signals,
@@ -18,7 +24,21 @@ from swpt_pythonlib.multiproc_utils import (
 from swpt_login.hydra import invalidate_credentials
 from swpt_login.models import UserRegistration
 from swpt_login.extensions import db
-from swpt_login.redis import set_for_period
+from swpt_login.sharding import (
+    execute_on_shards,
+    sync_to_next_shard,
+    reshard_registrations,
+    register_user_ids,
+    get_shard_engines,
+)
+from swpt_login.flushing import (
+    run_flush_worker,
+    get_signal_metrics,
+    FlushSupervisor,
+)
+from swpt_login.consistency import check_registrations
+from swpt_login.bulk import export_registrations, import_registrations, COPY_FORMATS
+from swpt_login.redis import set_for_period, replenish_user_id_pool
 
 
 @click.group("swpt_login")
@@ -48,6 +68,29 @@ def swpt_login():
         " variable will be used, defaulting to 2 seconds if empty."
     ),
 )
+@click.option(
+    "-m",
+    "--max-processes",
+    type=int,
+    help=(
+        "The maximum number of worker processes. If greater than the"
+        " number of worker processes, the number of processes will be"
+        " adjusted automatically, according to the number of pending"
+        " tasks. If not specified, the value of the FLUSH_MAX_PROCESSES"
+        " environment variable will be used, defaulting to 0 if empty"
+        " (no automatic adjustment)."
+    ),
+)
+@click.option(
+    "--max-wait",
+    type=float,
+    help=(
+        "When there are no pending tasks, the time between flushes will"
+        " gradually increase up to FLOAT seconds. If not specified, the"
+        " value of the FLUSH_MAX_PERIOD environment variable will be used,"
+        " defaulting to 10 seconds if empty."
+    ),
+)
 @click.option(
     "--quit-early",
     is_flag=True,
@@ -59,6 +102,8 @@ def flush(
     task_types: list[str],
     processes: int,
     wait: float,
+    max_processes: int,
+    max_wait: float,
     quit_early: bool,
 ) -> None:
     """Periodically process pending tasks.
@@ -87,101 +132,622 @@ def flush(
         if wait is not None
         else current_app.config["FLUSH_PERIOD"]
     )
+    max_processes = (
+        max_processes
+        if max_processes is not None
+        else current_app.config["FLUSH_MAX_PROCESSES"]
+    )
+    max_wait = (
+        max_wait
+        if max_wait is not None
+        else current_app.config["FLUSH_MAX_PERIOD"]
+    )
 
-    def _flush(
-        models_to_flush: list[type[Model]],
-        wait: float,
-    ) -> None:
-        from swpt_login import create_app
-
-        app = current_app if quit_early else create_app()
-        stopped = False
-
-        def stop(signum: Any = None, frame: Any = None) -> None:
-            nonlocal stopped
-            stopped = True
-
-        for sig in HANDLED_SIGNALS:
-            signal.signal(sig, stop)
-        try_unblock_signals()
-
-        with app.app_context():
-            signalbus: SignalBus = current_app.extensions["signalbus"]
-            time.sleep(wait * random.random())
-
-            while not stopped:
-                started_at = time.time()
-                try:
-                    count = signalbus.flushmany(models_to_flush)
-                except Exception:
-                    logger.exception("Caught error while processing pending tasks.")
-                    sys.exit(1)
-
-                if count > 0:
-                    logger.info("%i tasks have been successfully processed.", count)
-                else:
-                    logger.debug("0 tasks have been processed.")
-
-                seconds_to_sleep = max(0.0, wait + started_at - time.time())
-                if quit_early:
-                    break
-                time.sleep(seconds_to_sleep)
+    shard_count = (
+        max(processes, max_processes)
+        if current_app.config["APP_FLUSH_SHARDING"]
+        else 0
+    )
 
     if quit_early:
-        _flush(models_to_flush, wait)
+        run_flush_worker(models_to_flush, wait, max_wait, quit_early=True)
+    elif max_processes > processes:
+        FlushSupervisor(
+            models_to_flush=models_to_flush,
+            wait=wait,
+            max_wait=max_wait,
+            min_processes=processes,
+            max_processes=max_processes,
+            rows_per_process=current_app.config["APP_FLUSH_ROWS_PER_PROCESS"],
+            check_period=current_app.config["APP_FLUSH_SUPERVISOR_PERIOD"],
+            shard_count=shard_count,
+        ).run()
     else:
         spawn_worker_processes(
             processes=processes,
-            target=_flush,
+            target=run_flush_worker,
             models_to_flush=models_to_flush,
             wait=wait,
+            max_wait=max_wait,
+            shard_count=shard_count,
         )
 
     sys.exit(1)
 
 
+@swpt_login.command("maintain_user_id_pool")
+@with_appcontext
+@click.option(
+    "-w",
+    "--wait",
+    type=float,
+    help=(
+        "Check the pool every FLOAT seconds."
+        " If not specified, the value of the USER_ID_POOL_PERIOD environment"
+        " variable will be used, defaulting to 10 seconds if empty."
+    ),
+)
+@click.option(
+    "--quit-early",
+    is_flag=True,
+    default=False,
+    help="Exit after some time (mainly useful during testing).",
+)
+def maintain_user_id_pool(wait: float, quit_early: bool) -> None:
+    """Maintain a pool of pre-reserved user IDs.
+
+    Periodically removes reservations which are about to expire, and
+    reserves new user IDs, so that the number of reservations in the
+    pool equals USER_ID_POOL_SIZE.
+
+    """
+
+    logger = logging.getLogger(__name__)
+    wait = (
+        wait
+        if wait is not None
+        else current_app.config["USER_ID_POOL_PERIOD"]
+    )
+    stopped = False
+
+    def stop(signum: Any = None, frame: Any = None) -> None:
+        nonlocal stopped
+        stopped = True
+
+    for sig in HANDLED_SIGNALS:
+        signal.signal(sig, stop)
+    try_unblock_signals()
+
+    logger.info("Started maintaining the pool of pre-reserved user IDs.")
+    while not stopped:
+        started_at = time.time()
+        try:
+            count = replenish_user_id_pool()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Caught error while replenishing the user ID pool.")
+        else:
+            logger.info("%i pre-reserved user IDs are in the pool.", count)
+
+        if quit_early:
+            break
+        time.sleep(max(0.0, wait + started_at - time.time()))
+
+
+@swpt_login.command("show_signal_metrics")
+@with_appcontext
+@click.argument("task_types", nargs=-1)
+def show_signal_metrics(task_types: list[str]) -> None:
+    """Show the lag and the throughput of pending tasks processing.
+
+    If a list of TASK_TYPES is given, shows only metrics for these
+    types of tasks. If no TASK_TYPES are specified, shows metrics for
+    all types of tasks.
+    """
+
+    models = get_models_to_flush(current_app.extensions["signalbus"], task_types)
+    click.echo(json.dumps(get_signal_metrics(models), indent=2))
+
+
+@swpt_login.command("list_dead_signals")
+@with_appcontext
+@click.option(
+    "-l",
+    "--limit",
+    type=int,
+    default=100,
+    show_default=True,
+    help="Show at most INTEGER dead tasks of each type.",
+)
+@click.argument("task_types", nargs=-1)
+def list_dead_signals(task_types: list[str], limit: int) -> None:
+    """Show pending tasks which have failed too many times.
+
+    If a list of TASK_TYPES is given, shows only these types of dead
+    tasks. If no TASK_TYPES are specified, shows all dead tasks.
+    """
+
+    models = get_models_to_flush(current_app.extensions["signalbus"], task_types)
+    for model in models:
+        for obj in model.get_dead(limit):
+            primary_key = ", ".join(str(x) for x in inspect(obj).identity)
+            click.echo(
+                f"{model.__name__}({primary_key}) attempts={obj.attempts}"
+                f" dead_at={obj.dead_at.isoformat()} error={obj.last_error!r}"
+            )
+
+
+@swpt_login.command("requeue_dead_signals")
+@with_appcontext
+@click.argument("task_types", nargs=-1)
+def requeue_dead_signals(task_types: list[str]) -> None:
+    """Retry pending tasks which have failed too many times.
+
+    If a list of TASK_TYPES is given, requeues only these types of dead
+    tasks. If no TASK_TYPES are specified, requeues all dead tasks.
+    Some types of dead tasks (like EmailSignal) can not be requeued,
+    and are skipped.
+    """
+
+    models = get_models_to_flush(current_app.extensions["signalbus"], task_types)
+    for model in models:
+        if not model.can_requeue_dead:
+            click.echo(f"Dead {model.__name__} tasks can not be requeued. Skipped.")
+            continue
+
+        count = model.requeue_dead()
+        db.session.commit()
+        click.echo(f"{count} dead {model.__name__} tasks have been requeued.")
+
+
+@swpt_login.command("purge_dead_signals")
+@with_appcontext
+@click.argument("task_types", nargs=-1)
+def purge_dead_signals(task_types: list[str]) -> None:
+    """Delete pending tasks which have failed too many times.
+
+    If a list of TASK_TYPES is given, deletes only these types of dead
+    tasks. If no TASK_TYPES are specified, deletes all dead tasks.
+    """
+
+    models = get_models_to_flush(current_app.extensions["signalbus"], task_types)
+    for model in models:
+        count = model.purge_dead()
+        db.session.commit()
+        click.echo(f"{count} dead {model.__name__} tasks have been purged.")
+
+
+SUSPEND_USERS_STATEMENT = (
+    update(UserRegistration)
+    .where(UserRegistration.email == any_(bindparam("emails", type_=ARRAY(String))))
+    .values(status=1)
+    .returning(UserRegistration.email, UserRegistration.user_id)
+)
+
+RESUME_USERS_STATEMENT = (
+    update(UserRegistration)
+    .where(UserRegistration.email == any_(bindparam("emails", type_=ARRAY(String))))
+    .values(status=0)
+    .returning(UserRegistration.email, UserRegistration.user_id)
+)
+
+
+def _iter_email_batches(
+    user_emails: list[str], emails_file, batch_size: int, skip: int
+) -> Iterable[list[str]]:
+    emails = (
+        email.strip()
+        for email in itertools.chain(user_emails, emails_file or [])
+    )
+    emails = itertools.islice((e for e in emails if e), skip, None)
+    while batch := list(itertools.islice(emails, batch_size)):
+        yield batch
+
+
+def _read_checkpoint(checkpoint: Optional[str]) -> int:
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as f:
+        return int(f.read().strip() or "0")
+
+
+def _write_checkpoint(checkpoint: Optional[str], count: int) -> None:
+    if checkpoint is not None:
+        with open(f"{checkpoint}.tmp", "w") as f:
+            f.write(f"{count}\n")
+        os.replace(f"{checkpoint}.tmp", checkpoint)
+
+
+def _invalidate_credentials_concurrently(
+    user_ids: list[str], max_workers: int
+) -> list[tuple[str, Exception]]:
+    """Invalidate the credentials of users, over a bounded thread pool.
+
+    Returns a list of `(user_id, error)` tuples for the users whose
+    credentials could not be invalidated.
+    """
+
+    app = current_app._get_current_object()
+
+    def invalidate(user_id: str) -> Optional[Exception]:
+        with app.app_context():
+            try:
+                invalidate_credentials(user_id)
+            except Exception as e:
+                return e
+            return None
+
+    max_workers = min(len(user_ids), max_workers)
+    if max_workers <= 1:
+        errors = [invalidate(user_id) for user_id in user_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            errors = list(executor.map(invalidate, user_ids))
+
+    return [(u, e) for u, e in zip(user_ids, errors) if e is not None]
+
+
+def _change_registrations_in_batches(
+    statement,
+    user_emails: list[str],
+    emails_file,
+    batch_size: int,
+    checkpoint: Optional[str],
+    process_changed: Callable[[list], None] = lambda rows: None,
+) -> None:
+    logger = logging.getLogger(__name__)
+    processed = _read_checkpoint(checkpoint)
+    if processed:
+        logger.info("Resuming after %i processed emails.", processed)
+
+    changed = 0
+    for emails in _iter_email_batches(user_emails, emails_file, batch_size, processed):
+        rows = execute_on_shards(emails, statement)
+        db.session.commit()
+        sync_to_next_shard(*(row.email for row in rows))
+        process_changed(rows)
+
+        processed += len(emails)
+        changed += len(rows)
+        _write_checkpoint(checkpoint, processed)
+        logger.info(
+            "Processed %i emails, found %i user registrations.", processed, changed
+        )
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+_emails_file_option = click.option(
+    "-f",
+    "--file",
+    "emails_file",
+    type=click.File("r"),
+    help="Read user email addresses from this file (one per line), or from"
+    ' the standard input if "-" is given.',
+)
+_batch_size_option = click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1000,
+    show_default=True,
+    help="Update INTEGER user registrations at a time.",
+)
+_checkpoint_option = click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help=(
+        "Record the progress in this file, so that an interrupted run can"
+        " be resumed by running the same command again. The file is"
+        " removed when the command completes."
+    ),
+)
+
+
 @swpt_login.command("suspend_user_registrations")
 @with_appcontext
+@_emails_file_option
+@_batch_size_option
+@_checkpoint_option
+@click.option(
+    "-c",
+    "--concurrency",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Invalidate the credentials of up to INTEGER users in parallel.",
+)
+@click.option(
+    "--failures",
+    type=click.File("a"),
+    help=(
+        "Append the emails of the users whose credentials could not be"
+        " invalidated to this file. The file can be passed to --file"
+        " later, to retry the invalidation."
+    ),
+)
 @click.argument("user_emails", nargs=-1)
-def suspend_user_registrations(user_emails: list[str]) -> None:
+def suspend_user_registrations(
+    user_emails: list[str],
+    emails_file,
+    batch_size: int,
+    checkpoint: Optional[str],
+    concurrency: int,
+    failures,
+) -> None:
     """Suspend the registrations of users.
 
-    USER_EMAILS should be a list of user email addresses.
+    USER_EMAILS should be a list of user email addresses. More email
+    addresses can be read from a file (see the --file option). The
+    credentials of all found users are invalidated, even if their
+    registrations have been suspended already.
     """
 
-    for email in user_emails:
-        user = (
-            UserRegistration.query
-            .filter_by(email=email, status=0)
-            .with_for_update()
-            .one_or_none()
-        )
-        if user:
-            assert user.status == 0
-            invalidate_credentials(user.user_id)
-            user.status = 1
-            db.session.commit()
+    logger = logging.getLogger(__name__)
+
+    def invalidate(rows: list) -> None:
+        emails = {row.user_id: row.email for row in rows}
+        for user_id, error in _invalidate_credentials_concurrently(
+            list(emails), concurrency
+        ):
+            logger.warning(
+                "Failed to invalidate the credentials of %s: %s",
+                emails[user_id],
+                error,
+            )
+            if failures:
+                failures.write(f"{emails[user_id]}\n")
+                failures.flush()
+
+    _change_registrations_in_batches(
+        SUSPEND_USERS_STATEMENT,
+        user_emails,
+        emails_file,
+        batch_size,
+        checkpoint,
+        invalidate,
+    )
 
 
 @swpt_login.command("resume_user_registrations")
 @with_appcontext
+@_emails_file_option
+@_batch_size_option
+@_checkpoint_option
 @click.argument("user_emails", nargs=-1)
-def resume_user_registrations(user_emails: list[str]) -> None:
+def resume_user_registrations(
+    user_emails: list[str],
+    emails_file,
+    batch_size: int,
+    checkpoint: Optional[str],
+) -> None:
     """Resume suspended user registrations.
 
-    USER_EMAILS should be a list of user email addresses.
+    USER_EMAILS should be a list of user email addresses. More email
+    addresses can be read from a file (see the --file option).
     """
 
-    for email in user_emails:
-        user = (
-            UserRegistration.query
-            .filter_by(email=email)
-            .with_for_update()
-            .one_or_none()
-        )
-        if user:
-            user.status = 0
-            db.session.commit()
+    _change_registrations_in_batches(
+        RESUME_USERS_STATEMENT,
+        user_emails,
+        emails_file,
+        batch_size,
+        checkpoint,
+    )
+
+
+@swpt_login.command("verify_consistency")
+@with_appcontext
+@click.option(
+    "-r",
+    "--rate",
+    type=float,
+    default=50.0,
+    show_default=True,
+    help="Send at most FLOAT requests per second to the resource server.",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Send up to INTEGER requests to the resource server in parallel.",
+)
+@_checkpoint_option
+@click.argument("output_file", type=click.File("w"), default="-")
+def verify_consistency(
+    output_file, rate: float, concurrency: int, checkpoint: Optional[str]
+) -> None:
+    """Find registered users who do not exist on the resource server.
+
+    Checks each user registration against the resource server, and
+    writes the inconsistencies to OUTPUT_FILE (the standard output if
+    not specified), in CSV format: email, user ID, and either
+    "missing" (the user does not exist on the resource server), or
+    "unknown" (the check has failed).
+
+    """
+
+    writer = csv.writer(output_file, lineterminator="\n")
+
+    def report(email: str, user_id: str, exists: Optional[bool]) -> None:
+        writer.writerow([email, user_id, "unknown" if exists is None else "missing"])
+        output_file.flush()
+
+    counts = check_registrations(report, rate, concurrency, checkpoint)
+    logging.getLogger(__name__).info(
+        "Checked %i users: %i missing, %i unknown.",
+        counts["checked"],
+        counts["missing"],
+        counts["unknown"],
+    )
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+@swpt_login.command("reshard_user_registrations")
+@with_appcontext
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1000,
+    show_default=True,
+    help="Copy INTEGER user registrations at a time.",
+)
+def reshard_user_registrations(batch_size: int) -> None:
+    """Copy user registrations to the next shards.
+
+    Copies all user registrations from the databases listed in
+    POSTGRES_SHARD_URLS to the databases listed in
+    POSTGRES_NEXT_SHARD_URLS, and deletes the registrations in the
+    next shards which do not exist in the current shards. Before
+    running this command, POSTGRES_NEXT_SHARD_URLS must be set for all
+    running processes.
+
+    Also, registers the user IDs of the registrations which have been
+    added without registering their user IDs (by processes running an
+    old version during an upgrade).
+
+    """
+
+    registered = register_user_ids(batch_size)
+    if registered > 0:
+        click.echo(f"Registered {registered} missing user IDs.")
+
+    copied, deleted = reshard_registrations(batch_size)
+    db.session.rollback()
+    click.echo(f"Copied {copied} user registrations, deleted {deleted} stale copies.")
+
+
+@swpt_login.command("export_users")
+@with_appcontext
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(COPY_FORMATS),
+    default="csv",
+    show_default=True,
+    help="The format of the exported data (PostgreSQL COPY format).",
+)
+@click.argument("output_file", type=click.File("wb"), default="-")
+def export_users(output_file, format: str) -> None:
+    """Export all user registrations to OUTPUT_FILE.
+
+    If OUTPUT_FILE is not specified, the data will be written to the
+    standard output. The exported data can be imported with the
+    `import_users` command.
+
+    """
+
+    logger = logging.getLogger(__name__)
+    try:
+        count = export_registrations(output_file, format)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    logger.info("Exported %i user registrations.", count)
+
+
+@swpt_login.command("import_users")
+@with_appcontext
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(COPY_FORMATS),
+    default="csv",
+    show_default=True,
+    help="The format of the imported data (PostgreSQL COPY format).",
+)
+@click.option(
+    "-r",
+    "--report",
+    type=click.File("wb"),
+    help="Write the rows which have not been imported to this file (CSV).",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=10000,
+    show_default=True,
+    help="When sharding is used, import INTEGER user registrations at a time.",
+)
+@click.argument("input_file", type=click.File("rb"), default="-")
+def import_users(input_file, format: str, report, batch_size: int) -> None:
+    """Import user registrations from INPUT_FILE.
+
+    If INPUT_FILE is not specified, the data will be read from the
+    standard input. The data should be in the format produced by the
+    `export_users` command (CSV data must have a header row). In CSV
+    data, the "registered_from_ip", "registered_at", and "status"
+    columns may be empty. Invalid rows, and rows whose email or user
+    ID is already registered, are not imported.
+
+    """
+
+    counts = import_registrations(input_file, format, report, batch_size)
+    click.echo(f"Imported {counts.pop('imported')} user registrations.")
+    for problem, count in sorted(counts.items()):
+        click.echo(f"Skipped {count} rows ({problem}).")
+
+
+@swpt_login.command("convert_user_hashes")
+@with_appcontext
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1000,
+    show_default=True,
+    help="Convert INTEGER user registrations at a time.",
+)
+@click.option(
+    "-s",
+    "--sleep",
+    type=float,
+    default=0.0,
+    show_default=True,
+    help="Sleep FLOAT seconds after each batch, so as to reduce the load.",
+)
+@click.option(
+    "--to-text",
+    is_flag=True,
+    default=False,
+    help="Convert the binary values back to Base64 encoded values.",
+)
+def convert_user_hashes(batch_size: int, sleep: float, to_text: bool) -> None:
+    """Store user password salts and hashes in binary form.
+
+    Converts the Base64 encoded password salts, password hashes, and
+    recovery code hashes to binary values, in small batches, so that
+    the command can be run on a live system. Password hashes whose
+    salts specify a non-default hashing method are not converted. When
+    STORE_BINARY_HASHES is enabled, new and changed rows are stored in
+    binary form, and therefore the conversion needs to be run only
+    once, after STORE_BINARY_HASHES has been enabled on all running
+    processes. (Before switching STORE_BINARY_HASHES off, the command
+    should be run with the --to-text option.)
+
+    """
+
+    logger = logging.getLogger(__name__)
+    for engine in get_shard_engines():
+        processed = 0
+        last_email = ""
+        while True:
+            with engine.begin() as connection:
+                last_email = UserRegistration.convert_hashes(
+                    connection, last_email, batch_size, to_binary=not to_text
+                )
+            if last_email is None:
+                break
+
+            processed += batch_size
+            logger.info("Processed about %i user registrations.", processed)
+            time.sleep(sleep)
 
 
 @swpt_login.command("ban_ip_addresses")
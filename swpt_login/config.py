@@ -14,6 +14,10 @@ def _str_or_nothing(s: str) -> Union[str, None]:
     return s or None
 
 
+def _int_or_nothing(s: str) -> Union[int, None]:
+    return int(s) if s else None
+
+
 class MetaEnvReader(type):
     def __init__(cls, name, bases, dct):
         """MetaEnvReader class initializer.
@@ -50,7 +54,18 @@ class Configuration(metaclass=MetaEnvReader):
     SQLALCHEMY_ECHO = False
 
     POSTGRES_CONNECTION_POOL_SIZE = 0
+    POSTGRES_POOL_WARMUP_CONNECTIONS = 0
+    POSTGRES_POOL_PRE_PING = False
+    POSTGRES_POOL_RECYCLE_SECONDS = 0
     POSTGRES_REPLICA_URL = ""
+    POSTGRES_REPLICA_URLS = ""
+    POSTGRES_REPLICA_WEIGHTS = ""
+    POSTGRES_REPLICA_MAX_LAG_SECONDS = 0.0
+    POSTGRES_PREPARE_THRESHOLD: _int_or_nothing = 5
+    POSTGRES_TRANSACTION_POOLING = False
+    POSTGRES_SHARD_URLS = ""
+    POSTGRES_NEXT_SHARD_URLS = ""
+    STORE_BINARY_HASHES = False
 
     REDIS_URL = "redis://localhost:6379/0"
     REDIS_CLUSTER_URL = ""
@@ -64,6 +79,8 @@ class Configuration(metaclass=MetaEnvReader):
     MAIL_DEFAULT_SENDER: str = None
     MAIL_MAX_EMAILS: int = None
     MAIL_ASCII_ATTACHMENTS = False
+    MAIL_USE_OUTBOX = False
+    MAIL_OUTBOX_IMMEDIATE_ATTEMPT = True
 
     CAPTCHA_SITEKEY = "10000000-ffff-ffff-ffff-000000000001"
     CAPTCHA_SITEKEY_SECRET = "0x0000000000000000000000000000000000000000"
@@ -113,9 +130,20 @@ class Configuration(metaclass=MetaEnvReader):
     API_AUTH2_TOKEN_URL = "https://hydra/oauth2/token"
     API_RESOURCE_SERVER = "https://resource-server"
     API_TIMEOUT_SECONDS = 5
+    API_CACHE_ACCESS_TOKEN = False
+    API_ACCESS_TOKEN_EXPIRATION_MARGIN_SECONDS = 60
+
+    WEBSERVER_THREADS = 3
 
     FLUSH_PROCESSES = 1
     FLUSH_PERIOD = 2.0
+    FLUSH_MAX_PROCESSES = 0
+    FLUSH_MAX_PERIOD = 10.0
+
+    USER_ID_POOL_SIZE = 0
+    USER_ID_POOL_PERIOD = 10.0
+    USER_ID_POOL_SAFETY_MARGIN_SECONDS = 3600
+    USER_ID_POOL_RESERVATION_SECONDS = 24 * 60 * 60
 
     # Limit Flask content lengths.
     MAX_CONTENT_LENGTH = 16384
@@ -142,6 +170,7 @@ class Configuration(metaclass=MetaEnvReader):
     CLIENT_LANGUAGE_COOKIE_NAME = "client_lang"
     COMPUTER_CODE_COOKIE_NAME = "user_cc"
     LOGIN_VERIFICATION_COOKIE_NAME = "user_lv"
+    LSN_COOKIE_NAME = "user_lsn"
     PASSWORD_MIN_LENGTH = 12
     PASSWORD_MAX_LENGTH = 64
     SEND_FILE_MAX_AGE_DEFAULT = 12096000  # max-age for static files
@@ -149,6 +178,26 @@ class Configuration(metaclass=MetaEnvReader):
     BABEL_DEFAULT_TIMEZONE = "UTC"
     APP_FLUSH_ACTIVATE_USERS_BURST_COUNT = 5
     APP_FLUSH_DEACTIVATE_USERS_BURST_COUNT = 5
+    APP_FLUSH_EMAILS_BURST_COUNT = 5
+    APP_FLUSH_MAX_CONCURRENCY = 10
+    APP_FLUSH_LISTEN = True
+    APP_FLUSH_ROWS_PER_PROCESS = 100
+    APP_FLUSH_SUPERVISOR_PERIOD = 5.0
+    APP_FLUSH_STATS_PERIOD = 5.0
+    APP_FLUSH_SHARDING = True
+    APP_FLUSH_SHARD_LEASE_SECONDS = 30.0
+    APP_SIGNAL_MAX_ATTEMPTS = 30
+    APP_SIGNAL_RETRY_MIN_SECONDS = 5.0
+    APP_SIGNAL_RETRY_MAX_SECONDS = 3600.0
+    APP_REPLICA_EJECT_SECONDS = 30.0
+    APP_REPLICA_LAG_CHECK_SECONDS = 5.0
+    APP_REPLICA_LSN_WAIT_SECONDS = 0.2
+    APP_READ_YOUR_WRITES_SECONDS = 300
+    APP_MIGRATION_LOCK_TIMEOUT_SECONDS = 2.0
+    APP_HTTP_POOL_CONNECTIONS = 4
+    APP_HTTP_POOL_MAXSIZE = 0  # zero means "derive from the number of threads"
+    APP_HTTP_POOL_BLOCK = False
+    APP_EXPOSE_METRICS = False
 
     # NOTE: We may make SSL requests to the debtors/creditors Web API.
     # However, those requests will be to an internal hostname, not to
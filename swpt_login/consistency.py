@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+from urllib.parse import urljoin
+from sqlalchemy import select
+from flask import current_app
+from .extensions import requests_session
+from .models import UserRegistration, _get_api_base_url
+from .sharding import get_shard_engines
+
+
+class RateLimiter:
+    """Limit the rate at which some operation is performed.
+
+    `wait()` blocks until the operation can be performed again, so
+    that the operation is performed at most `rate` times per second,
+    on average. A non-positive `rate` means no limit. Thread-safe.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0.0 else 0.0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(now, self.next_at)
+            self.next_at = wait_until + self.interval
+
+        time.sleep(max(0.0, wait_until - now))
+
+
+def user_exists(user_id: str) -> Optional[bool]:
+    """Check whether the user exists on the resource server.
+
+    Returns `None` if the existence of the user could not be checked.
+    """
+
+    try:
+        response = requests_session.get(
+            url=urljoin(_get_api_base_url(), f"{user_id}/"),
+            verify=current_app.config["APP_VERIFY_SSL_CERTIFICATES"],
+        )
+    except (requests.ConnectionError, requests.Timeout):
+        return None
+
+    if response.status_code == 200:
+        return True
+    if response.status_code == 404:
+        return False
+    return None
+
+
+def read_checkpoint(path: Optional[str]) -> dict[str, str]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (TypeError, FileNotFoundError):
+        return {}
+
+
+def write_checkpoint(path: Optional[str], checkpoint: dict[str, str]) -> None:
+    if path is not None:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def _iter_registration_chunks(
+    shard_number: int, after_email: str, chunk_size: int
+) -> Iterable[list]:
+    """Iterate over the `(email, user_id)` rows of a shard, ordered by email.
+
+    Each chunk of `chunk_size` rows is fetched with a separate short
+    query (continuing after the last email of the previous chunk), so
+    that no database transaction stays open while the users are being
+    checked.
+    """
+
+    engine = get_shard_engines()[shard_number]
+    last_email = after_email
+    while True:
+        with engine.connect() as connection:
+            chunk = connection.execute(
+                select(UserRegistration.email, UserRegistration.user_id)
+                .where(UserRegistration.email > last_email)
+                .order_by(UserRegistration.email)
+                .limit(chunk_size)
+            ).all()
+
+        if not chunk:
+            break
+
+        yield chunk
+        last_email = chunk[-1].email
+
+
+def check_registrations(
+    report: Callable[[str, str, Optional[bool]], None],
+    rate: float,
+    concurrency: int,
+    checkpoint_path: Optional[str] = None,
+    chunk_size: int = 100,
+) -> dict[str, int]:
+    """Check that all registered users exist on the resource server.
+
+    `report(email, user_id, exists)` is called for each user who does
+    not exist (`exists` is `False`), or whose existence could not be
+    checked (`exists` is `None`). The resource server is queried at
+    most `rate` times per second, with up to `concurrency` parallel
+    requests. When `checkpoint_path` is given, the progress is
+    recorded in this file after each chunk of users, and if the file
+    already exists, the check is resumed from the recorded position.
+    Returns the number of checked, missing, and unknown users.
+    """
+
+    logger = logging.getLogger(__name__)
+    app = current_app._get_current_object()
+    rate_limiter = RateLimiter(rate)
+    checkpoint = read_checkpoint(checkpoint_path)
+    counts = {"checked": 0, "missing": 0, "unknown": 0}
+
+    def check(user_id: str) -> Optional[bool]:
+        rate_limiter.wait()
+        with app.app_context():
+            return user_exists(user_id)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for shard_number in range(len(get_shard_engines())):
+            shard_key = str(shard_number)
+            for chunk in _iter_registration_chunks(
+                shard_number, checkpoint.get(shard_key, ""), chunk_size
+            ):
+                results = executor.map(check, [row.user_id for row in chunk])
+                for row, exists in zip(chunk, results):
+                    counts["checked"] += 1
+                    if not exists:
+                        counts["missing" if exists is False else "unknown"] += 1
+                        report(row.email, row.user_id, exists)
+
+                checkpoint[shard_key] = chunk[-1].email
+                write_checkpoint(checkpoint_path, checkpoint)
+                logger.info(
+                    "Checked %i users (%i missing, %i unknown).",
+                    counts["checked"],
+                    counts["missing"],
+                    counts["unknown"],
+                )
+
+    return counts
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from sqlalchemy.exc import TimeoutError, OperationalError, InterfaceError
+from sqlalchemy.pool import QueuePool
+from .extensions import db
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A `QueuePool` which measures the connection checkouts.
+
+    For every checkout, measures the time spent waiting for a
+    connection (including the time needed to open a new connection),
+    and whether an overflow connection was needed.
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_timeouts = 0
+        self._overflow_checkouts = 0
+        self._max_overflow_seen = 0
+        self._checkout_seconds = 0.0
+        self._max_checkout_seconds = 0.0
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self._checkout_timeouts += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started_at
+            overflow = self.overflow()
+            with self._stats_lock:
+                self._checkouts += 1
+                self._checkout_seconds += seconds
+                self._max_checkout_seconds = max(self._max_checkout_seconds, seconds)
+                self._max_overflow_seen = max(self._max_overflow_seen, overflow)
+                if overflow > 0:
+                    self._overflow_checkouts += 1
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "checkouts": self._checkouts,
+                "checkout_timeouts": self._checkout_timeouts,
+                "avg_checkout_seconds": (
+                    self._checkout_seconds / self._checkouts
+                    if self._checkouts > 0
+                    else None
+                ),
+                "max_checkout_seconds": self._max_checkout_seconds,
+                "overflow_checkouts": self._overflow_checkouts,
+                "max_overflow": self._max_overflow_seen,
+            }
+
+
+def get_db_pool_stats() -> list[dict]:
+    """Return usage statistics for this process' database connection pools.
+
+    For every database bind, reports the pool size, the number of
+    idle and used connections, the current overflow, and for
+    instrumented pools, checkout statistics.
+    """
+
+    stats = []
+    for bind_key, engine in list(db.engines.items()):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):  # pragma: no cover
+            continue
+
+        pool_stats = {
+            "bind": bind_key or "primary",
+            "pool_size": pool.size(),
+            "idle_connections": pool.checkedin(),
+            "used_connections": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+        if isinstance(pool, InstrumentedQueuePool):
+            pool_stats.update(pool.get_stats())
+        stats.append(pool_stats)
+
+    return stats
+
+
+def warm_up_pools(app) -> None:
+    """Prepare the database connection pools of a new worker process.
+
+    Connections inherited from the parent process are abandoned (not
+    closed, because they are still used by the parent process). Then,
+    for every database bind, POSTGRES_POOL_WARMUP_CONNECTIONS
+    connections are opened in advance, so that the first requests
+    served by the worker do not need to wait for new connections.
+    """
+
+    logger = logging.getLogger(__name__)
+    warmup_connections = app.config["POSTGRES_POOL_WARMUP_CONNECTIONS"]
+
+    with app.app_context():
+        for bind_key, engine in list(db.engines.items()):
+            engine.dispose(close=False)
+
+            pool_size = engine.pool.size()
+            count = (
+                min(warmup_connections, pool_size)
+                if pool_size > 0
+                else warmup_connections
+            )
+            connections = []
+            try:
+                for _ in range(count):
+                    connections.append(engine.connect())
+            except (OperationalError, InterfaceError):
+                logger.warning(
+                    "Failed to warm up the connection pool for %s.",
+                    bind_key or "the primary database",
+                )
+            finally:
+                for connection in connections:
+                    connection.close()
@@ -1,8 +1,10 @@
 import re
-from flask import render_template
+import logging
+from flask import render_template, current_app
 from flask_babel import gettext
 from flask_mail import Message
-from .extensions import mail
+from .extensions import db, mail
+from .models import EmailSignal
 
 PARAGRAPHS_SEPARATOR_REGEX = re.compile(r"(?:\r?\n){2,}", re.MULTILINE)
 SIGNATURE_START_REGEX = re.compile(r"\A-- \r?\n", re.MULTILINE)
@@ -27,6 +29,57 @@ def text_to_html(text: str) -> str:
     return "".join(html_paragraphs)
 
 
+def send_message(msg: Message, urgent: bool = False) -> None:
+    """Send an email message, possibly through the outbox.
+
+    When MAIL_USE_OUTBOX is enabled, the message is added to the
+    `email_signal` table, and will be sent by the `flush_emails`
+    process. For urgent messages (like login verification codes), an
+    immediate sending attempt will be made, unless
+    MAIL_OUTBOX_IMMEDIATE_ATTEMPT is disabled.
+    """
+
+    config = current_app.config
+    if not config["MAIL_USE_OUTBOX"]:
+        mail.send(msg)
+        return
+
+    (recipient,) = msg.recipients
+    signal = EmailSignal(
+        recipient=recipient,
+        subject=msg.subject,
+        body=msg.body,
+        html=msg.html,
+    )
+    db.session.add(signal)
+    db.session.commit()
+
+    if urgent and config["MAIL_OUTBOX_IMMEDIATE_ATTEMPT"]:
+        email_id = signal.email_id
+        if signal := (
+            EmailSignal.query
+            .filter_by(email_id=email_id)
+            .with_for_update(skip_locked=True)
+            .one_or_none()
+        ):
+            try:
+                EmailSignal.send_signalbus_message(signal)
+                db.session.delete(signal)
+            except EmailSignal.SendingError:
+                logger = logging.getLogger(__name__)
+                logger.warning(
+                    "SendingError occurred while trying to send email %i."
+                    " The email will be sent later.",
+                    email_id,
+                )
+
+                # The flush workers have missed the notification sent
+                # when the row was inserted, because it was locked.
+                EmailSignal.notify_flush_workers()
+
+        db.session.commit()
+
+
 def send_duplicate_registration_email(email):
     text = render_template(
         "duplicate_registration.txt",
@@ -38,7 +91,7 @@ def send_duplicate_registration_email(email):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_change_password_email(email, choose_password_link):
@@ -53,7 +106,7 @@ def send_change_password_email(email, choose_password_link):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_change_password_success_email(email, change_password_page):
@@ -68,7 +121,7 @@ def send_change_password_success_email(email, change_password_page):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_confirm_registration_email(email, register_link):
@@ -83,7 +136,7 @@ def send_confirm_registration_email(email, register_link):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_verification_code_email(
@@ -101,7 +154,7 @@ def send_verification_code_email(
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg, urgent=True)
 
 
 def send_change_email_address_request_email(email, change_password_page):
@@ -115,7 +168,7 @@ def send_change_email_address_request_email(email, change_password_page):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_change_email_address_email(email, change_email_address_link):
@@ -130,7 +183,7 @@ def send_change_email_address_email(email, change_email_address_link):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_change_recovery_code_email(email, change_recovery_code_link):
@@ -145,7 +198,7 @@ def send_change_recovery_code_email(email, change_recovery_code_link):
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
 
 
 def send_delete_account_email(
@@ -165,4 +218,4 @@ def send_delete_account_email(
         body=text,
         html=text_to_html_document(text),
     )
-    mail.send(msg)
+    send_message(msg)
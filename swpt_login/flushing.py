@@ -0,0 +1,799 @@
+import os
+import logging
+import time
+import sys
+import math
+import socket
+import signal
+import random
+import multiprocessing
+from collections import Counter
+from typing import Any, Optional
+import psycopg
+import redis
+from sqlalchemy import select, func, text, event
+from flask import current_app
+from flask_sqlalchemy.model import Model
+from swpt_pythonlib.multiproc_utils import try_unblock_signals, HANDLED_SIGNALS
+from swpt_login.extensions import db, redis_store
+from swpt_login import models
+from swpt_login.models import get_now_utc
+
+
+class SignalListener:
+    """Wait for notifications about newly inserted signals.
+
+    The signal tables have triggers which send a notification (on a
+    channel named after the table) whenever new rows are inserted.
+    Notifications are also sent when a signal which could not be
+    processed immediately after its insertion becomes available to
+    the flush workers (see `notify_flush_workers`). A dedicated
+    database connection listens on those channels.
+    """
+
+    def __init__(self, models: list[type[Model]]):
+        self.channels = [model.__table__.name for model in models]
+        self.connection: Optional[psycopg.Connection] = None
+
+    def _get_connection(self) -> psycopg.Connection:
+        if self.connection is None or self.connection.closed:
+            url = db.engine.url.set(drivername="postgresql")
+            connection = psycopg.connect(
+                url.render_as_string(hide_password=False),
+                autocommit=True,
+            )
+            for channel in self.channels:
+                connection.execute(f'LISTEN "{channel}"')
+            self.connection = connection
+
+        return self.connection
+
+    def start(self) -> None:
+        """Start listening, so that no notifications will be missed.
+
+        This should be called before the first flush. If the database
+        connection fails, `wait` will try to reconnect.
+        """
+
+        try:
+            self._get_connection()
+        except psycopg.Error:
+            logger = logging.getLogger(__name__)
+            logger.warning("Failed to listen for notifications.", exc_info=True)
+            self.close()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until notified, or until `timeout` seconds have passed.
+
+        Returns `True` if a notification has been received. If the
+        database connection fails, this simply sleeps for `timeout`
+        seconds, and tries to reconnect next time.
+        """
+
+        try:
+            connection = self._get_connection()
+            notified = False
+            for _ in connection.notifies(timeout=timeout, stop_after=1):
+                notified = True
+
+            if notified:
+                # Consume the notifications that have arrived in the
+                # meantime. They all will be handled by one flush.
+                for _ in connection.notifies(timeout=0.0):
+                    pass
+
+            return notified
+
+        except psycopg.Error:
+            logger = logging.getLogger(__name__)
+            logger.warning("Failed to listen for notifications.", exc_info=True)
+            self.close()
+            time.sleep(timeout)
+            return False
+
+    def close(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg.Error:  # pragma: no cover
+                pass
+            self.connection = None
+
+
+class FlushScheduler:
+    """Decide how long to wait before the next flush.
+
+    When a flush has filled the burst of at least one signal model,
+    there are probably more signals waiting, so the next flush should
+    start immediately. When some signals have been processed, the
+    next flush starts after `min_wait` seconds. When nothing has been
+    processed, the waiting time doubles after every flush, up to
+    `max_wait` seconds.
+    """
+
+    def __init__(self, min_wait: float, max_wait: float):
+        self.min_wait = min_wait
+        self.max_wait = max(min_wait, max_wait)
+        self.current_wait = min_wait
+
+    def get_next_wait(self, count: int, full: bool = False) -> float:
+        logger = logging.getLogger(__name__)
+
+        if full:
+            self.current_wait = 0.0
+            logger.debug(
+                "Processed %i tasks (a full burst). Flushing again immediately.",
+                count,
+            )
+        elif count > 0:
+            self.current_wait = self.min_wait
+            logger.debug(
+                "Processed %i tasks. Flushing again in %.3f seconds.",
+                count,
+                self.current_wait,
+            )
+        else:
+            self.current_wait = min(
+                self.max_wait, max(self.min_wait, 2 * self.current_wait)
+            )
+            logger.debug(
+                "Processed 0 tasks. Backing off to %.3f seconds.",
+                self.current_wait,
+            )
+
+        return self.current_wait
+
+
+STATS_KEY_PREFIX = "flushstats:"
+STATS_INDEX_KEY_PREFIX = "flushstats-workers:"
+
+
+def _get_error_label(error: Exception) -> str:
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return str(status_code)
+    if isinstance(error, models.SignalSendingError):
+        return "connection"
+    return "other"
+
+
+class FlushStats:
+    """Collect statistics about the work done by a flush worker.
+
+    The statistics are periodically published to Redis (one hash per
+    signal model and worker process), with an expiration time, so
+    that the statistics of dead worker processes disappear. For each
+    signal model, the worker processes which have published
+    statistics are registered in a sorted set (scored by the
+    expiration time of their statistics), so that the statistics can
+    be read without scanning the Redis keyspace.
+    """
+
+    def __init__(self, models_to_flush: list[type[Model]]):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.totals = {m.__table__.name: Counter() for m in models_to_flush}
+        self.window_processed = Counter()
+        self.window_errors = {m.__table__.name: Counter() for m in models_to_flush}
+        self.window_started_at = time.time()
+        self.statements = 0
+
+    def watch_engine(self, engine) -> None:
+        """Count the SQL statements executed by `engine`."""
+
+        def count_statement(*args, **kwargs):
+            self.statements += 1
+
+        event.listen(engine, "before_cursor_execute", count_statement)
+
+    def record(self, model: type[Model], processed: int, failures: list) -> None:
+        name = model.__table__.name
+        totals = self.totals[name]
+        totals["processed"] += processed
+        totals["failed"] += len(failures)
+        for _, error in failures:
+            label = _get_error_label(error)
+            totals[f"errors:{label}"] += 1
+            self.window_errors[name][label] += 1
+
+        self.window_processed[name] += processed
+
+    def publish(self, force: bool = False) -> None:
+        config = current_app.config
+        now = time.time()
+        elapsed = now - self.window_started_at
+        if elapsed < config["APP_FLUSH_STATS_PERIOD"] and not force:
+            return
+
+        ttl = max(
+            int(3 * config["APP_FLUSH_STATS_PERIOD"]),
+            int(3 * config["FLUSH_MAX_PERIOD"]),
+            10,
+        )
+        try:
+            pipeline = redis_store.pipeline()
+            for name, totals in self.totals.items():
+                key = f"{STATS_KEY_PREFIX}{name}:{self.worker_id}"
+                mapping = dict(totals)
+                mapping["rate"] = self.window_processed[name] / max(elapsed, 1e-6)
+                for k in totals:
+                    if k.startswith("errors:"):
+                        label = k[len("errors:"):]
+                        mapping[f"error_rate:{label}"] = (
+                            self.window_errors[name][label] / max(elapsed, 1e-6)
+                        )
+                mapping["updated_at"] = now
+                mapping["statements"] = self.statements
+                pipeline.hset(key, mapping=mapping)
+                pipeline.expire(key, ttl)
+                index_key = f"{STATS_INDEX_KEY_PREFIX}{name}"
+                pipeline.zadd(index_key, {self.worker_id: now + ttl})
+                pipeline.expire(index_key, ttl)
+            pipeline.execute()
+        except redis.RedisError:
+            logging.getLogger(__name__).warning(
+                "Failed to publish flush statistics to Redis."
+            )
+
+        self.window_processed.clear()
+        for errors in self.window_errors.values():
+            errors.clear()
+        self.window_started_at = now
+
+
+def read_flush_stats(table_name: str) -> dict[str, dict]:
+    """Return the published statistics of the live flush workers.
+
+    Returns a dictionary which maps worker IDs to the statistics
+    published by the worker, for the given signal table.
+    """
+
+    index_key = f"{STATS_INDEX_KEY_PREFIX}{table_name}"
+    pipeline = redis_store.pipeline()
+    pipeline.zremrangebyscore(index_key, "-inf", time.time())
+    pipeline.zrange(index_key, 0, -1)
+    worker_ids = pipeline.execute()[1]
+
+    pipeline = redis_store.pipeline()
+    for worker_id in worker_ids:
+        pipeline.hgetall(f"{STATS_KEY_PREFIX}{table_name}:{worker_id}")
+
+    return {
+        worker_id: stats
+        for worker_id, stats in zip(worker_ids, pipeline.execute())
+        if stats
+    }
+
+
+def clear_flush_stats(table_name: str) -> None:
+    """Delete the published statistics for the given signal table."""
+
+    index_key = f"{STATS_INDEX_KEY_PREFIX}{table_name}"
+    worker_ids = redis_store.zrange(index_key, 0, -1)
+    pipeline = redis_store.pipeline()
+    for worker_id in worker_ids:
+        pipeline.delete(f"{STATS_KEY_PREFIX}{table_name}:{worker_id}")
+    pipeline.delete(index_key)
+    pipeline.execute()
+
+
+def get_signal_metrics(models: list[type[Model]]) -> dict[str, dict]:
+    """Return monitoring metrics for each one of the signal models.
+
+    For each model, returns an estimate of the number of rows (based
+    on the table statistics), the age of the oldest signal which is
+    waiting to be processed, the number of signals processed per
+    second, and the number of errors per second by status code (both
+    summed over all flush processes, for the last statistics period).
+    The cumulative numbers of processed signals and errors are shown
+    for each flush process.
+    """
+
+    now = get_now_utc()
+    metrics = {}
+
+    for model in models:
+        name = model.__table__.name
+        row_count_estimate = db.session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+            {"name": name},
+        ).scalar()
+        oldest_inserted_at = db.session.execute(
+            select(func.min(model.inserted_at)).where(model.dead_at.is_(None))
+        ).scalar()
+
+        processes = [
+            {
+                "worker": worker_id,
+                "processed": int(stats.get("processed", 0)),
+                "failed": int(stats.get("failed", 0)),
+                "rate": float(stats.get("rate", 0.0)),
+                "errors": {
+                    k[len("errors:"):]: int(v)
+                    for k, v in stats.items()
+                    if k.startswith("errors:")
+                },
+                "error_rates": {
+                    k[len("error_rate:"):]: float(v)
+                    for k, v in stats.items()
+                    if k.startswith("error_rate:")
+                },
+            }
+            for worker_id, stats in read_flush_stats(name).items()
+        ]
+
+        errors_per_second: dict[str, float] = {}
+        for process in processes:
+            for label, rate in process["error_rates"].items():
+                errors_per_second[label] = errors_per_second.get(label, 0.0) + rate
+
+        metrics[model.__name__] = {
+            "row_count_estimate": max(0, int(row_count_estimate or 0)),
+            "oldest_age_seconds": (
+                (now - oldest_inserted_at).total_seconds()
+                if oldest_inserted_at is not None
+                else 0.0
+            ),
+            "processed_per_second": sum(p["rate"] for p in processes),
+            "errors_per_second": errors_per_second,
+            "processes": processes,
+        }
+
+    db.session.commit()
+    return metrics
+
+
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_shard_expression(model: type[Model], shard_count: int):
+    """Return an SQL expression for the shard number of a signal.
+
+    Signals are sharded by user ID, unless the model specifies another
+    column name in its `signalbus_shard_key` attribute.
+    """
+
+    column = getattr(model, getattr(model, "signalbus_shard_key", "user_id"))
+    return func.hashtext(column).op("&")(0x7FFFFFFF) % shard_count
+
+
+class ShardLeases:
+    """Distribute hash shards of the signal tables among flush processes.
+
+    Each shard is owned by the process which holds the shard's lease
+    (a Redis key with an expiration time). Every process owns no more
+    than its fair share of shards (the number of shards divided by the
+    number of live processes), renews the leases of its own shards,
+    and claims shards whose leases have expired (for example, because
+    their owner has died). When Redis is not available, the process
+    flushes all shards. This is safe, because rows are locked with
+    "FOR UPDATE SKIP LOCKED" anyway.
+    """
+
+    def __init__(self, models: list[type[Model]], shard_count: int):
+        group = ",".join(sorted(m.__table__.name for m in models))
+        self.shard_count = shard_count
+        self.prefix = f"flushshard:{group}:{shard_count}"
+        self.workers_key = f"{self.prefix}:workers"
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.owned: set[int] = set()
+
+    def _get_lease_key(self, shard: int) -> str:
+        return f"{self.prefix}:shard:{shard}"
+
+    def _get_lease_seconds(self) -> int:
+        config = current_app.config
+        return max(
+            int(config["APP_FLUSH_SHARD_LEASE_SECONDS"]),
+            int(3 * config["FLUSH_MAX_PERIOD"]),
+        )
+
+    def update(self) -> Optional[list[int]]:
+        """Renew, release, and claim shard leases.
+
+        Returns a list of the owned shards, or `None` if all shards
+        should be flushed.
+        """
+
+        if self.shard_count <= 1:
+            return None
+
+        try:
+            self._update_leases()
+        except redis.RedisError:
+            logging.getLogger(__name__).warning(
+                "Failed to update shard leases. Flushing all shards."
+            )
+            self.owned = set()
+            return None
+
+        return sorted(self.owned)
+
+    def _update_leases(self) -> None:
+        logger = logging.getLogger(__name__)
+        ttl = self._get_lease_seconds()
+        renew = redis_store.register_script(_RENEW_LEASE_SCRIPT)
+        release = redis_store.register_script(_RELEASE_LEASE_SCRIPT)
+
+        # The live workers are registered in a sorted set, scored by
+        # the time of their last heartbeat.
+        now = time.time()
+        pipeline = redis_store.pipeline()
+        pipeline.zadd(self.workers_key, {self.worker_id: now})
+        pipeline.zremrangebyscore(self.workers_key, "-inf", now - ttl)
+        pipeline.zrange(self.workers_key, 0, -1)
+        pipeline.expire(self.workers_key, ttl)
+        workers = sorted(pipeline.execute()[2])
+        fair_share = math.ceil(self.shard_count / max(1, len(workers)))
+
+        for shard in sorted(self.owned):
+            if not renew(keys=[self._get_lease_key(shard)], args=[self.worker_id, ttl]):
+                logger.warning("Lost the lease for shard %i.", shard)
+                self.owned.remove(shard)
+
+        while len(self.owned) > fair_share:
+            shard = max(self.owned)
+            release(keys=[self._get_lease_key(shard)], args=[self.worker_id])
+            self.owned.remove(shard)
+            logger.info("Released shard %i.", shard)
+
+        # Each worker starts claiming from a different shard (according
+        # to its position in the list of workers), so that the workers
+        # do not compete for the same shards.
+        position = workers.index(self.worker_id) if self.worker_id in workers else 0
+        offset = (position * fair_share) % self.shard_count
+        for i in range(self.shard_count):
+            if len(self.owned) >= fair_share:
+                break
+            shard = (offset + i) % self.shard_count
+            if shard not in self.owned and redis_store.set(
+                    self._get_lease_key(shard), self.worker_id, nx=True, ex=ttl
+            ):
+                self.owned.add(shard)
+                logger.info("Claimed shard %i.", shard)
+
+    def release_all(self) -> None:
+        try:
+            release = redis_store.register_script(_RELEASE_LEASE_SCRIPT)
+            for shard in self.owned:
+                release(keys=[self._get_lease_key(shard)], args=[self.worker_id])
+            redis_store.zrem(self.workers_key, self.worker_id)
+        except redis.RedisError:
+            pass
+
+        self.owned = set()
+
+
+def flush_signals(
+    model: type[Model],
+    stats: Optional[FlushStats] = None,
+    shards: Optional[list[int]] = None,
+    shard_count: int = 0,
+) -> tuple[int, int]:
+    """Process one burst of due signals.
+
+    Selects up to `signalbus_burst_count` signals which are due for a
+    (re)try, skipping signals locked by other workers. When `shards`
+    is given, only signals from these shards are selected.
+    Successfully processed signals are deleted, and failed signals are
+    scheduled for a retry. Returns a `(processed, failed)` tuple.
+    """
+
+    if shards is not None and not shards:
+        return 0, 0
+
+    burst_count = int(model.signalbus_burst_count)
+    query = (
+        select(model)
+        .where(model.dead_at.is_(None))
+        .where(model.next_attempt_at <= get_now_utc())
+    )
+    if shards is not None:
+        query = query.where(
+            get_shard_expression(model, shard_count).in_(shards)
+        )
+    objects = db.session.execute(
+        query
+        .order_by(model.next_attempt_at)
+        .limit(burst_count)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    if not objects:
+        db.session.commit()
+        return 0, 0
+
+    processed, failures = model.process_signals(objects)
+    for obj in processed:
+        db.session.delete(obj)
+    for obj, error in failures:
+        model.schedule_retry(obj, error)
+
+    db.session.commit()
+    if stats:
+        stats.record(model, len(processed), failures)
+
+    return len(processed), len(failures)
+
+
+def is_full_burst(model: type[Model], processed: int, failed: int) -> bool:
+    return processed + failed >= int(model.signalbus_burst_count)
+
+
+def run_flush_worker(
+    models_to_flush: list[type[Model]],
+    wait: float,
+    max_wait: Optional[float] = None,
+    shard_count: int = 0,
+    quit_early: bool = False,
+) -> None:
+    """Process pending signals until stopped.
+
+    The time between two flushes is decided by a `FlushScheduler`,
+    ranging from zero (when the last flush has processed a full burst
+    of some signal model), to `max_wait` seconds (when there was
+    nothing to do for a while). While the bursts of some signal models
+    come back full, only these models are flushed, but all models are
+    flushed at least once every `wait` seconds. During the waiting, the worker wakes up as soon as new
+    signals have been inserted (if APP_FLUSH_LISTEN is enabled, and
+    POSTGRES_TRANSACTION_POOLING is disabled).
+
+    When `shard_count` is greater than 1, the signals are split into
+    `shard_count` shards (by the hash of the user ID), and the worker
+    processes only the shards that it owns (see `ShardLeases`).
+    """
+
+    from swpt_login import create_app
+
+    logger = logging.getLogger(__name__)
+    app = current_app if quit_early else create_app()
+    stopped = False
+
+    def stop(signum: Any = None, frame: Any = None) -> None:
+        nonlocal stopped
+        stopped = True
+
+    for sig in HANDLED_SIGNALS:
+        signal.signal(sig, stop)
+    try_unblock_signals()
+
+    with app.app_context():
+        listener = (
+            SignalListener(models_to_flush)
+            if (
+                current_app.config["APP_FLUSH_LISTEN"]
+                and not current_app.config["POSTGRES_TRANSACTION_POOLING"]
+                and not quit_early
+            )
+            else None
+        )
+        scheduler = FlushScheduler(
+            min_wait=wait,
+            max_wait=wait if max_wait is None else max_wait,
+        )
+        stats = FlushStats(models_to_flush)
+        stats.watch_engine(db.engine)
+        shard_leases = ShardLeases(models_to_flush, shard_count)
+        time.sleep(wait * random.random())
+        if listener:
+            listener.start()
+        full_models: list[type[Model]] = []
+        all_flushed_at = 0.0
+
+        try:
+            while not stopped:
+                started_at = time.time()
+                if full_models and started_at - all_flushed_at < wait:
+                    flushed_models = full_models
+                else:
+                    flushed_models = models_to_flush
+                    all_flushed_at = started_at
+
+                full_models = []
+                count = 0
+                failed_count = 0
+                shards = shard_leases.update()
+                try:
+                    for model in flushed_models:
+                        processed, failed = flush_signals(
+                            model, stats, shards, shard_count
+                        )
+                        count += processed
+                        failed_count += failed
+                        if is_full_burst(model, processed, failed):
+                            full_models.append(model)
+                except Exception:
+                    logger.exception("Caught error while processing pending tasks.")
+                    sys.exit(1)
+
+                if count > 0:
+                    logger.info("%i tasks have been successfully processed.", count)
+                else:
+                    logger.debug("0 tasks have been processed.")
+                if failed_count > 0:
+                    logger.warning("%i tasks have failed.", failed_count)
+                stats.publish()
+
+                next_wait = scheduler.get_next_wait(
+                    count + failed_count, full=bool(full_models)
+                )
+                seconds_to_sleep = max(0.0, next_wait + started_at - time.time())
+                if quit_early and not full_models:
+                    break
+                if seconds_to_sleep <= 0.0:
+                    continue
+                if listener:
+                    listener.wait(seconds_to_sleep)
+                else:
+                    time.sleep(seconds_to_sleep)
+        finally:
+            stats.publish(force=True)
+            shard_leases.release_all()
+            if listener:
+                listener.close()
+
+
+def measure_queue_depth(models: list[type[Model]], limit: int) -> int:
+    """Return the number of pending signals, counting up to `limit`.
+
+    Counting is limited, so that the query remains cheap even when
+    there is a huge backlog.
+    """
+
+    depth = 0
+    now = get_now_utc()
+    for model in models:
+        pending = (
+            select(model)
+            .where(model.dead_at.is_(None))
+            .where(model.next_attempt_at <= now)
+            .limit(limit)
+            .subquery()
+        )
+        depth += db.session.execute(
+            select(func.count()).select_from(pending)
+        ).scalar()
+
+    db.session.remove()
+
+    # NOTE: We must not leave open database connections when worker
+    # processes are forked, because the workers could mess them up.
+    db.engine.dispose()
+    return depth
+
+
+class FlushSupervisor:
+    """Run a variable number of flush worker processes.
+
+    Periodically measures the number of pending signals, and starts
+    or stops worker processes, so that there is one process per
+    `rows_per_process` pending signals, but no less than
+    `min_processes` and no more than `max_processes` processes. Dead
+    worker processes are replaced.
+    """
+
+    def __init__(
+        self,
+        models_to_flush: list[type[Model]],
+        wait: float,
+        max_wait: float,
+        min_processes: int,
+        max_processes: int,
+        rows_per_process: int,
+        check_period: float,
+        shard_count: int = 0,
+    ):
+        self.models_to_flush = models_to_flush
+        self.shard_count = shard_count
+        self.wait = wait
+        self.max_wait = max_wait
+        self.min_processes = max(1, min_processes)
+        self.max_processes = max(self.min_processes, max_processes)
+        self.rows_per_process = max(1, rows_per_process)
+        self.check_period = check_period
+        self.workers: list[multiprocessing.Process] = []
+
+    def _start_worker(self) -> None:
+        worker = multiprocessing.Process(
+            target=run_flush_worker,
+            kwargs=dict(
+                models_to_flush=self.models_to_flush,
+                wait=self.wait,
+                max_wait=self.max_wait,
+                shard_count=self.shard_count,
+            ),
+        )
+        worker.start()
+        self.workers.append(worker)
+
+    def _stop_worker(self) -> None:
+        worker = self.workers.pop()
+        worker.terminate()
+        worker.join()
+
+    def _reap_dead_workers(self) -> None:
+        logger = logging.getLogger(__name__)
+        alive = []
+        for worker in self.workers:
+            if worker.is_alive():
+                alive.append(worker)
+            else:
+                logger.warning(
+                    "Flush worker process %s exited with code %s.",
+                    worker.pid,
+                    worker.exitcode,
+                )
+        self.workers = alive
+
+    def get_desired_processes(self, depth: int) -> int:
+        desired = math.ceil(depth / self.rows_per_process)
+        return min(self.max_processes, max(self.min_processes, desired))
+
+    def scale(self, depth: int) -> None:
+        logger = logging.getLogger(__name__)
+        self._reap_dead_workers()
+        current = len(self.workers)
+        desired = self.get_desired_processes(depth)
+
+        if desired > current:
+            logger.info(
+                "%i pending tasks. Scaling up from %i to %i flush processes.",
+                depth,
+                current,
+                desired,
+            )
+            for _ in range(desired - current):
+                self._start_worker()
+
+        elif desired < current:
+            # Scale down gradually, one process at a time.
+            logger.info(
+                "%i pending tasks. Scaling down from %i to %i flush processes.",
+                depth,
+                current,
+                current - 1,
+            )
+            self._stop_worker()
+
+        else:
+            logger.debug(
+                "%i pending tasks. Keeping %i flush processes.", depth, current
+            )
+
+    def run(self) -> None:
+        logger = logging.getLogger(__name__)
+        stopped = False
+
+        def stop(signum: Any = None, frame: Any = None) -> None:
+            nonlocal stopped
+            stopped = True
+
+        for sig in HANDLED_SIGNALS:
+            signal.signal(sig, stop)
+        try_unblock_signals()
+
+        depth_limit = self.max_processes * self.rows_per_process
+        try:
+            while not stopped:
+                try:
+                    depth = measure_queue_depth(self.models_to_flush, depth_limit)
+                except Exception:
+                    logger.exception("Caught error while measuring queue depth.")
+                    depth = 0
+
+                self.scale(depth)
+                time.sleep(self.check_period)
+        finally:
+            while self.workers:
+                self._stop_worker()
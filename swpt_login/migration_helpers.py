@@ -0,0 +1,158 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+from alembic import op
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# The SQLSTATE code of the "lock_not_available" error, which is raised
+# when `lock_timeout` expires.
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def _is_lock_timeout(error: OperationalError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE
+
+
+def _format_lock_timeout(seconds: float) -> str:
+    return f"{int(seconds * 1000)}ms"
+
+
+@contextmanager
+def _temporary_lock_timeout(seconds: float):
+    bind = op.get_bind()
+    saved = bind.execute(text("SHOW lock_timeout")).scalar()
+    bind.execute(text(f"SET lock_timeout = '{_format_lock_timeout(seconds)}'"))
+    try:
+        yield
+    finally:
+        bind.execute(text(f"SET lock_timeout = '{saved}'"))
+
+
+def execute_with_retry(
+    statement: str,
+    lock_timeout: float = 2.0,
+    attempts: int = 10,
+    retry_delay: float = 1.0,
+) -> None:
+    """Execute a DDL statement in its own transaction, with a lock timeout.
+
+    If the lock timeout expires, the statement is retried, with
+    exponentially increasing delays between the attempts. Must be
+    called outside of `autocommit_block()`.
+    """
+
+    logger = logging.getLogger(__name__)
+    with op.get_context().autocommit_block(), _temporary_lock_timeout(lock_timeout):
+        bind = op.get_bind()
+        for attempt in range(1, attempts + 1):
+            try:
+                bind.execute(text(statement))
+                return
+            except OperationalError as e:
+                if not _is_lock_timeout(e) or attempt == attempts:
+                    raise
+                delay = retry_delay * 2 ** (attempt - 1)
+                logger.warning(
+                    "Lock timeout (attempt %i of %i). Retrying in %.1f seconds.",
+                    attempt,
+                    attempts,
+                    delay,
+                )
+                time.sleep(delay)
+
+
+def create_index_concurrently(
+    index_name: str, table_name: str, columns: list, **kw
+) -> None:
+    """Create an index without locking the table for writes.
+
+    A previous failed attempt to create the index concurrently may
+    have left an invalid index, which is dropped first. Must be called
+    outside of `autocommit_block()`. Additional keyword arguments are
+    passed to `op.create_index`.
+    """
+
+    # NOTE: While the index is being created, other transactions are
+    # not blocked, and therefore there is no need to time out.
+    with op.get_context().autocommit_block(), _temporary_lock_timeout(0):
+        is_valid = op.get_bind().execute(
+            text(
+                "SELECT indisvalid FROM pg_index"
+                " WHERE indexrelid = to_regclass(:name)"
+            ),
+            {"name": index_name},
+        ).scalar()
+        if is_valid is False:
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kw,
+        )
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    """Drop an index without locking the table for writes.
+
+    Must be called outside of `autocommit_block()`.
+    """
+
+    with op.get_context().autocommit_block(), _temporary_lock_timeout(0):
+        op.drop_index(
+            index_name,
+            table_name=table_name,
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def backfill_in_batches(
+    batch_statement: str,
+    first_key: Any = "",
+    batch_size: int = 1000,
+    sleep_seconds: float = 0.1,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Process all rows of a table in small batches.
+
+    `batch_statement` is executed repeatedly, with the `last_key` and
+    `batch_size` parameters. It must process (update, or copy to
+    another table) up to `batch_size` rows whose keys are greater than
+    `last_key`, in key order, and must return one row with two
+    columns: the biggest processed key, and the number of processed
+    rows. The first batch receives `first_key` as `last_key`. The
+    backfill ends when a batch processes no rows.
+
+    Each batch is executed and committed in its own transaction, so
+    that rows are not locked for long, and the table does not bloat as
+    much. Because the batches are selected by key (not by scanning
+    for unprocessed rows), each batch reads only `batch_size` rows
+    from the key's index. After each batch, the backfill sleeps for
+    `sleep_seconds`, so as to not overload the database. Must be
+    called outside of `autocommit_block()`. Returns the number of
+    processed rows.
+    """
+
+    statement = text(batch_statement)
+    last_key = first_key
+    total = 0
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            last_key, count = bind.execute(
+                statement, {"last_key": last_key, "batch_size": batch_size}
+            ).one()
+            if not count:
+                break
+            total += count
+            if progress:
+                progress(total)
+            time.sleep(sleep_seconds)
+
+    return total
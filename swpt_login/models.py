@@ -1,19 +1,70 @@
+import base64
 import logging
+import random
+import smtplib
 import requests
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Optional
 from urllib.parse import urljoin
-from sqlalchemy import text
+from sqlalchemy import text, select, update, delete, func, tuple_, and_
 from sqlalchemy.inspection import inspect
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.dialects.postgresql import INET, insert as pg_insert
 from flask import current_app
-from .extensions import db, requests_session
+from flask_mail import Message
+from .extensions import db, mail, requests_session
+from .sharding import (
+    is_sharded,
+    execute_on_shard,
+    get_shard_number,
+    get_shard_engines,
+    get_next_shard_engines,
+    upsert_registrations,
+)
 
 
 def get_now_utc():
     return datetime.now(tz=timezone.utc)
 
 
+def _store_binary_hashes() -> bool:
+    return current_app.config["STORE_BINARY_HASHES"]
+
+
+def get_password_values(salt: str, password_hash: str) -> dict:
+    """Return the `UserRegistration` column values for a password.
+
+    When STORE_BINARY_HASHES is enabled, the salt and the hash are
+    stored in binary form, unless the salt specifies a non-default
+    hashing method.
+    """
+
+    if _store_binary_hashes() and not salt.startswith("$"):
+        return dict(
+            salt=None,
+            password_hash=None,
+            salt_bin=base64.b64decode(salt),
+            password_hash_bin=base64.b64decode(password_hash),
+        )
+    return dict(
+        salt=salt,
+        password_hash=password_hash,
+        salt_bin=None,
+        password_hash_bin=None,
+    )
+
+
+def get_recovery_code_values(recovery_code_hash: str) -> dict:
+    """Return the `UserRegistration` column values for a recovery code."""
+
+    if _store_binary_hashes():
+        return dict(
+            recovery_code_hash=None,
+            recovery_code_hash_bin=base64.b64decode(recovery_code_hash),
+        )
+    return dict(recovery_code_hash=recovery_code_hash, recovery_code_hash_bin=None)
+
+
 def _get_api_base_url() -> str:
     api_resource_server = current_app.config["API_RESOURCE_SERVER"]
     api_reserve_user_id_path = current_app.config["API_RESERVE_USER_ID_PATH"]
@@ -45,9 +96,12 @@ class ChooseRowsMixin:
 class UserRegistration(db.Model):
     email = db.Column(db.String(255), primary_key=True)
     user_id = db.Column(db.String(64), nullable=False)
-    salt = db.Column(db.String(32), nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    recovery_code_hash = db.Column(db.String(128), nullable=False)
+    salt = db.Column(db.String(32))
+    password_hash = db.Column(db.String(128))
+    recovery_code_hash = db.Column(db.String(128))
+    salt_bin = db.Column(db.LargeBinary)
+    password_hash_bin = db.Column(db.LargeBinary)
+    recovery_code_hash_bin = db.Column(db.LargeBinary)
     registered_from_ip = db.Column(INET)
     registered_at = db.Column(
         db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc,
@@ -81,6 +135,23 @@ class UserRegistration(db.Model):
         # without removing their corresponding `UserRegistration` rows
         # from the login database.
         db.Index("idx_user_registration_user_id", user_id, unique=True),
+
+        # This index duplicates the primary key index, but it includes
+        # all the columns needed for checking user's credentials, so
+        # that credential lookups can be performed as index-only scans
+        # (no heap fetches).
+        db.Index(
+            "idx_user_registration_credentials",
+            email,
+            postgresql_include=[
+                "user_id",
+                "salt",
+                "password_hash",
+                "salt_bin",
+                "password_hash_bin",
+                "status",
+            ],
+        ),
         {
             "comment": (
                 'Represents a registered user. The columns "salt", '
@@ -91,14 +162,451 @@ class UserRegistration(db.Model):
                 'hashing method. The salt IS NOT used when calculating the '
                 '"recovery_code_hash". The "recovery_code_hash" is always '
                 'calculated using the default hashing method (Scrypt N=128, '
-                'r=8, p=1, dklen=32), and an empty string as salt.'
+                'r=8, p=1, dklen=32), and an empty string as salt. The '
+                '"salt_bin", "password_hash_bin", and "recovery_code_hash_bin" '
+                'columns contain the same values in binary form (the salt '
+                'must use the default hashing method). When a binary value '
+                'is not NULL, the corresponding Base64 encoded value is '
+                'NULL, and vice versa.'
+            ),
+        },
+    )
+
+    # NOTE: The following methods change user registrations with a
+    # single `UPDATE/DELETE ... RETURNING` statement, without loading
+    # ORM objects. When `user_registration` is not sharded, the caller
+    # is responsible for committing the transaction.
+
+    @classmethod
+    def change_password(cls, email: str, salt: str, password_hash: str) -> str:
+        """Change user's password salt and hash, and return the user ID.
+
+        Raises `NoResultFound` if the user does not exist.
+        """
+
+        return execute_on_shard(
+            email,
+            update(cls)
+            .where(cls.email == email)
+            .values(get_password_values(salt, password_hash))
+            .returning(cls.user_id),
+        ).scalar_one()
+
+    @classmethod
+    def change_recovery_code_hash(cls, email: str, recovery_code_hash: str) -> str:
+        """Change user's recovery code hash, and return the user ID.
+
+        Raises `NoResultFound` if the user does not exist.
+        """
+
+        return execute_on_shard(
+            email,
+            update(cls)
+            .where(cls.email == email)
+            .values(get_recovery_code_values(recovery_code_hash))
+            .returning(cls.user_id),
+        ).scalar_one()
+
+    @classmethod
+    def delete_verified(cls, email: str, credentials) -> Optional[str]:
+        """Delete user's registration, and return the user ID.
+
+        The registration will be deleted only if user's password hash
+        still equals the password hash in `credentials` (that is: the
+        password has been verified, and has not been changed since
+        then). Otherwise, `None` will be returned.
+        """
+
+        return execute_on_shard(
+            email,
+            delete(cls)
+            .where(
+                cls.email == email,
+                cls.password_hash.is_not_distinct_from(credentials.password_hash),
+                cls.password_hash_bin.is_not_distinct_from(
+                    credentials.password_hash_bin
+                ),
+            )
+            .returning(cls.user_id),
+        ).scalar_one_or_none()
+
+    @classmethod
+    def convert_hashes(
+        cls, connection, after_email: str, limit: int, to_binary: bool = True
+    ) -> Optional[str]:
+        """Convert the hashes of up to `limit` registrations.
+
+        The registrations whose emails come after `after_email` are
+        converted, in email order. When `to_binary` is `False`, binary
+        values are converted back to Base64 encoded values. Returns the
+        last processed email, or `None` if there are no more
+        registrations. The caller is responsible for committing the
+        transaction.
+        """
+
+        batch = (
+            select(cls.email)
+            .where(cls.email > after_email)
+            .order_by(cls.email)
+            .limit(limit)
+            .subquery()
+        )
+        last_email = connection.execute(select(func.max(batch.c.email))).scalar()
+        if last_email is None:
+            return None
+
+        in_batch = and_(cls.email > after_email, cls.email <= last_email)
+        if to_binary:
+            connection.execute(
+                update(cls)
+                .where(
+                    in_batch,
+                    cls.password_hash.is_not(None),
+                    cls.salt.not_like("$%"),
+                )
+                .values(
+                    salt_bin=func.decode(cls.salt, "base64"),
+                    password_hash_bin=func.decode(cls.password_hash, "base64"),
+                    salt=None,
+                    password_hash=None,
+                )
+            )
+            connection.execute(
+                update(cls)
+                .where(in_batch, cls.recovery_code_hash.is_not(None))
+                .values(
+                    recovery_code_hash_bin=func.decode(cls.recovery_code_hash, "base64"),
+                    recovery_code_hash=None,
+                )
+            )
+        else:
+            connection.execute(
+                update(cls)
+                .where(in_batch, cls.password_hash_bin.is_not(None))
+                .values(
+                    salt=func.encode(cls.salt_bin, "base64"),
+                    password_hash=func.encode(cls.password_hash_bin, "base64"),
+                    salt_bin=None,
+                    password_hash_bin=None,
+                )
+            )
+            connection.execute(
+                update(cls)
+                .where(in_batch, cls.recovery_code_hash_bin.is_not(None))
+                .values(
+                    recovery_code_hash=func.encode(cls.recovery_code_hash_bin, "base64"),
+                    recovery_code_hash_bin=None,
+                )
+            )
+
+        return last_email
+
+
+class RegisteredUserId(db.Model):
+    user_id = db.Column(db.String(64), primary_key=True)
+    registered_at = db.Column(
+        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+    )
+
+    __table_args__ = (
+        {
+            "comment": (
+                "Contains the user IDs of all registered users. Because the"
+                " user_registration table may be split into several shards"
+                " (based on the email's hash), the uniqueness of user IDs"
+                " can not be guaranteed by a unique index on the"
+                " user_registration table. This table is never sharded,"
+                " and guarantees the global uniqueness of user IDs."
+            ),
+        },
+    )
+
+
+class ReservedUserId(db.Model):
+    user_id = db.Column(db.String(64), primary_key=True)
+    reservation_id = db.Column(db.String(100), primary_key=True)
+    valid_until = db.Column(db.TIMESTAMP(timezone=True), nullable=False)
+    reserved_at = db.Column(
+        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+    )
+
+    __table_args__ = (
+        db.Index("idx_reserved_user_id_valid_until", valid_until),
+        {
+            "comment": (
+                "Represents a pre-reserved user ID, which will be assigned"
+                " to a new user on sign up. This allows new users to sign"
+                " up without waiting for the resource server to reserve"
+                " an user ID for them."
             ),
         },
     )
 
+    @classmethod
+    def claim(cls, valid_until: datetime) -> Optional[tuple[str, str]]:
+        """Remove one reservation from the pool, and return it.
+
+        Only reservations that will remain valid until `valid_until`
+        can be claimed. Returns an `(user_id, reservation_id)` tuple,
+        or `None` if the pool is empty. Note that the caller is
+        responsible for committing the transaction.
+        """
+
+        chosen = (
+            select(cls.user_id, cls.reservation_id)
+            .where(cls.valid_until > valid_until)
+            .order_by(cls.valid_until)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        row = db.session.execute(
+            delete(cls)
+            .where(tuple_(cls.user_id, cls.reservation_id).in_(chosen))
+            .returning(cls.user_id, cls.reservation_id)
+        ).one_or_none()
+
+        return (row.user_id, row.reservation_id) if row else None
+
+    @classmethod
+    def delete_expiring(cls, valid_until: datetime) -> int:
+        """Delete reservations that would expire before `valid_until`."""
+
+        result = db.session.execute(
+            delete(cls).where(cls.valid_until <= valid_until)
+        )
+        return result.rowcount
+
+    @classmethod
+    def count(cls) -> int:
+        return db.session.execute(select(func.count()).select_from(cls)).scalar()
+
+
+DUPLICATED_USER_ERROR_MESSAGE = (
+    "Duplicated email or user ID. This may happen if a user has"
+    " attempted to sign up more than once simultaneously, with the same"
+    " email address (duplicated email). In this case, this error is a"
+    " single rare event which does not cause any problems. However,"
+    " this error also occurs when an already existing user ID is"
+    " assigned to a new user, which signals that a serious database"
+    " inconsistency has been prevented. If this is the case, this error"
+    " will continue to show up, again and again."
+)
+
+
+class SignalSendingError(Exception):
+    """Failed delivery of a signal."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _deliver_concurrently(deliver, objects: list) -> list[tuple]:
+    """Call `deliver(obj)` for each object, over a bounded thread pool.
+
+    Returns a list of `(result, error)` tuples, one for each object,
+    in the same order. When the delivery of an object fails with
+    `SignalSendingError`, `error` will be the exception instance.
+    """
+
+    app = current_app._get_current_object()
+
+    def deliver_in_app_context(obj):
+        with app.app_context():
+            try:
+                return deliver(obj), None
+            except SignalSendingError as e:
+                return None, e
+
+    max_workers = min(len(objects), app.config["APP_FLUSH_MAX_CONCURRENCY"])
+    if max_workers <= 1:
+        return [deliver_in_app_context(obj) for obj in objects]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(deliver_in_app_context, objects))
+
+
+class ConcurrentDeliveryMixin:
+    """Deliver signals in bursts, making the HTTP requests concurrently.
+
+    Models must implement the `deliver_signal` class method, which
+    makes the HTTP request and returns the response's status code,
+    and the `apply_delivery` class method, which updates the database
+    according to the status code. Models which can update the
+    database more efficiently for the whole burst, may override the
+    `apply_deliveries` class method instead. Note that
+    `deliver_signal` will be called from worker threads, and
+    therefore must not use the database session.
+    """
+
+    @classmethod
+    def send_signalbus_message(cls, obj):
+        failures = cls.apply_deliveries([(obj, cls.deliver_signal(obj))])
+        if failures:
+            _, error = failures[0]
+            raise error
+
+    @classmethod
+    def send_signalbus_messages(cls, objects):
+        processed, failures = cls.process_signals(objects)
+
+        if failures:
+            # Make sure that successfully processed signals will not
+            # be sent again, and report the first failure. The failed
+            # signals will be retried later.
+            for obj in processed:
+                db.session.delete(obj)
+            db.session.commit()
+
+            _, error = failures[0]
+            raise error
+
+    @classmethod
+    def process_signals(cls, objects) -> tuple[list, list[tuple]]:
+        """Deliver the signals concurrently, and apply the results.
+
+        All database changes are made in the current transaction, but
+        each signal's changes are isolated in a savepoint, so that a
+        failure to apply the results for one signal does not affect
+        the others. Returns a `(processed, failures)` tuple, where
+        `processed` is a list of successfully processed signals (they
+        are not deleted), and `failures` is a list of `(obj, error)`
+        tuples.
+        """
+
+        objects = list(objects)
+        deliveries = []
+        failures = []
+
+        for obj, (status_code, error) in zip(
+                objects, _deliver_concurrently(cls.deliver_signal, objects)
+        ):
+            if error is None:
+                deliveries.append((obj, status_code))
+            else:
+                failures.append((obj, error))
+
+        if deliveries:
+            failures.extend(cls.apply_deliveries(deliveries))
+
+        failed = set(id(obj) for obj, _ in failures)
+        processed = [obj for obj in objects if id(obj) not in failed]
+
+        return processed, failures
+
+    @classmethod
+    def apply_deliveries(cls, deliveries: list[tuple]) -> list[tuple]:
+        """Apply the results of successful deliveries.
+
+        `deliveries` is a list of `(obj, status_code)` tuples. Returns
+        a list of `(obj, error)` tuples, one for each signal for which
+        the results could not be applied. The default implementation
+        calls `apply_delivery` for each signal, in a separate
+        savepoint.
+        """
+
+        failures = []
+        for obj, status_code in deliveries:
+            try:
+                with db.session.begin_nested():
+                    cls.apply_delivery(obj, status_code)
+            except Exception as e:
+                failures.append((obj, e))
+
+        return failures
+
+
+class SignalRetryMixin:
+    """Retry failed signals with exponential back-off.
+
+    Signals which have failed `APP_SIGNAL_MAX_ATTEMPTS` times are
+    marked as dead (`dead_at` is set), and will not be retried any
+    more, unless they are requeued (or purged).
+    """
+
+    can_requeue_dead = True
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(
+        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+    )
+    dead_at = db.Column(db.TIMESTAMP(timezone=True))
+    last_error = db.Column(db.Text)
+
+    @classmethod
+    def schedule_retry(cls, obj, error: Exception) -> None:
+        config = current_app.config
+        logger = logging.getLogger(__name__)
+        now = get_now_utc()
+        obj.attempts += 1
+        obj.last_error = str(error)[:1000]
+
+        if obj.attempts >= config["APP_SIGNAL_MAX_ATTEMPTS"]:
+            obj.dead_at = now
+            logger.error(
+                "%s %s has failed %i times, and will not be retried: %s",
+                cls.__name__,
+                inspect(obj).identity,
+                obj.attempts,
+                obj.last_error,
+            )
+        else:
+            delay = min(
+                config["APP_SIGNAL_RETRY_MAX_SECONDS"],
+                config["APP_SIGNAL_RETRY_MIN_SECONDS"] * 2 ** (obj.attempts - 1),
+            )
+            delay *= 0.5 + random.random() / 2
+            obj.next_attempt_at = now + timedelta(seconds=delay)
+            logger.warning(
+                "%s %s has failed (attempt %i), and will be retried in %.1f"
+                " seconds: %s",
+                cls.__name__,
+                inspect(obj).identity,
+                obj.attempts,
+                delay,
+                obj.last_error,
+            )
 
-class ActivateUserSignal(db.Model, ChooseRowsMixin):
-    class SendingError(Exception):
+    @classmethod
+    def notify_flush_workers(cls) -> None:
+        """Wake up the flush workers which listen for this signal type.
+
+        The notification is sent when the current transaction commits.
+        """
+
+        db.session.execute(select(func.pg_notify(cls.__table__.name, "")))
+
+    @classmethod
+    def get_dead(cls, limit: int) -> list:
+        return db.session.execute(
+            select(cls)
+            .where(cls.dead_at.is_not(None))
+            .order_by(cls.dead_at)
+            .limit(limit)
+        ).scalars().all()
+
+    @classmethod
+    def requeue_dead(cls) -> int:
+        if not cls.can_requeue_dead:
+            raise RuntimeError(f"Dead {cls.__name__} rows can not be requeued.")
+
+        result = db.session.execute(
+            update(cls)
+            .where(cls.dead_at.is_not(None))
+            .values(attempts=0, next_attempt_at=get_now_utc(), dead_at=None)
+        )
+        return result.rowcount
+
+    @classmethod
+    def purge_dead(cls) -> int:
+        result = db.session.execute(delete(cls).where(cls.dead_at.is_not(None)))
+        return result.rowcount
+
+
+class ActivateUserSignal(
+        SignalRetryMixin, ConcurrentDeliveryMixin, db.Model, ChooseRowsMixin
+):
+    class SendingError(SignalSendingError):
         """Failed activation request."""
 
     user_id = db.Column(db.String(64), primary_key=True)
@@ -112,13 +620,26 @@ class ActivateUserSignal(db.Model, ChooseRowsMixin):
         db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
     )
 
+    __table_args__ = (
+        db.Index(
+            "idx_activate_user_signal_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+        db.Index(
+            "idx_activate_user_signal_inserted_at",
+            "inserted_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+    )
+
     @classproperty
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_ACTIVATE_USERS_BURST_COUNT"]
 
     @classmethod
-    def send_signalbus_message(cls, obj):
-        """Activate the user reservation, then add a `UserRegistration` row."""
+    def deliver_signal(cls, obj) -> int:
+        """Activate the user reservation."""
 
         try:
             response = requests_session.post(
@@ -126,62 +647,308 @@ class ActivateUserSignal(db.Model, ChooseRowsMixin):
                 json={"reservationId": obj.reservation_id},
                 verify=current_app.config["APP_VERIFY_SSL_CERTIFICATES"],
             )
-            status_code = response.status_code
+        except (requests.ConnectionError, requests.Timeout):
+            raise cls.SendingError("connection problem")
+
+        status_code = response.status_code
+        if status_code not in (200, 409, 422):
+            raise cls.SendingError(
+                f"Unexpected status code ({status_code}) while trying to"
+                " activate an user.",
+                status_code,
+            )
+
+        return status_code
+
+    @classmethod
+    def apply_deliveries(cls, deliveries: list[tuple]) -> list[tuple]:
+        """Add `UserRegistration` rows for the activated users."""
+
+        logger = logging.getLogger(__name__)
+        activated = []
 
+        for obj, status_code in deliveries:
             if status_code == 200:
-                user_query = UserRegistration.query.filter_by(email=obj.email)
-                if not db.session.query(user_query.exists()).scalar():
-                    db.session.add(
-                        UserRegistration(
-                            email=obj.email,
-                            user_id=obj.user_id,
-                            salt=obj.salt,
-                            password_hash=obj.password_hash,
-                            recovery_code_hash=obj.recovery_code_hash,
-                            registered_from_ip=obj.registered_from_ip,
-                            registered_at=obj.inserted_at,
-                        )
-                    )
-                    try:
-                        db.session.flush()
-                    except IntegrityError:
-                        raise RuntimeError(
-                            "Duplicated email or user ID. This may happen if"
-                            " a user has attempted to sign up more than once"
-                            " simultaneously, with the same email address"
-                            " (duplicated email). In this case, this error is"
-                            " a single rare event which does not cause any"
-                            " problems. However, this error also occurs when"
-                            " an already existing user ID is assigned to a new"
-                            " user, which signals that a serious database"
-                            " inconsistency has been prevented. If this is"
-                            " the case, this error  will continue to show up,"
-                            " again and again."
-                        )
-
-            elif status_code == 409 or status_code == 422:
+                activated.append(obj)
+            else:
                 # This should be very rare, and not a big problem. In
                 # this case there is nothing we can do, except logging
                 # the event.
-                logger = logging.getLogger(__name__)
                 logger.error(
                     "Reservation %s has expired. As a result, the"
                     " registration of the new user failed",
                     obj.reservation_id,
                 )
 
+        if not activated:
+            return []
+
+        try:
+            with db.session.begin_nested():
+                conflicts = cls._register_users(activated)
+        except Exception as e:
+            return [(obj, e) for obj in activated]
+
+        failures = []
+        for obj in conflicts:
+            logger.error(
+                "Failed to register user %s (reservation %s).",
+                obj.user_id,
+                obj.reservation_id,
+            )
+            failures.append((obj, RuntimeError(DUPLICATED_USER_ERROR_MESSAGE)))
+
+        return failures
+
+    @classmethod
+    def _register_users(cls, activated: list) -> list:
+        """Insert `UserRegistration` rows with as few statements as possible.
+
+        Signals whose emails are already registered are skipped
+        silently. Returns a list of the signals for which a
+        `UserRegistration` row could not be inserted because of a
+        conflicting user ID.
+
+        When `user_registration` is sharded, the registrations are
+        committed to the shards independently of the current
+        transaction. To keep the shards consistent, the
+        `RegisteredUserId` rows are committed before that, and a
+        retried signal whose registration has already been committed
+        is recognized as an already registered user.
+        """
+
+        # Only one signal per email is inserted. The other signals
+        # with the same email are processed after the insertion, as
+        # signals whose emails are already registered.
+        to_register = []
+        duplicates = []
+        conflicts = []
+        for obj in activated:
+            if any(o.email == obj.email for o in to_register):
+                duplicates.append(obj)
+            elif any(o.user_id == obj.user_id for o in to_register):
+                conflicts.append(obj)
             else:
-                raise cls.SendingError(
-                    f"Unexpected status code ({status_code}) while trying to"
-                    " activate an user."
+                to_register.append(obj)
+
+        if is_sharded():
+            unique_ids = _register_user_ids(to_register)
+            inserted = _insert_registrations_into_shards(
+                [o for o in to_register if o.user_id in unique_ids]
+            )
+        else:
+            inserted = cls._insert_registrations(to_register)
+
+        # A signal which has not been inserted conflicts either with
+        # an already registered email (in which case the signal has
+        # been processed), or with an existing user ID.
+        not_inserted = [o for o in to_register if (o.email, o.user_id) not in inserted]
+        unresolved = not_inserted + duplicates
+        registered = _get_registered_users(unresolved) if unresolved else {}
+        _unregister_user_ids(
+            [o for o in not_inserted if registered.get(o.email) != o.user_id]
+        )
+
+        _insert_registrations_into_next_shards(
+            [o for o in to_register if (o.email, o.user_id) in inserted]
+        )
+        return conflicts + [o for o in unresolved if o.email not in registered]
+
+    @classmethod
+    def _insert_registrations(cls, to_insert: list) -> set[tuple]:
+        """Copy the signals into the `user_registration` table.
+
+        The `RegisteredUserId` rows are inserted by the same statement,
+        and signals whose user IDs are already registered are not
+        copied. Returns a set of `(email, user_id)` tuples, one for
+        each inserted row.
+        """
+
+        if not to_insert:
+            return set()
+
+        chosen = cls.choose_rows(
+            [(o.user_id, o.reservation_id) for o in to_insert]
+        )
+        chosen_signals = and_(
+            chosen.c.user_id == cls.user_id,
+            chosen.c.reservation_id == cls.reservation_id,
+        )
+        registered_ids = _on_user_id_conflict(
+            pg_insert(RegisteredUserId).from_select(
+                ["user_id", "registered_at"],
+                select(cls.user_id, cls.inserted_at).join(chosen, chosen_signals),
+            )
+        ).cte("registered_ids")
+        if _store_binary_hashes():
+            # NOTE: The salts of new users always use the default
+            # hashing method.
+            credential_columns = {
+                "salt_bin": func.decode(cls.salt, "base64"),
+                "password_hash_bin": func.decode(cls.password_hash, "base64"),
+                "recovery_code_hash_bin": func.decode(cls.recovery_code_hash, "base64"),
+            }
+        else:
+            credential_columns = {
+                "salt": cls.salt,
+                "password_hash": cls.password_hash,
+                "recovery_code_hash": cls.recovery_code_hash,
+            }
+
+        return set(
+            db.session.execute(
+                pg_insert(UserRegistration)
+                .from_select(
+                    [
+                        "email",
+                        "user_id",
+                        *credential_columns.keys(),
+                        "registered_from_ip",
+                        "registered_at",
+                    ],
+                    select(
+                        cls.email,
+                        cls.user_id,
+                        *credential_columns.values(),
+                        cls.registered_from_ip,
+                        cls.inserted_at,
+                    )
+                    .join(chosen, chosen_signals)
+                    .join(registered_ids, registered_ids.c.user_id == cls.user_id),
                 )
+                .on_conflict_do_nothing()
+                .returning(UserRegistration.email, UserRegistration.user_id)
+            ).all()
+        )
 
-        except (requests.ConnectionError, requests.Timeout):
-            raise cls.SendingError("connection problem")
 
+def _get_registration_row(obj) -> dict:
+    return dict(
+        email=obj.email,
+        user_id=obj.user_id,
+        **get_password_values(obj.salt, obj.password_hash),
+        **get_recovery_code_values(obj.recovery_code_hash),
+        registered_from_ip=obj.registered_from_ip,
+        registered_at=obj.inserted_at,
+        status=0,
+    )
+
+
+def _group_by_shard(engines: list, objects: list) -> dict:
+    groups = {}
+    for obj in objects:
+        engine = engines[get_shard_number(obj.email, len(engines))]
+        groups.setdefault(engine, []).append(obj)
+    return groups
+
+
+def _get_registered_users(activated: list) -> dict[str, str]:
+    """Return a dictionary mapping already registered emails to user IDs."""
+
+    query = select(UserRegistration.email, UserRegistration.user_id)
+
+    if not is_sharded():
+        emails = [o.email for o in activated]
+        return dict(
+            db.session.execute(query.where(UserRegistration.email.in_(emails))).all()
+        )
+
+    registered = {}
+    for engine, objects in _group_by_shard(get_shard_engines(), activated).items():
+        emails = [o.email for o in objects]
+        with engine.connect() as connection:
+            registered.update(
+                connection.execute(query.where(UserRegistration.email.in_(emails))).all()
+            )
+    return registered
 
-class DeactivateUserSignal(db.Model, ChooseRowsMixin):
-    class SendingError(Exception):
+
+def _on_user_id_conflict(statement):
+    """Make an insert into the `registered_user_id` table idempotent.
+
+    Conflicting rows are returned only if they have been inserted by a
+    previous attempt to register the same signals (such rows are
+    recognized by their `registered_at` column, which is set to the
+    signal's `inserted_at`).
+    """
+
+    return statement.on_conflict_do_update(
+        index_elements=[RegisteredUserId.user_id],
+        set_={"registered_at": statement.excluded.registered_at},
+        where=RegisteredUserId.registered_at == statement.excluded.registered_at,
+    ).returning(RegisteredUserId.user_id)
+
+
+def _register_user_ids(objects: list) -> set[str]:
+    """Insert rows in the `registered_user_id` table for the signals.
+
+    Returns the set of user IDs that have been successfully inserted,
+    now or by a previous attempt (see `_on_user_id_conflict`). The
+    rows are committed immediately, so that a shard never contains a
+    registration without a `RegisteredUserId` row, even if the current
+    transaction gets rolled back.
+    """
+
+    if not objects:
+        return set()
+
+    statement = _on_user_id_conflict(
+        pg_insert(RegisteredUserId).values(
+            [{"user_id": o.user_id, "registered_at": o.inserted_at} for o in objects]
+        )
+    )
+    with db.engine.begin() as connection:
+        return set(connection.execute(statement).scalars())
+
+
+def _unregister_user_ids(objects: list) -> None:
+    """Delete the `registered_user_id` rows inserted for the signals."""
+
+    if not objects:
+        return
+
+    db.session.execute(
+        delete(RegisteredUserId)
+        .where(
+            tuple_(RegisteredUserId.user_id, RegisteredUserId.registered_at)
+            .in_([(o.user_id, o.inserted_at) for o in objects])
+        )
+    )
+
+
+def _insert_registrations_into_shards(to_insert: list) -> set[tuple]:
+    inserted = set()
+    for engine, objects in _group_by_shard(get_shard_engines(), to_insert).items():
+        with engine.begin() as connection:
+            inserted.update(
+                connection.execute(
+                    pg_insert(UserRegistration)
+                    .values([_get_registration_row(o) for o in objects])
+                    .on_conflict_do_nothing()
+                    .returning(UserRegistration.email, UserRegistration.user_id)
+                ).all()
+            )
+    return inserted
+
+
+def _insert_registrations_into_next_shards(inserted: list) -> None:
+    """Replicate new registrations to the next shards (when resharding)."""
+
+    engines = get_next_shard_engines()
+    if not engines:
+        return
+
+    for engine, objects in _group_by_shard(engines, inserted).items():
+        with engine.begin() as connection:
+            upsert_registrations(
+                connection, [_get_registration_row(o) for o in objects]
+            )
+
+
+class DeactivateUserSignal(
+        SignalRetryMixin, ConcurrentDeliveryMixin, db.Model, ChooseRowsMixin
+):
+    class SendingError(SignalSendingError):
         """Failed deactivation request."""
 
     user_id = db.Column(db.String(64), primary_key=True)
@@ -189,12 +956,25 @@ class DeactivateUserSignal(db.Model, ChooseRowsMixin):
         db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
     )
 
+    __table_args__ = (
+        db.Index(
+            "idx_deactivate_user_signal_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+        db.Index(
+            "idx_deactivate_user_signal_inserted_at",
+            "inserted_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+    )
+
     @classproperty
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_DEACTIVATE_USERS_BURST_COUNT"]
 
     @classmethod
-    def send_signalbus_message(cls, obj):
+    def deliver_signal(cls, obj) -> int:
         """Deactivate the user reservation."""
 
         try:
@@ -203,11 +983,102 @@ class DeactivateUserSignal(db.Model, ChooseRowsMixin):
                 json={"type": current_app.config["API_DACTIVATION_REQUEST_TYPE"]},
                 verify=current_app.config["APP_VERIFY_SSL_CERTIFICATES"],
             )
-            status_code = response.status_code
-            if status_code != 204:
-                raise cls.SendingError(
-                    f"Unexpected status code ({status_code}) while trying to"
-                    " deactivate an user."
-                )
         except (requests.ConnectionError, requests.Timeout):
             raise cls.SendingError("connection problem")
+
+        status_code = response.status_code
+        if status_code != 204:
+            raise cls.SendingError(
+                f"Unexpected status code ({status_code}) while trying to"
+                " deactivate an user.",
+                status_code,
+            )
+
+        return status_code
+
+    @classmethod
+    def apply_delivery(cls, obj, status_code: int) -> None:
+        pass
+
+
+class EmailSignal(
+        SignalRetryMixin, ConcurrentDeliveryMixin, db.Model, ChooseRowsMixin
+):
+    class SendingError(SignalSendingError):
+        """Failed email delivery."""
+
+    # NOTE: The flush processes split the signals into shards by the
+    # hash of this column.
+    signalbus_shard_key = "recipient"
+
+    # NOTE: Dead messages are redacted (see `schedule_retry`), and
+    # therefore can not be sent again. They can only be purged.
+    can_requeue_dead = False
+
+    email_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text)
+    inserted_at = db.Column(
+        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+    )
+
+    __table_args__ = (
+        db.Index(
+            "idx_email_signal_next_attempt_at",
+            "next_attempt_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+        db.Index(
+            "idx_email_signal_inserted_at",
+            "inserted_at",
+            postgresql_where=text("dead_at IS NULL"),
+        ),
+        {
+            "comment": (
+                "Represents an already rendered email message, which is"
+                " waiting to be sent to the SMTP server."
+            ),
+        },
+    )
+
+    @classproperty
+    def signalbus_burst_count(self):
+        return current_app.config["APP_FLUSH_EMAILS_BURST_COUNT"]
+
+    @classmethod
+    def deliver_signal(cls, obj) -> None:
+        """Send the email message to the SMTP server."""
+
+        msg = Message(
+            subject=obj.subject,
+            recipients=[obj.recipient],
+            body=obj.body,
+            html=obj.html,
+        )
+        try:
+            mail.send(msg)
+        except smtplib.SMTPResponseException as e:
+            raise cls.SendingError(
+                f"Unexpected SMTP status code ({e.smtp_code}) while trying"
+                " to send an email.",
+                e.smtp_code,
+            )
+        except (smtplib.SMTPException, OSError) as e:
+            raise cls.SendingError(f"SMTP connection problem ({e})")
+
+    @classmethod
+    def apply_delivery(cls, obj, status_code: Optional[int]) -> None:
+        pass
+
+    @classmethod
+    def schedule_retry(cls, obj, error: Exception) -> None:
+        super().schedule_retry(obj, error)
+
+        if obj.dead_at is not None:
+            # The message may contain secret links and codes, which
+            # must not be stored indefinitely. Only the recipient and
+            # the subject are kept, for troubleshooting.
+            obj.body = ""
+            obj.html = None
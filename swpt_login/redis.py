@@ -3,31 +3,57 @@ import re
 import time
 import hashlib
 import base64
-from sqlalchemy import select
+from datetime import datetime, timedelta
+from sqlalchemy import select, bindparam
 from typing import Optional
 from urllib.parse import urljoin
 from sqlalchemy.exc import IntegrityError
 from flask import current_app
 from . import utils
-from .models import UserRegistration, ActivateUserSignal
+from .models import UserRegistration, ActivateUserSignal, ReservedUserId, get_now_utc
 from .extensions import db, redis_store, requests_session
+from .replicas import record_write_lsn
+from .sharding import execute_on_shard, sync_to_next_shard, change_registration_email
 
 USER_ID_REGEX_PATTERN = re.compile(r"^[0-9A-Za-z_=-]{1,64}$")
 
 
+RECOVERY_CODE_HASH_QUERY = (
+    select(
+        UserRegistration.recovery_code_hash,
+        UserRegistration.recovery_code_hash_bin,
+    )
+    .where(UserRegistration.email == bindparam("email"))
+)
+
+
 def _query_recovery_code_hash(email):
-    return db.session.execute(
-        select(UserRegistration.recovery_code_hash)
-        .where(UserRegistration.email == email),
-        bind_arguments={"bind": db.engines["replica"]},
-    ).scalar()
+    return execute_on_shard(
+        email, RECOVERY_CODE_HASH_QUERY, {"email": email}, read_only=True
+    ).one_or_none()
 
 
 def _get_user_verification_code_failures_redis_key(user_id):
     return "vcfails:" + str(user_id)
 
 
-def _reserve_user_id():
+def _parse_timestamp(s: Optional[str]) -> Optional[datetime]:
+    if s is None:
+        return None
+
+    # NOTE: Before Python 3.11, `datetime.fromisoformat` does not
+    # accept the "Z" suffix.
+    return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+def reserve_user_id():
+    """Reserve a new user ID on the resource server.
+
+    Returns an `(user_id, reservation_id, valid_until)` tuple. Note
+    that `valid_until` will be `None` if the resource server did not
+    specify when the reservation expires.
+    """
+
     api_resource_server = current_app.config["API_RESOURCE_SERVER"]
     api_reserve_user_id_path = current_app.config["API_RESERVE_USER_ID_PATH"]
     api_user_id_field_name = current_app.config["API_USER_ID_FIELD_NAME"]
@@ -43,10 +69,89 @@ def _reserve_user_id():
     if not USER_ID_REGEX_PATTERN.match(user_id):
         raise RuntimeError("Unvalid user ID.")
     reservation_id = response_json["reservationId"]
+    valid_until = _parse_timestamp(response_json.get("validUntil"))
+
+    return user_id, reservation_id, valid_until
+
+
+def _get_user_id_pool_min_valid_until() -> datetime:
+    safety_margin_seconds = current_app.config["USER_ID_POOL_SAFETY_MARGIN_SECONDS"]
+    return get_now_utc() + timedelta(seconds=safety_margin_seconds)
+
+
+# The number of sign ups which have found the pool of pre-reserved
+# user IDs empty, since the pool became empty. This is used to log a
+# warning only once, when the pool becomes empty, and not on every
+# sign up.
+_user_id_pool_misses = 0
+
+
+def _claim_user_id():
+    global _user_id_pool_misses
+
+    if current_app.config["USER_ID_POOL_SIZE"] > 0:
+        logger = logging.getLogger(__name__)
+
+        if reservation := ReservedUserId.claim(_get_user_id_pool_min_valid_until()):
+            if _user_id_pool_misses > 0:
+                logger.info(
+                    "The pool of pre-reserved user IDs has been refilled,"
+                    " after %i sign ups without a pre-reserved user ID.",
+                    _user_id_pool_misses,
+                )
+                _user_id_pool_misses = 0
+            return reservation
+
+        if _user_id_pool_misses == 0:
+            logger.warning("The pool of pre-reserved user IDs is empty.")
+        _user_id_pool_misses += 1
 
+    user_id, reservation_id, _ = reserve_user_id()
     return user_id, reservation_id
 
 
+def replenish_user_id_pool() -> int:
+    """Remove expiring reservations, and top up the user ID pool.
+
+    Returns the number of reservations in the pool.
+    """
+
+    logger = logging.getLogger(__name__)
+    pool_size = current_app.config["USER_ID_POOL_SIZE"]
+    min_valid_until = _get_user_id_pool_min_valid_until()
+
+    deleted_count = ReservedUserId.delete_expiring(min_valid_until)
+    db.session.commit()
+    if deleted_count > 0:
+        logger.info("Removed %i expiring user ID reservations.", deleted_count)
+
+    count = ReservedUserId.count()
+    while count < pool_size:
+        user_id, reservation_id, valid_until = reserve_user_id()
+        if valid_until is None:
+            valid_until = get_now_utc() + timedelta(
+                seconds=current_app.config["USER_ID_POOL_RESERVATION_SECONDS"]
+            )
+        if valid_until <= min_valid_until:
+            logger.error(
+                "User ID reservations expire too soon to be put in the pool."
+                " Consider decreasing USER_ID_POOL_SAFETY_MARGIN_SECONDS."
+            )
+            break
+
+        db.session.add(
+            ReservedUserId(
+                user_id=user_id,
+                reservation_id=reservation_id,
+                valid_until=valid_until,
+            )
+        )
+        db.session.commit()
+        count += 1
+
+    return count
+
+
 def _register_user_verification_code_failure(user_id):
     expiration_seconds = max(
         current_app.config["LOGIN_VERIFICATION_CODE_EXPIRATION_SECONDS"], 24 * 60 * 60
@@ -169,8 +274,8 @@ class LoginVerificationRequest(RedisSecretHashRecord):
 
     def is_correct_recovery_code(self, recovery_code):
         normalized_recovery_code = utils.normalize_recovery_code(recovery_code)
-        return _query_recovery_code_hash(self.email) == utils.calc_crypt_hash(
-            "", normalized_recovery_code
+        return utils.is_correct_recovery_code(
+            _query_recovery_code_hash(self.email), normalized_recovery_code
         )
 
     def register_code_failure(self):
@@ -190,8 +295,8 @@ class SignUpRequest(RedisSecretHashRecord):
 
     def is_correct_recovery_code(self, recovery_code):
         normalized_recovery_code = utils.normalize_recovery_code(recovery_code)
-        return _query_recovery_code_hash(self.email) == utils.calc_crypt_hash(
-            "", normalized_recovery_code
+        return utils.is_correct_recovery_code(
+            _query_recovery_code_hash(self.email), normalized_recovery_code
         )
 
     def register_code_failure(self):
@@ -204,22 +309,31 @@ class SignUpRequest(RedisSecretHashRecord):
         self.delete()
 
         if self.recover:
-            # Change the user's password.
-            user = UserRegistration.query.filter_by(email=self.email).one()
-            user.password_hash = utils.calc_crypt_hash(user.salt, password)
+            # Change the user's password. A new salt is generated, so
+            # that the old salt does not need to be read first.
+            salt = utils.generate_password_salt()
+            user_id = UserRegistration.change_password(
+                self.email, salt, utils.calc_crypt_hash(salt, password)
+            )
 
             # After changing the password, we "forget" past login
             # verification failures, thus guaranteeing that the user
             # will be able to log in immediately.
-            _clear_user_verification_code_failures(user.user_id)
+            _clear_user_verification_code_failures(user_id)
 
             db.session.commit()
-            self.user_id = user.user_id
+            sync_to_next_shard(self.email)
+            record_write_lsn()
+            self.user_id = user_id
             return None
 
         else:
-            # Reserve a user ID, which we need to activate.
-            user_id, reservation_id = _reserve_user_id()
+            # Reserve a user ID, which we need to activate. If
+            # possible, an user ID will be taken from the pool of
+            # pre-reserved user IDs. Note that a taken user ID will
+            # be removed from the pool in the same transaction which
+            # adds the `ActivateUserSignal` row.
+            user_id, reservation_id = _claim_user_id()
 
             # Before we try to activate the reserved user ID, we need
             # to make sure that a new row is added and committed to
@@ -261,7 +375,15 @@ class SignUpRequest(RedisSecretHashRecord):
                         reservation_id,
                     )
 
+                    # The notification sent when the signal was
+                    # inserted has been missed by the flush workers,
+                    # because the row was locked. Wake them up again,
+                    # so that the activation is retried without delay.
+                    ActivateUserSignal.notify_flush_workers()
+
             db.session.commit()
+            sync_to_next_shard(self.email)
+            record_write_lsn()
             self.user_id = user_id
             return recovery_code
 
@@ -277,21 +399,21 @@ class ChangeEmailRequest(RedisSecretHashRecord):
     def accept(self):
         self.delete()
         user_id = self.user_id
-        user = UserRegistration.query.filter_by(
-            user_id=user_id, email=self.old_email
-        ).one()
-        user.email = self.email
 
         try:
+            change_registration_email(user_id, self.old_email, self.email)
             db.session.commit()
         except IntegrityError:
             db.session.rollback()
             raise self.EmailAlredyRegistered()
 
+        sync_to_next_shard(self.old_email, self.email)
+        record_write_lsn()
+
         # After changing the email address, we "forget" past login
         # verification failures, thus guaranteeing that the user will
         # be able to log in immediately.
-        _clear_user_verification_code_failures(user.user_id)
+        _clear_user_verification_code_failures(user_id)
 
 
 class ChangeRecoveryCodeRequest(RedisSecretHashRecord):
@@ -302,7 +424,10 @@ class ChangeRecoveryCodeRequest(RedisSecretHashRecord):
     def accept(self) -> str:
         self.delete()
         recovery_code = utils.generate_recovery_code()
-        user = UserRegistration.query.filter_by(email=self.email).one()
-        user.recovery_code_hash = utils.calc_crypt_hash("", recovery_code)
+        UserRegistration.change_recovery_code_hash(
+            self.email, utils.calc_crypt_hash("", recovery_code)
+        )
         db.session.commit()
+        sync_to_next_shard(self.email)
+        record_write_lsn()
         return recovery_code
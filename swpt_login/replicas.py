@@ -0,0 +1,314 @@
+import time
+import logging
+import threading
+from typing import Callable, Optional
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import text
+from sqlalchemy.engine import Result
+from sqlalchemy.exc import OperationalError, InterfaceError
+from flask import current_app, request, g, has_request_context
+from .extensions import db
+
+REPLICA_BIND_KEY = "replica"
+
+_LAG_QUERY = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0.0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0.0"
+    " ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+    " END"
+)
+
+
+_CURRENT_LSN_QUERY = text("SELECT pg_current_wal_lsn()")
+
+# NOTE: On the primary database `pg_last_wal_replay_lsn()` returns
+# NULL. In this case, the database is obviously up-to-date.
+_CAUGHT_UP_QUERY = text(
+    "SELECT coalesce(pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn), true)"
+)
+
+
+def _get_bind_key(index: int) -> str:
+    # NOTE: The first replica's bind key is always "replica", so that
+    # code which uses the "replica" bind directly continues to work.
+    return REPLICA_BIND_KEY if index == 0 else f"{REPLICA_BIND_KEY}_{index}"
+
+
+def get_replicas(config) -> list[tuple[str, str, int]]:
+    """Return a list of `(bind_key, url, weight)` tuples.
+
+    When no replicas are configured, the primary database will be
+    used as the only "replica".
+    """
+
+    urls = config["POSTGRES_REPLICA_URLS"].split() or [
+        config["POSTGRES_REPLICA_URL"] or config["SQLALCHEMY_DATABASE_URI"]
+    ]
+    weights = [int(w) for w in config["POSTGRES_REPLICA_WEIGHTS"].split()]
+    weights += [1] * (len(urls) - len(weights))
+
+    return [
+        (_get_bind_key(i), url, max(0, weight))
+        for i, (url, weight) in enumerate(zip(urls, weights))
+    ]
+
+
+def get_replica_binds(config, engine_options: dict) -> dict:
+    return {
+        bind_key: {"url": url, **engine_options}
+        for bind_key, url, _ in get_replicas(config)
+    }
+
+
+class ReplicaRouter:
+    """Choose a replica for each read-only query.
+
+    Replicas are chosen by smooth weighted round-robin. A replica which
+    fails is ejected for `eject_seconds`. When `max_lag_seconds` is
+    positive, the replication lag of each replica is checked every
+    `lag_check_seconds` (in a background thread, so that requests are
+    never blocked by the checks), and replicas which lag too much are
+    skipped.
+    """
+
+    def __init__(
+        self,
+        replicas: list[tuple[str, int]],
+        eject_seconds: float,
+        max_lag_seconds: float = 0.0,
+        lag_check_seconds: float = 5.0,
+    ):
+        self.weights = {k: w for k, w in replicas if w > 0}
+        self.eject_seconds = eject_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.current_weights = {k: 0 for k in self.weights}
+        self.ejected_until = {k: 0.0 for k in self.weights}
+        self.lag_checked_at = {k: float("-inf") for k in self.weights}
+        self.lagging: set[str] = set()
+        self.checking_lags = False
+        self.lock = threading.Lock()
+
+    def choose(self) -> list[str]:
+        """Return the bind keys of the healthy replicas.
+
+        The first bind key in the list is the chosen replica. The rest
+        can be tried if the chosen replica fails.
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            healthy = [
+                k for k in self.weights
+                if self.ejected_until[k] <= now and k not in self.lagging
+            ]
+            if not healthy:
+                return []
+
+            total_weight = 0
+            for k in healthy:
+                self.current_weights[k] += self.weights[k]
+                total_weight += self.weights[k]
+
+            chosen = max(healthy, key=lambda k: self.current_weights[k])
+            self.current_weights[chosen] -= total_weight
+
+        return [chosen] + [k for k in healthy if k != chosen]
+
+    def eject(self, bind_key: str) -> None:
+        with self.lock:
+            self.ejected_until[bind_key] = time.monotonic() + self.eject_seconds
+
+    def _claim_due_lag_checks(self) -> list[str]:
+        if self.max_lag_seconds <= 0.0:
+            return []
+
+        now = time.monotonic()
+        with self.lock:
+            if self.checking_lags:
+                return []
+            due = [
+                k for k in self.weights
+                if self.lag_checked_at[k] + self.lag_check_seconds <= now
+                and self.ejected_until[k] <= now
+            ]
+            for k in due:
+                self.lag_checked_at[k] = now
+            self.checking_lags = bool(due)
+
+        return due
+
+    def _check_lags(
+        self, due: list[str], measure_lag: Callable[[str], Optional[float]]
+    ) -> None:
+        try:
+            for k in due:
+                lag = measure_lag(k)
+                if lag is None:
+                    self.eject(k)
+                    continue
+
+                with self.lock:
+                    if lag > self.max_lag_seconds:
+                        if k not in self.lagging:
+                            logging.getLogger(__name__).warning(
+                                "Replica %s lags %.1f seconds behind. Skipping it.",
+                                k,
+                                lag,
+                            )
+                        self.lagging.add(k)
+                    else:
+                        self.lagging.discard(k)
+        finally:
+            with self.lock:
+                self.checking_lags = False
+
+    def check_lags(self, measure_lag: Callable[[str], Optional[float]]) -> None:
+        """Check the replication lags which have not been checked recently.
+
+        `measure_lag(bind_key)` should return the lag in seconds, or
+        `None` if the replica is not available.
+        """
+
+        if due := self._claim_due_lag_checks():
+            self._check_lags(due, measure_lag)
+
+    def start_lag_checks(self, measure_lag: Callable[[str], Optional[float]]) -> None:
+        """Like `check_lags`, but checks the lags in a background thread.
+
+        Does nothing if a check is already running, or no check is due.
+        """
+
+        if due := self._claim_due_lag_checks():
+            threading.Thread(
+                target=self._check_lags, args=(due, measure_lag), daemon=True
+            ).start()
+
+
+def _get_lag_measurer(app) -> Callable[[str], Optional[float]]:
+    def measure_lag(bind_key: str) -> Optional[float]:
+        try:
+            with app.app_context(), db.engines[bind_key].connect() as connection:
+                return float(connection.execute(_LAG_QUERY).scalar())
+        except (OperationalError, InterfaceError):
+            logging.getLogger(__name__).warning(
+                "Failed to check the replication lag of %s.", bind_key
+            )
+            return None
+
+    return measure_lag
+
+
+def _has_replicas() -> bool:
+    config = current_app.config
+    return bool(config["POSTGRES_REPLICA_URLS"] or config["POSTGRES_REPLICA_URL"])
+
+
+def _get_lsn_serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt="lsn")
+
+
+def record_write_lsn() -> None:
+    """Remember the current WAL position of the primary database.
+
+    This should be called after committing changes to user's
+    credentials. The WAL position will be sent to the user's browser
+    in a signed cookie, so that the subsequent reads from replicas can
+    make sure that the replica has caught up with the changes (see
+    `execute_on_replica`).
+    """
+
+    if has_request_context() and _has_replicas():
+        with db.engine.connect() as connection:
+            g.swpt_login_write_lsn = str(connection.execute(_CURRENT_LSN_QUERY).scalar())
+
+
+def _get_min_lsn() -> Optional[str]:
+    if not has_request_context():
+        return None
+
+    if lsn := g.get("swpt_login_write_lsn"):
+        return lsn
+
+    cookie = request.cookies.get(current_app.config["LSN_COOKIE_NAME"])
+    if cookie:
+        try:
+            return _get_lsn_serializer().loads(
+                cookie, max_age=current_app.config["APP_READ_YOUR_WRITES_SECONDS"]
+            )
+        except BadSignature:
+            pass
+
+    return None
+
+
+def _set_lsn_cookie(response):
+    if lsn := g.get("swpt_login_write_lsn"):
+        config = current_app.config
+        response.set_cookie(
+            config["LSN_COOKIE_NAME"],
+            _get_lsn_serializer().dumps(lsn),
+            max_age=config["APP_READ_YOUR_WRITES_SECONDS"],
+            httponly=True,
+            path=config["LOGIN_PATH"],
+            secure=not config["DEBUG"],
+        )
+    return response
+
+
+def _wait_for_lsn(connection, lsn: str) -> bool:
+    """Wait for the replica to replay the WAL up to the given position.
+
+    Returns `False` if the replica has not caught up in time.
+    """
+
+    deadline = time.monotonic() + current_app.config["APP_REPLICA_LSN_WAIT_SECONDS"]
+    while True:
+        if connection.execute(_CAUGHT_UP_QUERY, {"lsn": lsn}).scalar():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+
+
+def execute_on_replica(statement, params: Optional[dict] = None) -> Result:
+    """Execute a read-only statement on a replica.
+
+    When the chosen replica fails, the other healthy replicas are
+    tried, and if all of them fail, the statement is executed on the
+    primary database. Also, if the user has recently changed his/her
+    credentials (see `record_write_lsn`), and the chosen replica does
+    not catch up with the change quickly enough, the statement is
+    executed on the primary database. Returns a buffered result.
+    """
+
+    router: ReplicaRouter = current_app.extensions["swpt_login_replicas"]
+    router.start_lag_checks(_get_lag_measurer(current_app._get_current_object()))
+    min_lsn = _get_min_lsn()
+
+    for bind_key in router.choose():
+        try:
+            with db.engines[bind_key].connect() as connection:
+                if min_lsn is None or _wait_for_lsn(connection, min_lsn):
+                    return connection.execute(statement, params).freeze()()
+            break
+        except (OperationalError, InterfaceError):
+            logging.getLogger(__name__).warning(
+                "Replica %s has failed. Ejecting it.", bind_key
+            )
+            router.eject(bind_key)
+
+    with db.engine.connect() as connection:
+        return connection.execute(statement, params).freeze()()
+
+
+def init_app(app) -> None:
+    config = app.config
+    app.after_request(_set_lsn_cookie)
+    app.extensions["swpt_login_replicas"] = ReplicaRouter(
+        [(bind_key, weight) for bind_key, _, weight in get_replicas(config)],
+        eject_seconds=config["APP_REPLICA_EJECT_SECONDS"],
+        max_lag_seconds=config["POSTGRES_REPLICA_MAX_LAG_SECONDS"],
+        lag_check_seconds=config["APP_REPLICA_LAG_CHECK_SECONDS"],
+    )
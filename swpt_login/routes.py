@@ -12,12 +12,14 @@ from flask import (
     abort,
     make_response,
     current_app,
+    jsonify,
     Blueprint,
 )
 from flask_babel import gettext, get_locale
 import user_agents
 import altcha
-from sqlalchemy import select
+from sqlalchemy import select, delete, bindparam
+from swpt_pythonlib.flask_signalbus import get_models_to_flush
 from . import utils, captcha, emails, hydra
 from .redis import (
     SignUpRequest,
@@ -28,8 +30,18 @@ from .redis import (
     increment_key_with_limit,
     ExceededValueLimitError,
 )
-from .models import UserRegistration, DeactivateUserSignal
+from .models import (
+    UserRegistration,
+    RegisteredUserId,
+    DeactivateUserSignal,
+    ReservedUserId,
+)
 from .extensions import db
+from .sharding import execute_on_shard, sync_to_next_shard
+from .replicas import record_write_lsn
+from .api_requests_session import get_requests_session_stats
+from .db_pool import get_db_pool_stats
+from .flushing import get_signal_metrics
 
 login = Blueprint(
     "login", __name__, template_folder="templates", static_folder="static"
@@ -211,15 +223,22 @@ def allow_sending_email(initiator_ip: str, email: str) -> bool:
     return True
 
 
+# NOTE: Hot queries are constructed only once, and always have the
+# same SQL text, so that they can be prepared on the server (see the
+# POSTGRES_PREPARE_THRESHOLD setting).
+USER_CREDENTIALS_QUERY = select(
+    UserRegistration.user_id,
+    UserRegistration.salt,
+    UserRegistration.password_hash,
+    UserRegistration.salt_bin,
+    UserRegistration.password_hash_bin,
+    UserRegistration.status,
+).where(UserRegistration.email == bindparam("email"))
+
+
 def query_user_credentials(email):
-    return db.session.execute(
-        select(
-            UserRegistration.user_id,
-            UserRegistration.salt,
-            UserRegistration.password_hash,
-            UserRegistration.status,
-        ).where(UserRegistration.email == email),
-        bind_arguments={"bind": db.engines["replica"]},
+    return execute_on_shard(
+        email, USER_CREDENTIALS_QUERY, {"email": email}, read_only=True
     ).one_or_none()
 
 
@@ -325,6 +344,62 @@ def healthz():
     return make_response(message, headers)
 
 
+@login.route("/metrics/http-pools")
+def http_pools_metrics():
+    """Return usage statistics for this process' HTTP connection pools.
+
+    This is available only when APP_EXPOSE_METRICS is set to "True".
+    """
+
+    if not current_app.config["APP_EXPOSE_METRICS"]:
+        abort(404)
+
+    return jsonify(get_requests_session_stats())
+
+
+@login.route("/metrics/db-pools")
+def db_pools_metrics():
+    """Return usage statistics for this process' database connection pools.
+
+    This is available only when APP_EXPOSE_METRICS is set to "True".
+    """
+
+    if not current_app.config["APP_EXPOSE_METRICS"]:
+        abort(404)
+
+    return jsonify(get_db_pool_stats())
+
+
+@login.route("/metrics/user-id-pool")
+def user_id_pool_metrics():
+    """Return the number of pre-reserved user IDs in the pool.
+
+    This is available only when APP_EXPOSE_METRICS is set to "True".
+    """
+
+    if not current_app.config["APP_EXPOSE_METRICS"]:
+        abort(404)
+
+    return jsonify({
+        "pool_size": current_app.config["USER_ID_POOL_SIZE"],
+        "pool_depth": ReservedUserId.count(),
+    })
+
+
+@login.route("/metrics/signals")
+def signals_metrics():
+    """Return the lag and the throughput of signal processing.
+
+    This is available only when APP_EXPOSE_METRICS is set to "True".
+    """
+
+    if not current_app.config["APP_EXPOSE_METRICS"]:
+        abort(404)
+
+    models = get_models_to_flush(current_app.extensions["signalbus"], [])
+    return jsonify(get_signal_metrics(models))
+
+
 @login.route("/signup", methods=["GET", "POST"])
 def signup():
     """Handle the initial sign up.
@@ -575,7 +650,7 @@ def change_email_login():
         if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
         ):
             # NOTE: We create a special kind of login verification
             # request -- a login verification request without a
@@ -708,7 +783,7 @@ def change_email_address(secret):
         if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
         ):
             try:
                 change_email_request.accept()
@@ -843,7 +918,7 @@ def generate_recovery_code(secret):
         if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
         ):
             new_recovery_code = crc_request.accept()
 
@@ -893,7 +968,7 @@ def delete_account_login():
         if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
         ):
             # NOTE: We create a special kind of login verification
             # request -- a login verification request without a
@@ -959,18 +1034,35 @@ def confirm_account_deletion(secret):
         else:
             email = login_verification_request.email
             password = request.form.get("password", "")
-            user = UserRegistration.query.filter_by(email=email).one_or_none()
+            user_id = None
+            user = query_user_credentials(email)
 
             if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
             ):
+                # NOTE: The registration will not be deleted if the
+                # password has been changed after the credentials were
+                # read (possibly from a replica).
+                #
+                # When `user_registration` is sharded, the
+                # registration gets deleted (and committed) first. If
+                # the next commit fails, the user ID will not be
+                # deactivated, which is much less harmful than
+                # deactivating the user ID of an existing registration.
+                user_id = UserRegistration.delete_verified(email, user)
+
+            if user_id is not None:
                 login_verification_request.accept()
-
-                db.session.delete(user)
-                db.session.add(DeactivateUserSignal(user_id=user.user_id))
+                db.session.execute(
+                    delete(RegisteredUserId)
+                    .where(RegisteredUserId.user_id == user_id)
+                )
+                db.session.add(DeactivateUserSignal(user_id=user_id))
                 db.session.commit()
+                sync_to_next_shard(email)
+                record_write_lsn()
 
                 return redirect(
                     url_for(".report_account_deletion_success", email=email)
@@ -1037,7 +1129,7 @@ def login_form():
         if (
                 verify_altcha()
                 and user
-                and user.password_hash == utils.calc_crypt_hash(user.salt, password)
+                and utils.is_correct_password(user, password)
         ):
             if user.status != 0:
                 return render_template(
@@ -0,0 +1,370 @@
+import hashlib
+from typing import Optional
+from sqlalchemy import (
+    func,
+    literal_column,
+    select,
+    insert,
+    update,
+    delete,
+    cast,
+    BigInteger,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert, BIT
+from sqlalchemy.engine import Engine, Result
+from flask import current_app
+from .extensions import db
+from .replicas import execute_on_replica
+
+
+def get_shard_number(email: str, shard_count: int) -> int:
+    """Return the shard number for the given email address.
+
+    This is the first 4 bytes of the SHA-256 hash of the email
+    address, interpreted as an unsigned big-endian integer, modulo
+    the number of shards.
+    """
+
+    digest = hashlib.sha256(email.encode("utf8")).digest()
+    return int.from_bytes(digest[:4], "big") % shard_count
+
+
+def get_shard_number_expression(email_column, shard_count: int):
+    """Return an SQL expression which calculates `get_shard_number`."""
+
+    hex_prefix = func.substr(
+        func.encode(func.sha256(func.convert_to(email_column, "UTF8")), "hex"),
+        1,
+        8,
+    )
+    as_bits = cast(literal_column("'x'").op("||")(hex_prefix), BIT(32))
+    return cast(as_bits, BigInteger) % shard_count
+
+
+def _get_shard_urls(setting: str) -> list[str]:
+    return current_app.config[setting].split()
+
+
+def get_shard_binds(config, engine_options: dict) -> dict:
+    binds = {}
+    for prefix, setting in [
+        ("shard", "POSTGRES_SHARD_URLS"),
+        ("next_shard", "POSTGRES_NEXT_SHARD_URLS"),
+    ]:
+        for i, url in enumerate(config[setting].split()):
+            binds[f"{prefix}_{i}"] = {"url": url, **engine_options}
+
+    return binds
+
+
+def is_sharded() -> bool:
+    return bool(_get_shard_urls("POSTGRES_SHARD_URLS"))
+
+
+def get_shard_engines() -> list[Engine]:
+    count = len(_get_shard_urls("POSTGRES_SHARD_URLS"))
+    if count == 0:
+        return [db.engine]
+    return [db.engines[f"shard_{i}"] for i in range(count)]
+
+
+def get_next_shard_engines() -> list[Engine]:
+    count = len(_get_shard_urls("POSTGRES_NEXT_SHARD_URLS"))
+    return [db.engines[f"next_shard_{i}"] for i in range(count)]
+
+
+def get_shard_engine(email: str) -> Engine:
+    engines = get_shard_engines()
+    return engines[get_shard_number(email, len(engines))]
+
+
+def get_next_shard_engine(email: str) -> Optional[Engine]:
+    engines = get_next_shard_engines()
+    if not engines:
+        return None
+    return engines[get_shard_number(email, len(engines))]
+
+
+def execute_on_shard(
+    email: str, statement, params: Optional[dict] = None, read_only: bool = False
+) -> Result:
+    """Execute a statement on the shard which contains the given email.
+
+    When `user_registration` is not sharded, read-only statements are
+    executed on a replica, and all other statements are executed in
+    the current database session (the caller commits). Otherwise, the
+    statement is executed and committed on the shard's database.
+    Returns a buffered result.
+    """
+
+    if not is_sharded():
+        if read_only:
+            return execute_on_replica(statement, params)
+        return db.session.execute(statement, params)
+
+    with get_shard_engine(email).begin() as connection:
+        return connection.execute(statement, params).freeze()()
+
+
+def execute_on_shards(emails: list[str], statement) -> list:
+    """Execute a statement on the shards which contain the given emails.
+
+    The statement should select the rows by the "emails" bind
+    parameter, which will be set to the list of emails contained in
+    the given shard. When `user_registration` is not sharded, the
+    statement is executed in the current database session (the caller
+    commits). Otherwise, the statement is executed and committed on
+    each shard's database. Returns the resulting rows from all shards.
+    """
+
+    if not is_sharded():
+        return db.session.execute(statement, {"emails": emails}).all()
+
+    engines = get_shard_engines()
+    emails_by_engine: dict[Engine, list[str]] = {}
+    for email in emails:
+        engine = engines[get_shard_number(email, len(engines))]
+        emails_by_engine.setdefault(engine, []).append(email)
+
+    rows = []
+    for engine, shard_emails in emails_by_engine.items():
+        with engine.begin() as connection:
+            rows.extend(connection.execute(statement, {"emails": shard_emails}).all())
+
+    return rows
+
+
+def upsert_registrations(connection, rows: list[dict]) -> None:
+    """Insert `UserRegistration` rows, replacing existing ones."""
+
+    from .models import UserRegistration
+
+    if not rows:
+        return
+
+    statement = pg_insert(UserRegistration)
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[UserRegistration.email],
+            set_={
+                c.name: statement.excluded[c.name]
+                for c in UserRegistration.__table__.columns
+                if c.name != "email"
+            },
+        ),
+        rows,
+    )
+
+
+def sync_to_next_shard(*emails: str) -> None:
+    """Copy the committed state of the registrations to the next shards.
+
+    This should be called after committing changes to registrations,
+    while resharding (when POSTGRES_NEXT_SHARD_URLS is set).
+    """
+
+    from .models import UserRegistration
+
+    for email in emails:
+        next_engine = get_next_shard_engine(email)
+        if next_engine is None:
+            return
+
+        with get_shard_engine(email).connect() as connection:
+            row = connection.execute(
+                select(UserRegistration.__table__)
+                .where(UserRegistration.email == email)
+            ).mappings().one_or_none()
+
+        with next_engine.begin() as connection:
+            if row is None:
+                connection.execute(
+                    delete(UserRegistration).where(UserRegistration.email == email)
+                )
+            else:
+                upsert_registrations(connection, [dict(row)])
+
+
+def change_registration_email(user_id: str, old_email: str, new_email: str) -> None:
+    """Change the email address of a registered user.
+
+    Raises `IntegrityError` if the new email address is already
+    registered. When the new email address belongs to another shard,
+    the registration is moved to the other shard with a two-phase
+    commit (this requires `max_prepared_transactions` to be set on the
+    shards' databases), and the changes are copied to the next shards
+    (see `sync_to_next_shard`).
+    """
+
+    from .models import UserRegistration
+
+    old_engine = get_shard_engine(old_email)
+    new_engine = get_shard_engine(new_email)
+
+    if not is_sharded() or old_engine is new_engine:
+        execute_on_shard(
+            old_email,
+            update(UserRegistration)
+            .where(UserRegistration.user_id == user_id)
+            .where(UserRegistration.email == old_email)
+            .values(email=new_email)
+            .returning(UserRegistration.user_id),
+        ).one()
+        return
+
+    with old_engine.connect() as old_connection, new_engine.connect() as new_connection:
+        old_transaction = old_connection.begin_twophase()
+        new_transaction = new_connection.begin_twophase()
+        try:
+            row = old_connection.execute(
+                select(UserRegistration.__table__)
+                .where(UserRegistration.user_id == user_id)
+                .where(UserRegistration.email == old_email)
+                .with_for_update()
+            ).mappings().one()
+            new_connection.execute(
+                insert(UserRegistration).values({**row, "email": new_email})
+            )
+            old_connection.execute(
+                delete(UserRegistration).where(UserRegistration.email == old_email)
+            )
+            new_transaction.prepare()
+            old_transaction.prepare()
+        except BaseException:
+            new_transaction.rollback()
+            old_transaction.rollback()
+            raise
+
+        # NOTE: If the process dies before both prepared transactions
+        # have been committed, the remaining prepared transaction must
+        # be committed manually (see the `pg_prepared_xacts` view).
+        new_transaction.commit()
+        old_transaction.commit()
+
+    sync_to_next_shard(old_email, new_email)
+
+
+def register_user_ids(batch_size: int) -> int:
+    """Add the missing `RegisteredUserId` rows for all registrations.
+
+    Registrations which have been added by processes running an old
+    version of the code (during the rollout of the `registered_user_id`
+    table) have no `RegisteredUserId` rows. Returns the number of
+    added rows.
+    """
+
+    from .models import UserRegistration, RegisteredUserId
+
+    table = UserRegistration.__table__
+    added = 0
+    for engine in get_shard_engines():
+        last_email = ""
+        while True:
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select(table.c.email, table.c.user_id, table.c.registered_at)
+                    .where(table.c.email > last_email)
+                    .order_by(table.c.email)
+                    .limit(batch_size)
+                ).all()
+
+            if not rows:
+                break
+
+            with db.engine.begin() as connection:
+                added += len(
+                    connection.execute(
+                        pg_insert(RegisteredUserId)
+                        .values([
+                            {"user_id": row.user_id, "registered_at": row.registered_at}
+                            for row in rows
+                        ])
+                        .on_conflict_do_nothing()
+                        .returning(RegisteredUserId.user_id)
+                    ).all()
+                )
+
+            last_email = rows[-1].email
+
+    return added
+
+
+def reshard_registrations(batch_size: int) -> tuple[int, int]:
+    """Copy all registrations from the current shards to the next shards.
+
+    Rows in the next shards which do not exist in the current shards
+    are deleted. Returns a `(copied, deleted)` tuple. This must be run
+    after POSTGRES_NEXT_SHARD_URLS has been set on all processes, so
+    that the changes made during the copying are double-written to
+    the next shards (see `sync_to_next_shard`).
+
+    Rows which already exist in the next shards are not overwritten,
+    because they have been double-written after a change, and
+    therefore may be newer than the copied row (which could have been
+    read before the change).
+    """
+
+    from .models import UserRegistration
+
+    table = UserRegistration.__table__
+    next_engines = get_next_shard_engines()
+    if not next_engines:
+        raise RuntimeError("POSTGRES_NEXT_SHARD_URLS is not set.")
+
+    copied = 0
+    for engine in get_shard_engines():
+        last_email = ""
+        while True:
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select(table)
+                    .where(table.c.email > last_email)
+                    .order_by(table.c.email)
+                    .limit(batch_size)
+                ).mappings().all()
+
+            if not rows:
+                break
+
+            rows_by_shard: dict[int, list[dict]] = {}
+            for row in rows:
+                shard_number = get_shard_number(row["email"], len(next_engines))
+                rows_by_shard.setdefault(shard_number, []).append(dict(row))
+
+            for shard_number, shard_rows in rows_by_shard.items():
+                with next_engines[shard_number].begin() as connection:
+                    connection.execute(
+                        pg_insert(UserRegistration)
+                        .on_conflict_do_nothing(index_elements=[UserRegistration.email]),
+                        shard_rows,
+                    )
+
+            copied += len(rows)
+            last_email = rows[-1]["email"]
+
+    deleted = 0
+    for next_engine in next_engines:
+        last_email = ""
+        while True:
+            with next_engine.connect() as connection:
+                emails = connection.execute(
+                    select(table.c.email)
+                    .where(table.c.email > last_email)
+                    .order_by(table.c.email)
+                    .limit(batch_size)
+                ).scalars().all()
+
+            if not emails:
+                break
+
+            for email in emails:
+                if execute_on_shard(
+                    email, select(table.c.email).where(table.c.email == email)
+                ).scalar() is None:
+                    with next_engine.begin() as connection:
+                        connection.execute(delete(table).where(table.c.email == email))
+                    deleted += 1
+
+            last_email = emails[-1]
+
+    return copied, deleted
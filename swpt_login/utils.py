@@ -1,5 +1,6 @@
 import os
 import re
+import hmac
 import base64
 import struct
 import hashlib
@@ -51,6 +52,32 @@ def generate_verification_code(num_digits: int = 6):
     return str(random_number).zfill(num_digits)
 
 
+def calc_crypt_hash_bytes(salt: bytes, password: str) -> bytes:
+    """Return a cryptographic hash, using the default hashing method."""
+    password_bytes = password.encode("utf8")
+    if len(password_bytes) > 1024:
+        raise ValueError("The password is too long.")
+
+    # The generation of the Scrypt hash requires 128*n*r bytes of
+    # memory. In our case, that is 128KiB. This should be enough to
+    # render GPUs ineffective to a large extent. The number of rounds
+    # is given by "n". In our case we should be able to crunch about
+    # 2000-3000 hashes per second per CPU core, which should be enough
+    # to not be a bottleneck in case of a DoS attack. Given that a
+    # single CPU core can make no more than few hundreds of SSL
+    # handshakes per second, this means that the SSL handshakes will
+    # almost certainly be the real CPU bottleneck in case of a DoS
+    # attack.
+    return hashlib.scrypt(
+        password=password_bytes,
+        salt=salt,
+        n=128,
+        r=8,
+        p=1,
+        dklen=32,
+    )
+
+
 def calc_crypt_hash(salt: str, password: str) -> str:
     """Return a Base64 encoded cryptographic hash."""
     if salt.startswith("$"):
@@ -60,30 +87,44 @@ def calc_crypt_hash(salt: str, password: str) -> str:
         raise ValueError(f'unsupported hashing method "{method}"')
 
     salt_bytes = base64.b64decode(salt, validate=True)
-    password_bytes = password.encode("utf8")
-    if len(password_bytes) > 1024:
-        raise ValueError("The password is too long.")
+    return base64.b64encode(calc_crypt_hash_bytes(salt_bytes, password)).decode("ascii")
+
+
+def is_correct_password(credentials, password: str) -> bool:
+    """Check the password against user's credentials.
 
-    return base64.b64encode(
-        # The generation of the Scrypt hash requires 128*n*r bytes of
-        # memory. In our case, that is 128KiB. This should be enough
-        # to render GPUs ineffective to a large extent. The number of
-        # rounds is given by "n". In our case we should be able to
-        # crunch about 2000-3000 hashes per second per CPU core, which
-        # should be enough to not be a bottleneck in case of a DoS
-        # attack. Given that a single CPU core can make no more than
-        # few hundreds of SSL handshakes per second, this means that
-        # the SSL handshakes will almost certainly be the real CPU
-        # bottleneck in case of a DoS attack.
-        hashlib.scrypt(
-            password=password_bytes,
-            salt=salt_bytes,
-            n=128,
-            r=8,
-            p=1,
-            dklen=32,
+    `credentials` should have "salt", "password_hash", "salt_bin",
+    and "password_hash_bin" attributes. When the binary hash is
+    available, it is used, and the Base64 encoded one is ignored.
+    """
+    if credentials.password_hash_bin is not None:
+        return hmac.compare_digest(
+            credentials.password_hash_bin,
+            calc_crypt_hash_bytes(credentials.salt_bin, password),
         )
-    ).decode("ascii")
+    return hmac.compare_digest(
+        credentials.password_hash,
+        calc_crypt_hash(credentials.salt, password),
+    )
+
+
+def is_correct_recovery_code(credentials, recovery_code: str) -> bool:
+    """Check the recovery code against user's credentials.
+
+    `credentials` should have "recovery_code_hash" and
+    "recovery_code_hash_bin" attributes, or be `None`.
+    """
+    if credentials is None:
+        return False
+    if credentials.recovery_code_hash_bin is not None:
+        return hmac.compare_digest(
+            credentials.recovery_code_hash_bin,
+            calc_crypt_hash_bytes(b"", recovery_code),
+        )
+    return hmac.compare_digest(
+        credentials.recovery_code_hash,
+        calc_crypt_hash("", recovery_code),
+    )
 
 
 def calc_sha256(computer_code: str) -> str:
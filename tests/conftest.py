@@ -48,6 +48,9 @@ def db_session(app):
         "TRUNCATE TABLE user_registration",
         "TRUNCATE TABLE activate_user_signal",
         "TRUNCATE TABLE deactivate_user_signal",
+        "TRUNCATE TABLE email_signal",
+        "TRUNCATE TABLE reserved_user_id",
+        "TRUNCATE TABLE registered_user_id",
     ]:
         db.session.execute(sqlalchemy.text(cmd))
     db.session.commit()
@@ -0,0 +1,42 @@
+from unittest.mock import Mock
+from swpt_login import api_requests_session as ars
+from swpt_login.extensions import redis_store
+
+
+def test_shared_access_token(app):
+    key, _ = ars._get_shared_access_token_keys()
+    redis_store.delete(key)
+    obtain_new_access_token = Mock(
+        return_value={"access_token": "token1", "expires_in": 3600}
+    )
+
+    assert ars._load_shared_access_token(obtain_new_access_token) == (
+        "token1",
+        True,
+    )
+    assert ars._load_shared_access_token(obtain_new_access_token) == (
+        "token1",
+        False,
+    )
+    obtain_new_access_token.assert_called_once()
+    assert 0 < redis_store.ttl(key) <= 3600
+
+    ars._invalidate_shared_access_token("wrong_token")
+    assert redis_store.get(key) == "token1"
+
+    ars._invalidate_shared_access_token("token1")
+    assert redis_store.get(key) is None
+
+
+def test_shared_access_token_expires_soon(app):
+    key, _ = ars._get_shared_access_token_keys()
+    redis_store.delete(key)
+    obtain_new_access_token = Mock(
+        return_value={"access_token": "token2", "expires_in": 10}
+    )
+
+    assert ars._load_shared_access_token(obtain_new_access_token) == (
+        "token2",
+        True,
+    )
+    assert redis_store.get(key) is None
@@ -231,11 +231,13 @@ def test_suspend_user_registrations(mocker, app, db_session):
     assert users[0].status == 1
     assert users[1].user_id == "5678"
     assert users[1].status == 1
+    # NOTE: Credentials are invalidated concurrently.
     invalidate_credentials.assert_has_calls(
         [
             call("1234"),
             call("5678"),
-        ]
+        ],
+        any_order=True,
     )
 
     runner = app.test_cli_runner()
@@ -285,3 +287,179 @@ def test_ban_ip_addresses(app):
         assert redis.increment_key_with_limit("ip:1.2.3.130", 100000)
 
     redis.increment_key_with_limit("ip:1.1.1.1", 100000)
+
+
+def test_suspend_user_registrations_from_file(mocker, app, db_session, tmp_path):
+    invalidate_credentials = Mock(side_effect=[None, RuntimeError("failed")])
+    mocker.patch("swpt_login.cli.invalidate_credentials", invalidate_credentials)
+
+    for user_id in ["1234", "5678"]:
+        db_session.add(
+            m.UserRegistration(
+                user_id=user_id,
+                email=f"user{user_id}@example.com",
+                salt="",
+                password_hash="x",
+                recovery_code_hash="y",
+            )
+        )
+    db_session.commit()
+
+    emails_file = tmp_path / "emails.txt"
+    emails_file.write_text(
+        "user9999@example.com\nuser1234@example.com\n\nuser5678@example.com\n"
+    )
+    checkpoint = tmp_path / "checkpoint"
+    checkpoint.write_text("1\n")
+    failures = tmp_path / "failures.txt"
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_login",
+            "suspend_user_registrations",
+            "--file", str(emails_file),
+            "--batch-size", "1",
+            "--concurrency", "1",
+            "--checkpoint", str(checkpoint),
+            "--failures", str(failures),
+        ]
+    )
+    assert result.exit_code == 0
+    assert not checkpoint.exists()
+    assert failures.read_text() == "user5678@example.com\n"
+    invalidate_credentials.assert_has_calls([call("1234"), call("5678")])
+    assert all(u.status == 1 for u in m.UserRegistration.query.all())
+
+
+def test_dead_signals(mocker, app, db_session):
+    class RequestSessionMock:
+        post = Mock(return_value=Response(500))
+
+    requests_session = RequestSessionMock()
+    mocker.patch("swpt_login.models.requests_session", requests_session)
+    mocker.patch.dict(app.config, {"APP_SIGNAL_MAX_ATTEMPTS": 2})
+    db.session.add(m.DeactivateUserSignal(user_id="123"))
+    db.session.commit()
+
+    runner = app.test_cli_runner()
+    args = ["swpt_login", "flush", "--wait", "0.1", "--quit-early"]
+    runner.invoke(args=args)
+    signal = m.DeactivateUserSignal.query.one()
+    assert signal.attempts == 1
+    assert signal.dead_at is None
+    assert signal.next_attempt_at > signal.inserted_at
+
+    signal.next_attempt_at = signal.inserted_at
+    db.session.commit()
+    runner.invoke(args=args)
+    signal = m.DeactivateUserSignal.query.one()
+    assert signal.attempts == 2
+    assert signal.dead_at is not None
+    assert "500" in signal.last_error
+    db.session.commit()
+
+    result = runner.invoke(args=["swpt_login", "list_dead_signals"])
+    assert result.exit_code == 0
+    assert "DeactivateUserSignal(123)" in result.output
+
+    result = runner.invoke(args=["swpt_login", "requeue_dead_signals"])
+    assert result.exit_code == 0
+    assert "Dead EmailSignal tasks can not be requeued" in result.output
+    signal = m.DeactivateUserSignal.query.one()
+    assert signal.attempts == 0
+    assert signal.dead_at is None
+    db.session.commit()
+
+    signal.dead_at = signal.inserted_at
+    db.session.commit()
+    result = runner.invoke(args=["swpt_login", "purge_dead_signals"])
+    assert result.exit_code == 0
+    assert "1 dead DeactivateUserSignal tasks have been purged." in result.output
+    assert m.DeactivateUserSignal.query.count() == 0
+
+
+def test_export_import_users(app, db_session, tmp_path):
+    for user_id in ["1234", "5678"]:
+        db_session.add(
+            m.UserRegistration(
+                user_id=user_id,
+                email=f"user{user_id}@example.com",
+                salt="",
+                password_hash="x",
+                recovery_code_hash="y",
+            )
+        )
+    db_session.commit()
+
+    exported = tmp_path / "users.csv"
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["swpt_login", "export_users", str(exported)])
+    assert result.exit_code == 0
+    lines = exported.read_text().splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith("email,user_id,")
+
+    m.UserRegistration.query.filter_by(user_id="5678").delete()
+    db_session.commit()
+    with exported.open("a") as f:
+        f.write("invalid-email,9999,,x,y,,,\n")
+
+    report = tmp_path / "report.csv"
+    result = runner.invoke(
+        args=["swpt_login", "import_users", "--report", str(report), str(exported)]
+    )
+    assert result.exit_code == 0
+    assert "Imported 1 user registrations." in result.output
+    assert "Skipped 1 rows (email already registered)." in result.output
+    assert "Skipped 1 rows (invalid email)." in result.output
+    assert report.read_text().splitlines()[1:] == [
+        "invalid-email,9999,invalid email",
+        "user1234@example.com,1234,email already registered",
+    ]
+
+    users = m.UserRegistration.query.order_by(m.UserRegistration.user_id).all()
+    assert [u.user_id for u in users] == ["1234", "5678"]
+    assert m.RegisteredUserId.query.one().user_id == "5678"
+
+
+def test_verify_consistency(mocker, app, db_session, tmp_path):
+    class RequestSessionMock:
+        def get(self, url, **kwargs):
+            if url.endswith("/1234/"):
+                return Response(200)
+            if url.endswith("/5678/"):
+                return Response(404)
+            return Response(500)
+
+    mocker.patch("swpt_login.consistency.requests_session", RequestSessionMock())
+
+    for user_id in ["1234", "5678", "9999"]:
+        db_session.add(
+            m.UserRegistration(
+                user_id=user_id,
+                email=f"user{user_id}@example.com",
+                salt="",
+                password_hash="x",
+                recovery_code_hash="y",
+            )
+        )
+    db_session.commit()
+
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text('{"0": "user1234@example.com"}')
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_login",
+            "verify_consistency",
+            "--rate", "0",
+            "--checkpoint", str(checkpoint),
+        ]
+    )
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "user5678@example.com,5678,missing",
+        "user9999@example.com,9999,unknown",
+    ]
+    assert not checkpoint.exists()
@@ -1,3 +1,4 @@
+import pytest
 from swpt_login import emails
 from dataclasses import dataclass
 from unittest.mock import Mock
@@ -44,6 +45,62 @@ def test_email_sending(app):
         emails.send_delete_account_email(email, link, link)
 
 
+def test_email_outbox(mocker, app, db_session):
+    import smtplib
+    from swpt_login.models import EmailSignal
+
+    mail = FakeMail()
+    mail.send = Mock()
+    mocker.patch("swpt_login.models.mail", mail)
+    email = "test@example.com"
+    link = "http://example.com"
+
+    app.config["MAIL_USE_OUTBOX"] = True
+    try:
+        with app.test_request_context():
+            emails.send_change_password_email(email, link)
+            emails.send_verification_code_email(email, "123456", "Mozilla", link)
+    finally:
+        app.config["MAIL_USE_OUTBOX"] = False
+
+    # Only the verification code has been sent immediately.
+    assert mail.send.call_count == 1
+    assert "123456" in mail.send.call_args[0][0].body
+    signals = EmailSignal.query.all()
+    assert len(signals) == 1
+    assert signals[0].recipient == email
+    assert signals[0].html is not None
+
+    mail.send.side_effect = smtplib.SMTPServerDisconnected("disconnected")
+    processed, failures = EmailSignal.process_signals(signals)
+    assert processed == []
+    assert isinstance(failures[0][1], EmailSignal.SendingError)
+    db_session.rollback()
+
+    mail.send.side_effect = None
+    processed, failures = EmailSignal.process_signals(EmailSignal.query.all())
+    assert len(processed) == 1
+    assert failures == []
+    assert mail.send.call_count == 3
+    db_session.rollback()
+
+    # Messages which have failed too many times are redacted.
+    signal = EmailSignal.query.one()
+    signal.attempts = app.config["APP_SIGNAL_MAX_ATTEMPTS"] - 1
+    EmailSignal.schedule_retry(signal, RuntimeError("error"))
+    db_session.commit()
+    signal = EmailSignal.query.one()
+    assert signal.dead_at is not None
+    assert signal.body == "" and signal.html is None
+    assert signal.recipient == email
+
+    with pytest.raises(RuntimeError):
+        EmailSignal.requeue_dead()
+    assert EmailSignal.purge_dead() == 1
+    db_session.commit()
+    assert EmailSignal.query.count() == 0
+
+
 def test_text_to_html_document(app):
     from swpt_login.emails import text_to_html_document
 
@@ -0,0 +1,108 @@
+from swpt_login.flushing import (
+    FlushScheduler,
+    SignalListener,
+    FlushSupervisor,
+    FlushStats,
+    read_flush_stats,
+    clear_flush_stats,
+)
+
+
+def test_flush_scheduler():
+    scheduler = FlushScheduler(min_wait=1.0, max_wait=5.0)
+    assert scheduler.get_next_wait(10, full=True) == 0.0
+    assert scheduler.get_next_wait(25) == 1.0
+    assert scheduler.get_next_wait(2, full=True) == 0.0
+    assert scheduler.get_next_wait(3) == 1.0
+    assert scheduler.get_next_wait(0) == 2.0
+    assert scheduler.get_next_wait(0) == 4.0
+    assert scheduler.get_next_wait(0) == 5.0
+    assert scheduler.get_next_wait(0) == 5.0
+    assert scheduler.get_next_wait(1) == 1.0
+    assert scheduler.get_next_wait(10, full=True) == 0.0
+    assert scheduler.get_next_wait(0) == 1.0
+
+
+def test_signal_listener(app, db_session):
+    from swpt_login import models as m
+
+    listener = SignalListener([m.ActivateUserSignal])
+    listener.start()
+    try:
+        m.ActivateUserSignal.notify_flush_workers()
+        db_session.commit()
+        assert listener.wait(5.0)
+        assert not listener.wait(0.01)
+    finally:
+        listener.close()
+
+
+def test_flush_supervisor_desired_processes():
+    supervisor = FlushSupervisor(
+        models_to_flush=[],
+        wait=1.0,
+        max_wait=5.0,
+        min_processes=2,
+        max_processes=6,
+        rows_per_process=100,
+        check_period=5.0,
+    )
+    assert supervisor.get_desired_processes(0) == 2
+    assert supervisor.get_desired_processes(250) == 3
+    assert supervisor.get_desired_processes(600) == 6
+    assert supervisor.get_desired_processes(100000) == 6
+
+
+def test_flush_stats(app):
+    from swpt_login import models as m
+    from swpt_login.extensions import redis_store
+
+    stats = FlushStats([m.DeactivateUserSignal])
+    stats.record(
+        m.DeactivateUserSignal,
+        3,
+        [
+            (None, m.DeactivateUserSignal.SendingError("error", 500)),
+            (None, m.DeactivateUserSignal.SendingError("connection problem")),
+        ],
+    )
+    stats.publish(force=True)
+    key = f"flushstats:deactivate_user_signal:{stats.worker_id}"
+    try:
+        data = redis_store.hgetall(key)
+        assert data["processed"] == "3"
+        assert data["failed"] == "2"
+        assert data["errors:500"] == "1"
+        assert data["errors:connection"] == "1"
+        assert float(data["error_rate:500"]) > 0.0
+        assert float(data["rate"]) > 0.0
+        assert read_flush_stats("deactivate_user_signal")[stats.worker_id] == data
+    finally:
+        clear_flush_stats("deactivate_user_signal")
+    assert redis_store.exists(key) == 0
+
+
+def test_shard_leases(app):
+    from swpt_login import models as m
+    from swpt_login.extensions import redis_store
+    from swpt_login.flushing import ShardLeases
+
+    leases1 = ShardLeases([m.DeactivateUserSignal], 4)
+    leases2 = ShardLeases([m.DeactivateUserSignal], 4)
+    leases2.worker_id += ":2"
+    try:
+        assert len(leases1.update()) == 4
+        assert leases2.update() == []
+        assert len(leases1.update()) == 2
+        shards2 = leases2.update()
+        assert shards2 == [2, 3]
+        assert leases1.update() == [0, 1]
+
+        leases1.release_all()
+        assert redis_store.zrange(leases1.workers_key, 0, -1) == [leases2.worker_id]
+        assert len(leases2.update()) == 4
+    finally:
+        leases1.release_all()
+        leases2.release_all()
+
+    assert ShardLeases([m.DeactivateUserSignal], 1).update() is None
@@ -1,9 +1,12 @@
+import base64
 from swpt_login import models as m
+from swpt_login.extensions import db
 
 
 def test_sibnalbus_burst_count(app):
     assert isinstance(m.DeactivateUserSignal.signalbus_burst_count, int)
     assert isinstance(m.ActivateUserSignal.signalbus_burst_count, int)
+    assert isinstance(m.EmailSignal.signalbus_burst_count, int)
 
 
 def test_user_registration(db_session):
@@ -23,3 +26,222 @@ def test_user_registration(db_session):
     assert ur.salt == "abcd"
     assert ur.password_hash == "1234"
     assert ur.recovery_code_hash == "7890"
+
+
+def test_user_registration_changes(app, db_session):
+    db_session.add(
+        m.UserRegistration(
+            user_id="1",
+            email="email@example.com",
+            salt="abcd",
+            password_hash="1234",
+            recovery_code_hash="7890",
+        )
+    )
+    db_session.commit()
+
+    assert m.UserRegistration.change_password("email@example.com", "efgh", "5678") == "1"
+    assert m.UserRegistration.change_recovery_code_hash("email@example.com", "0000") == "1"
+    db_session.commit()
+    ur = m.UserRegistration.query.one()
+    assert ur.salt == "efgh"
+    assert ur.password_hash == "5678"
+    assert ur.recovery_code_hash == "0000"
+
+    assert m.UserRegistration.delete_verified("email@example.com", "1234") is None
+    assert m.UserRegistration.query.count() == 1
+    assert m.UserRegistration.delete_verified("email@example.com", "5678") == "1"
+    db_session.commit()
+    assert m.UserRegistration.query.count() == 0
+
+
+def test_convert_hashes(app, db_session):
+    for i, salt in enumerate(["salt", "$method$salt"]):
+        db_session.add(
+            m.UserRegistration(
+                user_id=str(i),
+                email=f"email{i}@example.com",
+                salt=salt,
+                password_hash="1234",
+                recovery_code_hash="7890",
+            )
+        )
+    db_session.commit()
+
+    with db.engine.begin() as connection:
+        last_email = m.UserRegistration.convert_hashes(connection, "", 10)
+        assert last_email == "email1@example.com"
+        assert m.UserRegistration.convert_hashes(connection, last_email, 10) is None
+
+    ur0, ur1 = m.UserRegistration.query.order_by(m.UserRegistration.user_id).all()
+    assert ur0.salt is None and ur0.salt_bin == base64.b64decode("salt")
+    assert ur0.password_hash is None and ur0.password_hash_bin == base64.b64decode("1234")
+    assert ur0.recovery_code_hash is None
+    assert ur0.recovery_code_hash_bin == base64.b64decode("7890")
+    assert ur1.salt == "$method$salt" and ur1.password_hash == "1234"
+    assert ur1.recovery_code_hash is None
+    db_session.commit()
+
+    with db.engine.begin() as connection:
+        m.UserRegistration.convert_hashes(connection, "", 10, to_binary=False)
+
+    ur0, ur1 = m.UserRegistration.query.order_by(m.UserRegistration.user_id).all()
+    assert ur0.salt == "salt" and ur0.password_hash == "1234"
+    assert ur0.salt_bin is None and ur0.password_hash_bin is None
+    assert ur1.recovery_code_hash == "7890" and ur1.recovery_code_hash_bin is None
+
+
+def test_store_binary_hashes(app, db_session):
+    db_session.add(
+        m.UserRegistration(
+            user_id="1",
+            email="email@example.com",
+            salt="abcd",
+            password_hash="1234",
+            recovery_code_hash="7890",
+        )
+    )
+    db_session.commit()
+
+    app.config["STORE_BINARY_HASHES"] = True
+    try:
+        m.UserRegistration.change_password("email@example.com", "efgh", "5678")
+        m.UserRegistration.change_recovery_code_hash("email@example.com", "0000")
+        db_session.commit()
+        ur = m.UserRegistration.query.one()
+        assert ur.salt is None and ur.salt_bin == base64.b64decode("efgh")
+        assert ur.password_hash is None
+        assert ur.password_hash_bin == base64.b64decode("5678")
+        assert ur.recovery_code_hash is None
+        assert ur.recovery_code_hash_bin == base64.b64decode("0000")
+
+        # Salts which specify a non-default hashing method are stored
+        # Base64 encoded.
+        m.UserRegistration.change_password("email@example.com", "$method$salt", "1234")
+        db_session.commit()
+        ur = m.UserRegistration.query.one()
+        assert ur.salt == "$method$salt" and ur.password_hash == "1234"
+        assert ur.salt_bin is None and ur.password_hash_bin is None
+    finally:
+        app.config["STORE_BINARY_HASHES"] = False
+
+
+def test_reserved_user_id(db_session, current_ts):
+    from datetime import timedelta
+
+    db_session.add(
+        m.ReservedUserId(
+            user_id="1",
+            reservation_id="r1",
+            valid_until=current_ts + timedelta(hours=1),
+        )
+    )
+    db_session.add(
+        m.ReservedUserId(
+            user_id="2",
+            reservation_id="r2",
+            valid_until=current_ts + timedelta(hours=2),
+        )
+    )
+    db_session.commit()
+    assert m.ReservedUserId.count() == 2
+
+    assert m.ReservedUserId.claim(current_ts + timedelta(minutes=90)) == ("2", "r2")
+    assert m.ReservedUserId.claim(current_ts + timedelta(minutes=90)) is None
+    db_session.commit()
+    assert m.ReservedUserId.count() == 1
+
+    assert m.ReservedUserId.delete_expiring(current_ts + timedelta(minutes=90)) == 1
+    db_session.commit()
+    assert m.ReservedUserId.count() == 0
+
+
+def test_process_signals(mocker, app, db_session):
+    from dataclasses import dataclass
+    from unittest.mock import Mock
+
+    @dataclass
+    class Response:
+        status_code: int
+
+    def post(url, **kwargs):
+        return Response(500 if "/2/" in url else 204)
+
+    requests_session = Mock()
+    requests_session.post = Mock(side_effect=post)
+    mocker.patch("swpt_login.models.requests_session", requests_session)
+
+    for user_id in ["1", "2", "3"]:
+        db_session.add(m.DeactivateUserSignal(user_id=user_id))
+    db_session.commit()
+
+    signals = m.DeactivateUserSignal.query.order_by(
+        m.DeactivateUserSignal.user_id
+    ).all()
+    processed, failures = m.DeactivateUserSignal.process_signals(signals)
+    assert requests_session.post.call_count == 3
+    assert [obj.user_id for obj in processed] == ["1", "3"]
+    assert len(failures) == 1
+    obj, error = failures[0]
+    assert obj.user_id == "2"
+    assert isinstance(error, m.DeactivateUserSignal.SendingError)
+    assert error.status_code == 500
+    db_session.rollback()
+
+
+def test_activate_users_burst(mocker, app, db_session):
+    from dataclasses import dataclass
+    from unittest.mock import Mock
+
+    @dataclass
+    class Response:
+        status_code: int
+
+    requests_session = Mock()
+    requests_session.post = Mock(return_value=Response(200))
+    mocker.patch("swpt_login.models.requests_session", requests_session)
+
+    def create_signal(user_id, email):
+        return m.ActivateUserSignal(
+            user_id=user_id,
+            reservation_id="reservation" + user_id,
+            email=email,
+            salt="salt",
+            password_hash="hash",
+            recovery_code_hash="recovery_code_hash",
+        )
+
+    db_session.add(
+        m.UserRegistration(
+            user_id="9",
+            email="existing@example.com",
+            salt="salt",
+            password_hash="hash",
+            recovery_code_hash="recovery_code_hash",
+        )
+    )
+    db_session.add(create_signal("1", "user1@example.com"))
+    db_session.add(create_signal("2", "existing@example.com"))
+    db_session.add(create_signal("3", "user3@example.com"))
+    db_session.add(create_signal("4", "user1@example.com"))
+    db_session.add(create_signal("9", "user9@example.com"))
+    db_session.commit()
+
+    signals = m.ActivateUserSignal.query.order_by(
+        m.ActivateUserSignal.user_id
+    ).all()
+    processed, failures = m.ActivateUserSignal.process_signals(signals)
+    assert [obj.user_id for obj in processed] == ["1", "2", "3", "4"]
+    assert len(failures) == 1
+    obj, error = failures[0]
+    assert obj.user_id == "9"
+    assert isinstance(error, RuntimeError)
+    assert sorted(
+        (r.email, r.user_id) for r in m.UserRegistration.query.all()
+    ) == [
+        ("existing@example.com", "9"),
+        ("user1@example.com", "1"),
+        ("user3@example.com", "3"),
+    ]
+    assert sorted(r.user_id for r in m.RegisteredUserId.query.all()) == ["1", "3"]
+    db_session.rollback()
@@ -411,3 +411,31 @@ def test_user_logins_history(app):
     assert not ulh.contains("3")
     assert not ulh.contains("4")
     assert not ulh.contains("5")
+
+
+def test_empty_user_id_pool_warning(mocker, app, db_session, caplog, current_ts):
+    from datetime import timedelta
+
+    mocker.patch(
+        "swpt_login.redis.reserve_user_id", return_value=("1", "r1", None)
+    )
+    mocker.patch.dict(app.config, {"USER_ID_POOL_SIZE": 10})
+    mocker.patch("swpt_login.redis._user_id_pool_misses", 0)
+
+    # The warning is logged only once, while the pool is empty.
+    for _ in range(3):
+        assert redis._claim_user_id() == ("1", "r1")
+    assert caplog.text.count("The pool of pre-reserved user IDs is empty.") == 1
+    assert redis._user_id_pool_misses == 3
+
+    db_session.add(
+        m.ReservedUserId(
+            user_id="2",
+            reservation_id="r2",
+            valid_until=current_ts + timedelta(days=1),
+        )
+    )
+    db_session.flush()
+    assert redis._claim_user_id() == ("2", "r2")
+    assert redis._user_id_pool_misses == 0
+    db_session.rollback()
@@ -0,0 +1,106 @@
+from collections import Counter
+from swpt_login.replicas import ReplicaRouter, get_replicas, execute_on_replica
+
+
+def test_get_replicas():
+    config = {
+        "POSTGRES_REPLICA_URLS": "postgresql://r1/db postgresql://r2/db",
+        "POSTGRES_REPLICA_WEIGHTS": "3",
+        "POSTGRES_REPLICA_URL": "",
+        "SQLALCHEMY_DATABASE_URI": "postgresql://primary/db",
+    }
+    assert get_replicas(config) == [
+        ("replica", "postgresql://r1/db", 3),
+        ("replica_1", "postgresql://r2/db", 1),
+    ]
+
+    config["POSTGRES_REPLICA_URLS"] = ""
+    assert get_replicas(config) == [("replica", "postgresql://primary/db", 1)]
+
+
+def test_weighted_round_robin():
+    router = ReplicaRouter([("a", 3), ("b", 1)], eject_seconds=30.0)
+    chosen = Counter(router.choose()[0] for _ in range(400))
+    assert chosen == {"a": 300, "b": 100}
+    assert sorted(router.choose()) == ["a", "b"]
+
+    router.eject("a")
+    assert router.choose() == ["b"]
+    router.eject("b")
+    assert router.choose() == []
+
+
+def test_replica_lag():
+    router = ReplicaRouter(
+        [("a", 1), ("b", 1)],
+        eject_seconds=30.0,
+        max_lag_seconds=10.0,
+        lag_check_seconds=0.0,
+    )
+    router.check_lags(lambda k: 100.0 if k == "a" else 0.0)
+    assert router.choose() == ["b"]
+
+    router.check_lags(lambda k: 0.0 if k == "a" else None)
+    assert router.choose() == ["a"]
+
+
+def test_replica_lag_in_background():
+    import time
+    import threading
+
+    router = ReplicaRouter(
+        [("a", 1), ("b", 1)],
+        eject_seconds=30.0,
+        max_lag_seconds=10.0,
+        lag_check_seconds=0.0,
+    )
+    release = threading.Event()
+
+    def measure_lag(bind_key):
+        release.wait()
+        return 100.0 if bind_key == "a" else 0.0
+
+    # The checks do not block the caller, and only one check runs at
+    # a time.
+    router.start_lag_checks(measure_lag)
+    router.start_lag_checks(measure_lag)
+    assert sorted(router.choose()) == ["a", "b"]
+
+    release.set()
+    while router.checking_lags:
+        time.sleep(0.01)
+    assert router.choose() == ["b"]
+
+
+def test_execute_on_replica(app, db_session):
+    from sqlalchemy import text
+
+    assert execute_on_replica(text("SELECT :x"), {"x": 1}).scalar() == 1
+
+
+def test_read_your_writes(app, db_session):
+    from flask import g
+    from sqlalchemy import text
+    from swpt_login import replicas
+
+    with app.test_request_context():
+        with db_session.get_bind().connect() as connection:
+            g.swpt_login_write_lsn = str(
+                connection.execute(text("SELECT pg_current_wal_lsn()")).scalar()
+            )
+
+        # The primary database is always up-to-date.
+        assert execute_on_replica(text("SELECT 1")).scalar() == 1
+
+        response = replicas._set_lsn_cookie(app.response_class())
+        cookie = response.headers["Set-Cookie"]
+        assert cookie.startswith(app.config["LSN_COOKIE_NAME"] + "=")
+
+    value = cookie.split(";")[0].split("=", 1)[1]
+    headers = {"Cookie": f"{app.config['LSN_COOKIE_NAME']}={value}"}
+    with app.test_request_context(headers=headers):
+        assert replicas._get_min_lsn() is not None
+
+    headers = {"Cookie": f"{app.config['LSN_COOKIE_NAME']}=forged"}
+    with app.test_request_context(headers=headers):
+        assert replicas._get_min_lsn() is None
@@ -662,3 +662,49 @@ def test_login_inactive_account(mocker, client, app, db_session):
 def test_healthz(client, app):
     r = client.get("/login/healthz")
     assert r.status_code == 200
+
+
+def test_http_pools_metrics(client, app):
+    r = client.get("/login/metrics/http-pools")
+    assert r.status_code == 404
+
+    app.config["APP_EXPOSE_METRICS"] = True
+    try:
+        r = client.get("/login/metrics/http-pools")
+        assert r.status_code == 200
+        assert isinstance(r.get_json(), list)
+    finally:
+        app.config["APP_EXPOSE_METRICS"] = False
+
+
+def test_db_pools_metrics(client, app, db_session):
+    r = client.get("/login/metrics/db-pools")
+    assert r.status_code == 404
+
+    app.config["APP_EXPOSE_METRICS"] = True
+    try:
+        r = client.get("/login/metrics/db-pools")
+        assert r.status_code == 200
+        stats = r.get_json()
+        assert isinstance(stats, list)
+        primary = next(s for s in stats if s["bind"] == "primary")
+        assert primary["checkouts"] >= 1
+        assert primary["checkout_timeouts"] == 0
+    finally:
+        app.config["APP_EXPOSE_METRICS"] = False
+
+
+def test_signals_metrics(client, app, db_session):
+    r = client.get("/login/metrics/signals")
+    assert r.status_code == 404
+
+    app.config["APP_EXPOSE_METRICS"] = True
+    try:
+        r = client.get("/login/metrics/signals")
+        assert r.status_code == 200
+        metrics = r.get_json()
+        assert metrics["ActivateUserSignal"]["oldest_age_seconds"] == 0.0
+        assert "processed_per_second" in metrics["DeactivateUserSignal"]
+        assert "errors_per_second" in metrics["DeactivateUserSignal"]
+    finally:
+        app.config["APP_EXPOSE_METRICS"] = False
@@ -0,0 +1,144 @@
+from sqlalchemy import select, update, literal, text
+from swpt_login import models as m
+from swpt_login.sharding import (
+    get_shard_number,
+    get_shard_number_expression,
+    get_shard_binds,
+    is_sharded,
+    execute_on_shard,
+)
+
+
+def test_get_shard_binds():
+    config = {
+        "POSTGRES_SHARD_URLS": "postgresql://s0/db postgresql://s1/db",
+        "POSTGRES_NEXT_SHARD_URLS": "",
+    }
+    binds = get_shard_binds(config, {"pool_size": 5})
+    assert binds == {
+        "shard_0": {"url": "postgresql://s0/db", "pool_size": 5},
+        "shard_1": {"url": "postgresql://s1/db", "pool_size": 5},
+    }
+
+
+def test_shard_number_expression(app, db_session):
+    for email in ["user1@example.com", "user2@example.com", "Юзер@пример.бг"]:
+        for shard_count in [1, 2, 3, 16]:
+            shard_number = db_session.execute(
+                select(get_shard_number_expression(literal(email), shard_count))
+            ).scalar()
+            assert shard_number == get_shard_number(email, shard_count)
+            assert 0 <= shard_number < shard_count
+
+
+def test_execute_on_shard(app, db_session):
+    assert not is_sharded()
+    db_session.add(
+        m.UserRegistration(
+            user_id="1234",
+            email="user1234@example.com",
+            salt="",
+            password_hash="x",
+            recovery_code_hash="y",
+        )
+    )
+    db_session.commit()
+
+    query = select(m.UserRegistration.user_id).where(
+        m.UserRegistration.email == "user1234@example.com"
+    )
+    assert execute_on_shard("user1234@example.com", query).scalar() == "1234"
+    assert (
+        execute_on_shard("user1234@example.com", query, read_only=True).scalar()
+        == "1234"
+    )
+
+
+def test_reshard_registrations_keeps_double_writes(mocker, app, db_session):
+    from swpt_login import sharding
+    from swpt_login.extensions import db
+
+    # The next shard is simulated by a copy of the `user_registration`
+    # table, in another schema.
+    db_session.execute(text("DROP SCHEMA IF EXISTS next_shard CASCADE"))
+    db_session.execute(text("CREATE SCHEMA next_shard"))
+    db_session.execute(
+        text(
+            "CREATE TABLE next_shard.user_registration"
+            " (LIKE public.user_registration INCLUDING ALL)"
+        )
+    )
+    db_session.commit()
+    next_engine = db.engine.execution_options(
+        schema_translate_map={None: "next_shard"}
+    )
+    mocker.patch(
+        "swpt_login.sharding.get_next_shard_engines", return_value=[next_engine]
+    )
+
+    for user_id in ["1", "2"]:
+        db_session.add(
+            m.UserRegistration(
+                user_id=user_id,
+                email=f"user{user_id}@example.com",
+                salt="",
+                password_hash="old",
+                recovery_code_hash="y",
+            )
+        )
+    db_session.commit()
+
+    # The password is changed (and double-written to the next shard)
+    # after the batch has been read, but before it has been written.
+    get_shard_number = sharding.get_shard_number
+    changed = False
+
+    def change_password_after_read(email, shard_count):
+        nonlocal changed
+        if not changed:
+            changed = True
+            with db.engine.begin() as connection:
+                connection.execute(
+                    update(m.UserRegistration)
+                    .where(m.UserRegistration.email == "user1@example.com")
+                    .values(password_hash="new")
+                )
+            sharding.sync_to_next_shard("user1@example.com")
+        return get_shard_number(email, shard_count)
+
+    mocker.patch(
+        "swpt_login.sharding.get_shard_number",
+        side_effect=change_password_after_read,
+    )
+
+    try:
+        assert sharding.reshard_registrations(1000) == (2, 0)
+        with next_engine.connect() as connection:
+            rows = connection.execute(
+                select(m.UserRegistration.email, m.UserRegistration.password_hash)
+                .order_by(m.UserRegistration.email)
+            ).all()
+        assert rows == [("user1@example.com", "new"), ("user2@example.com", "old")]
+    finally:
+        db_session.rollback()
+        db_session.execute(text("DROP SCHEMA next_shard CASCADE"))
+        db_session.commit()
+
+
+def test_register_user_ids(app, db_session):
+    from swpt_login.sharding import register_user_ids
+
+    db_session.add(
+        m.UserRegistration(
+            user_id="1234",
+            email="user1234@example.com",
+            salt="",
+            password_hash="x",
+            recovery_code_hash="y",
+        )
+    )
+    db_session.commit()
+
+    assert register_user_ids(1000) == 1
+    assert register_user_ids(1000) == 0
+    assert m.RegisteredUserId.query.one().user_id == "1234"
@@ -1,5 +1,6 @@
 import pytest
 import base64
+from types import SimpleNamespace
 from swpt_login import utils
 
 
@@ -78,6 +79,46 @@ def test_calc_crypt_hash():
         utils.calc_crypt_hash("salt", "too_long" * 1000)
 
 
+def test_is_correct_password():
+    salt_bin = base64.b64decode("salt")
+    password_hash_bin = utils.calc_crypt_hash_bytes(salt_bin, "password")
+    assert password_hash_bin == base64.b64decode(
+        "QgiDbOU4LtyTKpfVGGRkaInIx2UxtoKai1g3W4d6U7I="
+    )
+
+    text_credentials = SimpleNamespace(
+        salt="salt",
+        password_hash="QgiDbOU4LtyTKpfVGGRkaInIx2UxtoKai1g3W4d6U7I=",
+        salt_bin=None,
+        password_hash_bin=None,
+    )
+    binary_credentials = SimpleNamespace(
+        salt=None,
+        password_hash=None,
+        salt_bin=salt_bin,
+        password_hash_bin=password_hash_bin,
+    )
+    for credentials in [text_credentials, binary_credentials]:
+        assert utils.is_correct_password(credentials, "password")
+        assert not utils.is_correct_password(credentials, "wrong password")
+
+
+def test_is_correct_recovery_code():
+    recovery_code_hash = utils.calc_crypt_hash("", "code")
+    assert utils.is_correct_recovery_code(
+        SimpleNamespace(recovery_code_hash=recovery_code_hash, recovery_code_hash_bin=None),
+        "code",
+    )
+    assert utils.is_correct_recovery_code(
+        SimpleNamespace(
+            recovery_code_hash=None,
+            recovery_code_hash_bin=base64.b64decode(recovery_code_hash),
+        ),
+        "code",
+    )
+    assert not utils.is_correct_recovery_code(None, "code")
+
+
 def test_calc_sha256():
     sha256 = utils.calc_sha256("123")
     assert isinstance(sha256, str)